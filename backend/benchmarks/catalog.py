@@ -0,0 +1,146 @@
+"""
+Seeded synthetic catalog generator.
+Produces realistic product listings: category-specific titles and
+descriptions, log-normal prices per category and a skewed seller
+distribution where a few sellers own most listings. The same seed always
+produces the same catalog.
+Usage: python -m benchmarks.catalog --count N [--seed S] (--output FILE | --load)
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import orjson
+import core.config
+import core.database
+import core.product
+
+# category: (nouns, median price, price spread)
+CATEGORIES = {
+    "furniture": (("chair", "table", "desk", "sofa", "bookshelf", "stool", "dresser", "bench"), 120.0, 0.8),
+    "lighting": (("lamp", "lantern", "chandelier", "sconce", "pendant"), 45.0, 0.7),
+    "clothing": (("jacket", "coat", "sweater", "dress", "jeans", "scarf", "boots"), 35.0, 0.6),
+    "decor": (("vase", "mirror", "rug", "frame", "clock", "planter", "cushion"), 25.0, 0.7),
+    "sports": (("bicycle", "skateboard", "racket", "helmet", "tent", "kayak"), 90.0, 0.9),
+    "electronics": (("camera", "radio", "turntable", "speaker", "monitor", "keyboard"), 80.0, 1.0),
+    "kitchen": (("kettle", "teapot", "skillet", "blender", "grinder", "bowl"), 20.0, 0.6),
+    "music": (("guitar", "violin", "amplifier", "keyboard", "drum", "ukulele"), 150.0, 0.9),
+    "books": (("novel", "atlas", "cookbook", "encyclopedia", "comic"), 8.0, 0.5),
+}
+CATEGORY_WEIGHTS = (30, 10, 20, 12, 8, 8, 6, 3, 3)
+ADJECTIVES = (
+    "vintage", "retro", "classic", "modern", "antique", "handmade", "refurbished",
+    "rustic", "compact", "sturdy", "elegant", "minimalist", "restored", "rare",
+)
+MATERIALS = (
+    "oak", "walnut", "pine", "teak", "bamboo", "leather", "wool", "linen", "cotton",
+    "ceramic", "glass", "brass", "copper", "steel", "aluminium", "marble",
+)
+CONDITIONS = ("like new", "good condition", "lightly used", "well loved", "minor scratches", "fully working")
+# Distinct reference codes; each appears in about count / REFERENCE_CODES listings.
+REFERENCE_CODES = 10000
+
+def seller_email(index: int) -> str:
+    return f"seller{index}@catalog.example.com"
+
+def generate_listings(count: int, seed: int = 1, sellers: int | None = None):
+    """
+    Yields `count` listings deterministically for `seed`.
+    Seller i owns roughly (1 / i^0.8) of the catalog, so the first sellers
+    dominate as on a real marketplace.
+    """
+    rng = random.Random(seed)
+    sellers = sellers or max(count // 50, 1)
+    categories = list(CATEGORIES)
+    for i in range(count):
+        category = rng.choices(categories, CATEGORY_WEIGHTS)[0]
+        nouns, median, spread = CATEGORIES[category]
+        noun = rng.choice(nouns)
+        adjective = rng.choice(ADJECTIVES)
+        material = rng.choice(MATERIALS)
+        reference = f"ref{rng.randrange(REFERENCE_CODES)}"
+        seller = min(int(sellers * rng.random() ** 5), sellers - 1)
+        yield {
+            "product_id": f"p{seed}-{i:08d}",
+            "title": f"{adjective} {material} {noun}".title(),
+            "description": (
+                f"{adjective.capitalize()} {noun} made of {material}, {rng.choice(CONDITIONS)}. "
+                f"Pickup or shipping available. Item {reference}."
+            ),
+            "price": round(max(median * math.exp(rng.gauss(0, spread)), 1.0), 2),
+            "category": category,
+            "pictures": [f"https://cdn.example.com/{seed}/{i}/{n}.jpg" for n in range(rng.randint(1, 4))],
+            "seller_email": seller_email(seller),
+        }
+
+async def ndjson_chunks(listings, batch: int = 1000):
+    """
+    Encodes listings as NDJSON byte chunks for `import_listings`.
+    """
+    lines = []
+    for listing in listings:
+        lines.append(orjson.dumps(listing))
+        if len(lines) >= batch:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+async def load(
+        product_manager: core.product.ProductListingManager,
+        count: int,
+        seed: int = 1,
+        sellers: int | None = None,
+        batch_size: int = 1000
+    ):
+    """
+    Imports a generated catalog through the bulk import path, which also
+    builds the search index.
+    """
+    report = await product_manager.import_listings(
+        ndjson_chunks(generate_listings(count, seed, sellers)),
+        format="ndjson",
+        batch_size=batch_size
+    )
+    if report.failed:
+        raise RuntimeError(f"Catalog import failed: {report.errors[:3]}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic product catalog.")
+    parser.add_argument("--count", type=int, required=True)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--sellers", type=int, help="Defaults to one seller per 50 listings.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="Write NDJSON to this file ('-' for stdout).")
+    target.add_argument("--load", action="store_true", help="Import into the database in $ECOFINDS_CONFIG.")
+    args = parser.parse_args()
+    if args.output:
+        output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        try:
+            for listing in generate_listings(args.count, args.seed, args.sellers):
+                output.write(orjson.dumps(listing) + b"\n")
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        return
+    config = core.config.load_config(os.environ.get("ECOFINDS_CONFIG", "config.toml"))
+    db = core.database.connect(config.mongodb)
+    product_manager = core.product.ProductListingManager(
+        db=db,
+        config=config.search,
+        cache_config=config.listing_cache
+    )
+    async def load_and_close():
+        try:
+            return await load(product_manager, args.count, args.seed, args.sellers, config.ingest.batch_size)
+        finally:
+            await core.database.close(db)
+    report = asyncio.run(load_and_close())
+    print(f"Imported {report.inserted} listings.")
+
+if __name__ == "__main__":
+    main()
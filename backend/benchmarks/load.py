@@ -0,0 +1,300 @@
+"""
+Endpoint load test.
+Boots the app in-process against an in-memory database (or a throwaway
+database on a local mongod) with the fake SMS provider, replays a weighted
+mix of login, search, cart and profile traffic, and reports latency
+percentiles and throughput per route.
+Usage: python -m benchmarks.load [--duration S] [--concurrency N] [--output FILE]
+                                 [--baseline FILE] [--mongo-uri URI]
+Needs the packages in benchmarks/requirements.txt.
+"""
+
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmarks import catalog
+
+WORDS = catalog.ADJECTIVES + catalog.MATERIALS + tuple(
+    noun for nouns, _, _ in catalog.CATEGORIES.values() for noun in nouns
+)
+CATEGORIES = tuple(catalog.CATEGORIES)
+# Scenario weights, roughly a browsing-heavy storefront.
+MIX = {
+    "search": 35,
+    "browse": 15,
+    "product": 20,
+    "cart": 12,
+    "profile": 8,
+    "login": 7,
+    "otp": 3,
+}
+
+def write_config(directory: str, args: argparse.Namespace) -> str:
+    in_memory = args.mongo_uri.startswith("mongomock://")
+    path = os.path.join(directory, "config.toml")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"""
+[mongodb]
+uri = "{args.mongo_uri}"
+db = "ecofinds_bench_{secrets.token_hex(4)}"
+async_mode = {str(not in_memory).lower()}
+# mongomock checks unique indexes with a full scan per insert, which would
+# dominate seeding; indexes only matter against a real server.
+ensure_indexes = {str(not in_memory).lower()}
+
+[sms]
+provider = "fake"
+workers = 2
+poll_interval = 0.1
+
+[listing_cache]
+change_stream = false
+""")
+    return path
+
+class Recorder:
+    """
+    Collects latencies and errors per route.
+    """
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = collections.defaultdict(list)
+        self.errors: collections.Counter = collections.Counter()
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs) -> dict:
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[route].append(time.perf_counter() - start)
+        body = response.json()
+        if response.status_code >= 400 or body.get("code", 200) >= 400:
+            self.errors[route] += 1
+        return body
+
+class Session:
+    """
+    A simulated user replaying scenarios from MIX.
+    """
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, user: dict, state: dict, rng: random.Random):
+        self.client = client
+        self.recorder = recorder
+        self.user = user
+        self.state = state
+        self.rng = rng
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.user['token']}"}
+    async def search(self):
+        query = " ".join(self.rng.sample(WORDS, self.rng.choice((1, 2))))
+        await self.recorder.request(
+            self.client, "GET /a/products/search?query", "GET", "/a/products/search",
+            params={"query": query, "limit": 20}
+        )
+    async def browse(self):
+        params = {"category": self.rng.choice(CATEGORIES), "sort": self.rng.choice(("price", "-created_at"))}
+        body = await self.recorder.request(
+            self.client, "GET /a/products/search?category", "GET", "/a/products/search", params=params
+        )
+        if body.get("next"):
+            await self.recorder.request(
+                self.client, "GET /a/products/search?category", "GET", "/a/products/search",
+                params=params | {"after": body["next"]}
+            )
+    async def product(self):
+        product_id = self.rng.choice(self.state["product_ids"])
+        await self.recorder.request(self.client, "GET /a/products/{product_id}", "GET", f"/a/products/{product_id}")
+    async def cart(self):
+        product_id = self.rng.choice(self.state["product_ids"])
+        await self.recorder.request(
+            self.client, "POST /a/cart/add", "POST", "/a/cart/add",
+            json={"product_id": product_id}, headers=self.headers
+        )
+        await self.recorder.request(self.client, "GET /a/cart/", "GET", "/a/cart/", headers=self.headers)
+    async def profile(self):
+        await self.recorder.request(self.client, "GET /a/profile/my", "GET", "/a/profile/my", headers=self.headers)
+    async def login(self):
+        await self.recorder.request(
+            self.client, "POST /a/auth/login/email", "POST", "/a/auth/login/email",
+            json={"email": self.user["email"]}
+        )
+        body = await self.recorder.request(
+            self.client, "POST /a/auth/login/password", "POST", "/a/auth/login/password",
+            json={"email": self.user["email"], "password": self.user["password"]}
+        )
+        self.user["token"] = body.get("auth_token") or self.user["token"]
+    async def otp(self):
+        await self.recorder.request(
+            self.client, "POST /a/auth/generateOTP", "POST", "/a/auth/generateOTP",
+            json={"phone_number": f"+1555{self.rng.randrange(10**7):07d}"}
+        )
+    async def run(self, deadline: float):
+        scenarios = list(MIX)
+        weights = list(MIX.values())
+        while time.perf_counter() < deadline:
+            await getattr(self, self.rng.choices(scenarios, weights)[0])()
+
+async def seed(container, client: httpx.AsyncClient, args: argparse.Namespace, rng: random.Random) -> tuple[list[dict], dict]:
+    users = []
+    for i in range(args.users):
+        user = {"email": f"user{i}@bench.example.com", "password": secrets.token_urlsafe(12)}
+        response = await client.post(
+            "/a/auth/login/register",
+            json=user | {"full_name": f"Bench User {i}"}
+        )
+        user["token"] = response.json()["auth_token"]
+        users.append(user)
+    await catalog.load(container.product_manager, args.listings, seed=args.seed)
+    cursor = container.db["product_listings"].find({}, {"_id": 0, "product_id": 1})
+    product_ids = [listing["product_id"] async for listing in cursor]
+    return users, {"product_ids": product_ids}
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    index = min(int(round(q * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        values = sorted(latencies)
+        routes[route] = {
+            "requests": len(values),
+            "errors": recorder.errors[route],
+            "throughput_rps": round(len(values) / elapsed, 1),
+            "mean_ms": round(statistics.fmean(values) * 1000, 2),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        }
+    everything = sorted(latency for latencies in recorder.latencies.values() for latency in latencies)
+    total = {
+        "requests": len(everything),
+        "errors": sum(recorder.errors.values()),
+        "throughput_rps": round(len(everything) / elapsed, 1),
+        "p50_ms": round(percentile(everything, 0.50) * 1000, 2) if everything else None,
+        "p95_ms": round(percentile(everything, 0.95) * 1000, 2) if everything else None,
+        "p99_ms": round(percentile(everything, 0.99) * 1000, 2) if everything else None,
+    }
+    return {"total": total, "routes": routes}
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_summary(summary: dict):
+    print(f"{'route':<36} {'reqs':>7} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in summary["routes"].items():
+        print(
+            f"{route:<36} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput_rps']:>8} "
+            f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}"
+        )
+    total = summary["total"]
+    print(
+        f"{'total':<36} {total['requests']:>7} {total['errors']:>5} {total['throughput_rps']:>8} "
+        f"{total['p50_ms']:>8} {total['p95_ms']:>8} {total['p99_ms']:>8}"
+    )
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns the routes whose p95 latency regressed beyond `tolerance`.
+    """
+    regressions = []
+    for route, stats in summary["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if previous is None or not previous.get("p95_ms"):
+            continue
+        change = stats["p95_ms"] / previous["p95_ms"] - 1
+        if change > tolerance:
+            regressions.append(f"{route}: p95 {previous['p95_ms']} -> {stats['p95_ms']} ms (+{change:.0%})")
+    return regressions
+
+async def run(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["ECOFINDS_CONFIG"] = write_config(directory, args)
+        import main
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            try:
+                users, state = await seed(main.app.state.container, client, args, rng)
+                sessions = [
+                    Session(client, Recorder(), rng.choice(users), state, random.Random(rng.random()))
+                    for _ in range(args.concurrency)
+                ]
+                # Warm caches and lazily started pools outside the measurement.
+                warmup = time.perf_counter() + args.warmup
+                await asyncio.gather(*(session.run(warmup) for session in sessions))
+                recorder = Recorder()
+                for session in sessions:
+                    session.recorder = recorder
+                start = time.perf_counter()
+                await asyncio.gather(*(session.run(start + args.duration) for session in sessions))
+                elapsed = time.perf_counter() - start
+            finally:
+                if not args.mongo_uri.startswith("mongomock://"):
+                    db = main.app.state.container.db
+                    await db.client.drop_database(db.name)
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mongo": "mongomock" if args.mongo_uri.startswith("mongomock://") else "mongod",
+            "duration": round(elapsed, 2),
+            "concurrency": args.concurrency,
+            "users": args.users,
+            "listings": args.listings,
+            "seed": args.seed,
+            "mix": MIX,
+        },
+        **summarize(recorder, elapsed),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="EcoFinds endpoint load test.")
+    parser.add_argument("--duration", type=float, default=20.0, help="Measured seconds.")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds before the run.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Simulated users in flight.")
+    parser.add_argument("--users", type=int, default=20, help="Registered users to spread sessions over.")
+    parser.add_argument("--listings", type=int, default=2000, help="Listings to seed.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--mongo-uri",
+        default="mongomock://",
+        help="mongomock:// (default) or a local mongod URI; a throwaway database is used and dropped."
+    )
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    parser.add_argument("--baseline", help="Results JSON to compare p95 latencies against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 regression (0.2 = 20%%).")
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    print_summary(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
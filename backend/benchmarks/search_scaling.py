@@ -0,0 +1,229 @@
+"""
+Search scaling benchmark.
+Loads synthetic catalogs of increasing size and runs
+`ProductListingManager.search_product_listings` with queries of varying
+selectivity and filter combinations against each search backend.
+Records latency, documents and index keys examined (from explain), search
+index postings read and peak Python memory per case, for plotting scaling
+curves.
+Usage: python -m benchmarks.search_scaling [--scales 10000,100000] [--backends index,regex]
+                                           [--cases term_common,...] [--max-postings-per-term N]
+                                           [--mongo-uri URI] [--output FILE]
+Against mongomock:// the database runs in-process, so explain counts are
+unavailable and peak memory includes the database's own work.
+"""
+
+import argparse
+import asyncio
+import json
+import secrets
+import statistics
+import time
+import tracemalloc
+import core.config
+import core.database
+import core.product
+from benchmarks import catalog
+
+# name: search_product_listings arguments
+CASES = {
+    "term_common": {"query": "chair"},
+    "term_medium": {"query": "walnut"},
+    "term_rare": {"query": "ref4242"},
+    "multi_term": {"query": "vintage walnut chair"},
+    "term_category_price": {"query": "walnut", "category": "furniture", "price_min": 50, "price_max": 200},
+    "category_newest": {"category": "furniture", "sort": "-created_at"},
+    "category_price_range": {"category": "clothing", "price_min": 20, "price_max": 60, "sort": "price"},
+    "seller": {"seller_email": catalog.seller_email(0), "sort": "-created_at"},
+    "seller_rare": {"seller_email": catalog.seller_email(7), "sort": "price"},
+    "price_range_only": {"price_min": 100, "price_max": 110, "sort": "price"},
+}
+
+class ExplainedCursor:
+    """
+    Cursor wrapper that logs the find or aggregate command it runs.
+    """
+    def __init__(self, cursor, command: dict, log: list):
+        self._cursor = cursor
+        self._command = command
+        self._log = log
+    def sort(self, keys):
+        self._command["sort"] = dict(keys)
+        self._cursor = self._cursor.sort(keys)
+        return self
+    def limit(self, limit: int):
+        self._command["limit"] = limit
+        self._cursor = self._cursor.limit(limit)
+        return self
+    async def to_list(self, length=None):
+        self._log.append(self._command)
+        documents = await self._cursor.to_list(length)
+        self._command["returned"] = len(documents)
+        return documents
+    def __aiter__(self):
+        self._log.append(self._command)
+        return self._cursor.__aiter__()
+
+class ExplainedCollection:
+    def __init__(self, collection, log: list):
+        self._collection = collection
+        self._log = log
+    def find(self, filter=None, projection=None, *args, **kwargs):
+        command = {"find": self._collection.name, "filter": filter or {}}
+        if projection is not None:
+            command["projection"] = projection
+        return ExplainedCursor(self._collection.find(filter, projection, *args, **kwargs), command, self._log)
+    async def aggregate(self, pipeline: list[dict], **kwargs):
+        command = {"aggregate": self._collection.name, "pipeline": pipeline, "cursor": {}}
+        return ExplainedCursor(await self._collection.aggregate(pipeline, **kwargs), command, self._log)
+    def __getattr__(self, name: str):
+        return getattr(self._collection, name)
+
+class ExplainedDatabase:
+    """
+    Database wrapper that records the find and aggregate commands issued
+    through it, so they can be explained after a search.
+    """
+    def __init__(self, db: core.database.AsyncDatabase):
+        self._db = db
+        self.log: list[dict] = []
+    def __getitem__(self, name: str) -> ExplainedCollection:
+        return ExplainedCollection(self._db[name], self.log)
+    def get_collection(self, name: str, **kwargs) -> ExplainedCollection:
+        return ExplainedCollection(self._db.get_collection(name, **kwargs), self.log)
+    def __getattr__(self, name: str):
+        return getattr(self._db, name)
+
+async def explain(db: core.database.AsyncDatabase, commands: list[dict]) -> dict | None:
+    """
+    Sums execution stats over the commands, or None if explain is unsupported.
+    """
+    totals = {"docs_examined": 0, "keys_examined": 0, "commands": len(commands)}
+    for command in commands:
+        command = {key: value for key, value in command.items() if key != "returned"}
+        try:
+            result = await db.command({"explain": command, "verbosity": "executionStats"})
+        except Exception:
+            return None
+        for stats in _execution_stats(result):
+            totals["docs_examined"] += stats.get("totalDocsExamined", 0)
+            totals["keys_examined"] += stats.get("totalKeysExamined", 0)
+    return totals
+
+def _execution_stats(result):
+    """
+    Yields every executionStats section of an explain result. Aggregations
+    nest them under their `$cursor` stages, and sharded ones per shard.
+    """
+    if isinstance(result, dict):
+        for key, value in result.items():
+            if key == "executionStats" and isinstance(value, dict):
+                yield value
+            else:
+                yield from _execution_stats(value)
+    elif isinstance(result, list):
+        for value in result:
+            yield from _execution_stats(value)
+
+async def run_case(manager: core.product.ProductListingManager, db: ExplainedDatabase, arguments: dict, repeat: int) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results, _, _ = await manager.search_product_listings(**arguments)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    db.log.clear()
+    await manager.search_product_listings(**arguments)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    postings = manager.search_index.postings.name
+    return {
+        "results": len(results),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)] * 1000, 2),
+        "peak_kb": round(peak / 1024, 1),
+        "postings_read": sum(command.get("returned", 0) for command in db.log if command.get("find") == postings),
+        "explain": await explain(db._db, list(db.log)),
+    }
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    rows = []
+    for scale in args.scales:
+        db = core.database.factory(
+            uri=args.mongo_uri,
+            db_name=f"ecofinds_search_bench_{secrets.token_hex(4)}",
+            async_mode=not args.mongo_uri.startswith("mongomock://")
+        )
+        explained = ExplainedDatabase(db)
+        # The listing cache is disabled so every search pays its full cost.
+        cache_config = core.config.ListingCache(size=0, change_stream=False)
+        try:
+            loader = core.product.ProductListingManager(db, core.config.Search(), cache_config)
+            if not args.mongo_uri.startswith("mongomock://"):
+                registry = core.database.IndexRegistry()
+                loader.register_indexes(registry)
+                await registry.apply(db)
+            start = time.perf_counter()
+            await catalog.load(loader, scale, seed=args.seed)
+            print(f"Loaded {scale} listings in {time.perf_counter() - start:.1f}s")
+            for backend in args.backends:
+                search_config = core.config.Search(backend=backend)
+                if args.max_postings_per_term:
+                    search_config.max_postings_per_term = args.max_postings_per_term
+                manager = core.product.ProductListingManager(explained, search_config, cache_config)
+                for case in args.cases:
+                    arguments = CASES[case]
+                    row = {"scale": scale, "backend": backend, "case": case}
+                    row |= await run_case(manager, explained, arguments, args.repeat)
+                    rows.append(row)
+                    examined = row["explain"]["docs_examined"] if row["explain"] else "-"
+                    print(
+                        f"{scale:>9} {backend:<6} {case:<22} {row['results']:>4} results "
+                        f"p50 {row['p50_ms']:>9} ms  p95 {row['p95_ms']:>9} ms  "
+                        f"docs {examined:>8}  postings {row['postings_read']:>7}  peak {row['peak_kb']:>9} KiB"
+                    )
+        finally:
+            if not args.mongo_uri.startswith("mongomock://"):
+                await db.client.drop_database(db.name)
+            await core.database.close(db)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Search scaling benchmark.")
+    parser.add_argument(
+        "--scales",
+        type=lambda value: [int(scale) for scale in value.split(",")],
+        default=[10000, 100000],
+        help="Comma separated catalog sizes."
+    )
+    parser.add_argument(
+        "--backends",
+        type=lambda value: value.split(","),
+        default=["index", "regex"],
+        help="Comma separated Search.backend values."
+    )
+    parser.add_argument(
+        "--cases",
+        type=lambda value: value.split(","),
+        default=list(CASES),
+        help="Comma separated case names."
+    )
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per case.")
+    parser.add_argument(
+        "--max-postings-per-term",
+        type=int,
+        help="Search.max_postings_per_term, to compare capped and uncapped postings reads."
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mongo-uri", default="mongomock://")
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    args = parser.parse_args()
+    rows = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"seed": args.seed, "mongo_uri": args.mongo_uri.split("@")[-1], "results": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Measures response serialization cost per endpoint.
+Compares FastAPI's previous path (jsonable_encoder + JSONResponse) with the
+current one (response model serialization + ORJSONResponse).
+Usage: python -m benchmarks.serialization [--number N] [--json]
+"""
+
+import argparse
+import datetime
+import json
+import secrets
+import timeit
+import pydantic
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+import schemas.cart
+import schemas.orders
+import schemas.product
+import schemas.profile
+
+def listing(full: bool = True) -> dict:
+    data = {
+        "product_id": secrets.token_hex(16),
+        "title": "Refurbished oak dining chair",
+        "price": 42.5,
+        "category": "furniture",
+        "pictures": [f"https://cdn.example.com/{secrets.token_hex(8)}.jpg" for _ in range(3)],
+    }
+    if full:
+        data |= {
+            "description": "Solid oak, sanded and re-oiled. Minor marks on the back rest. " * 3,
+            "seller_email": "seller@example.com",
+            "created_at": datetime.datetime(2025, 8, 31, 12, 0, 0),
+        }
+    return data
+
+def order() -> dict:
+    return {
+        "order_id": secrets.token_hex(16),
+        "products": [secrets.token_hex(16) for _ in range(4)],
+        "created_at": 1756641600.0,
+    }
+
+ENDPOINTS = {
+    "GET /a/products/{product_id}": (
+        schemas.product.ProductResponse,
+        lambda: {"success": True, "code": 200, "product": listing()},
+    ),
+    "GET /a/products/search (20)": (
+        schemas.product.SearchResponse,
+        lambda: {"success": True, "code": 200, "results": [listing() for _ in range(20)], "next": "WzQyLjVd"},
+    ),
+    "GET /a/products/search (100)": (
+        schemas.product.SearchResponse,
+        lambda: {"success": True, "code": 200, "results": [listing() for _ in range(100)], "next": None},
+    ),
+    "GET /a/cart/ (50)": (
+        schemas.cart.CartResponse,
+        lambda: {
+            "success": True,
+            "code": 200,
+            "items": [listing(full=False) for _ in range(50)],
+            "missing": [],
+            "total": 2125.0,
+        },
+    ),
+    "GET /a/orders (50)": (
+        schemas.orders.OrdersResponse,
+        lambda: {"success": True, "code": 200, "orders": [order() for _ in range(50)], "next": "WzE3NTZd"},
+    ),
+    "GET /a/profile/my": (
+        schemas.profile.ProfileResponse,
+        lambda: {"success": True, "code": 200, "profile": {"email": "user@example.com", "full_name": "Jane Doe"}},
+    ),
+}
+
+def before(payload: dict) -> bytes:
+    return JSONResponse(jsonable_encoder(payload)).body
+
+def after(adapter: pydantic.TypeAdapter, payload: dict) -> bytes:
+    # Mirrors FastAPI's response_model path: validate, then dump in JSON mode.
+    model = adapter.validate_python(payload)
+    return ORJSONResponse(adapter.dump_python(model, mode="json", exclude_unset=True)).body
+
+def measure(function, number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=500, help="Calls per timing run.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+    results = []
+    for name, (model, make_payload) in ENDPOINTS.items():
+        payload = make_payload()
+        adapter = pydantic.TypeAdapter(model)
+        assert json.loads(before(payload)) == json.loads(after(adapter, payload))
+        before_us = measure(lambda: before(payload), args.number)
+        after_us = measure(lambda: after(adapter, payload), args.number)
+        results.append({
+            "endpoint": name,
+            "bytes": len(after(adapter, payload)),
+            "before_us": round(before_us, 1),
+            "after_us": round(after_us, 1),
+            "speedup": round(before_us / after_us, 2),
+        })
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'endpoint':<32} {'bytes':>7} {'before µs':>10} {'after µs':>10} {'speedup':>8}")
+    for result in results:
+        print(
+            f"{result['endpoint']:<32} {result['bytes']:>7} {result['before_us']:>10} "
+            f"{result['after_us']:>10} {result['speedup']:>7}x"
+        )
+
+if __name__ == "__main__":
+    main()
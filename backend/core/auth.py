@@ -1,31 +1,40 @@
 from . import (
+    cache,
     database,
     config,
+    passwords,
+    sms,
 )
 import core.misc.strings
-from twilio.rest import Client
+import jwt
+import asyncio
+import datetime
+import hmac
 import string
 import random
 import secrets
 import time
 import humanize
 
-class TwilioClient:
+def _expires_in(created_at: datetime.datetime | float | None, ttl: int) -> float:
     """
-    Twilio client wrapper.
+    Returns the seconds left before something created at `created_at`
+    outlives `ttl`. Zero or negative means expired.
+    Also accepts the epoch timestamps stored by older sessions.
     """
-    def __init__(self, account_sid: str, auth_token: str, sms_from_ph: str):
-        self.c = Client(account_sid, auth_token)
-        self.sms_from_ph = sms_from_ph
-    def send_sms(self, to: str, body: str):
-        """
-        Sends SMS using Twilio API.
-        """
-        self.c.messages.create(
-            body = body,
-            from_=self.sms_from_ph,
-            to=to
-        )
+    if isinstance(created_at, (int, float)):
+        created_at = datetime.datetime.fromtimestamp(created_at, datetime.timezone.utc).replace(tzinfo=None)
+    if not isinstance(created_at, datetime.datetime):
+        return 0.0
+    return (created_at + datetime.timedelta(seconds=ttl) - database.utcnow()).total_seconds()
+
+def bearer_token(header: str | None) -> str | None:
+    """
+    Extracts the token from a `Bearer` Authorization header.
+    """
+    if not header or not header.startswith("Bearer "):
+        return None
+    return header.removeprefix("Bearer ").strip() or None
 
 class OTPSession:
     """
@@ -34,15 +43,15 @@ class OTPSession:
     """
     def __init__(
             self,
-            twilio_client: TwilioClient,
-            db: database.pymongo.database.Database,
+            outbox: sms.SMSOutbox,
+            db: database.AsyncDatabase,
             auth_strings: core.misc.strings.Auth,
             phone_number: str | None = None,
             session_id: str | None = None,
             ttl: int = 300,
             max_attempts: int = 5,
             length: int = 4):
-        self.twilio_client = twilio_client
+        self.outbox = outbox
         self.db = db
         self.length = length
         self.ttl = ttl
@@ -56,47 +65,115 @@ class OTPSession:
     def _generate_otp(self, length=4) -> str:
         otp = ''.join(random.choice(string.digits) for _ in range(length))
         return otp
-    def _save_otp_session(self, otp: str):
-        self.db["otp_sessions"].insert_one(
+    async def _save_otp_session(self, otp: str):
+        await self.db["otp_sessions"].insert_one(
             {
                 "phone": self.phone_number, 
                 "otp": otp,
                 "session_id": self.session_id,
-                "created_at": time.time(),
+                "created_at": database.utcnow(),
                 "attempts": 0
             }
         )
-    def send_otp(self):
+    async def send_otp(self):
         """
-        Generates and sends OTP to user's phone number.
+        Generates an OTP and queues it for delivery to the user's phone number.
         """
         otp = self._generate_otp()
-        self._save_otp_session(otp)
+        await self._save_otp_session(otp)
         sms_body = self.auth_strings.otp_sms.format(
             otp=otp,
             ttl_str=humanize.naturaldelta(self.ttl)
         )
-        self.twilio_client.send_sms(
+        await self.outbox.enqueue(
             body=sms_body,
             to=self.phone_number
         )
         return self.session_id
-    def verify_otp(self, otp: str):
+    async def verify_otp(self, otp: str):
         """
         Verifies OTP for the session.
         """
-        data = self.db["otp_sessions"].find_one({"session_id": self.session_id})
+        data = await self.db["otp_sessions"].find_one(
+            {"session_id": self.session_id},
+            {"_id": 0, "otp": 1, "attempts": 1, "created_at": 1}
+        )
         if data is None:
             return False, 404
         if data.get("otp") != otp:
             if data.get("attempts", 0) >= self.max_attempts:
                 return False, 429
-            self.db["otp_sessions"].update_one({"session_id": self.session_id}, {"$inc": {"attempts": 1}})
+            await self.db["otp_sessions"].update_one({"session_id": self.session_id}, {"$inc": {"attempts": 1}})
             return False, 401
-        if data.get("created_at", time.time()-self.ttl)+self.ttl > time.time():
+        if _expires_in(data.get("created_at"), self.ttl) > 0:
             return True, 200
         return False, 401
 
+class RevocationList:
+    """
+    In-process copy of revoked JWT ids, backed by `revoked_tokens`.
+    Only revocations newer than the last sync are fetched, at most once per
+    `refresh_interval` seconds, so checks cost no database access per request.
+    Entries are dropped once the token would have expired anyway.
+    """
+    # Re-read this many seconds before the last sync to absorb clock skew
+    # between workers inserting revocations.
+    SYNC_OVERLAP = 5
+    def __init__(self, db: database.AsyncDatabase, refresh_interval: float):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self._revoked: dict[str, float] = {}
+        self._synced_at = None
+        self._last_refresh = 0.0
+        self._lock = asyncio.Lock()
+    def __len__(self) -> int:
+        return len(self._revoked)
+    def register_indexes(self, registry: database.IndexRegistry):
+        registry.add("revoked_tokens", "jti", unique=True)
+        registry.add("revoked_tokens", "revoked_at")
+        registry.add("revoked_tokens", "expires_at", name="expires_at_ttl", expire_after_seconds=0)
+    def _prune(self):
+        now = time.time()
+        for jti in [jti for jti, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[jti]
+    async def refresh(self, force: bool = False):
+        """
+        Pulls revocations made since the last sync.
+        """
+        if not force and time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        async with self._lock:
+            if not force and time.monotonic() - self._last_refresh < self.refresh_interval:
+                return
+            query = {}
+            if self._synced_at is not None:
+                query["revoked_at"] = {"$gte": self._synced_at - datetime.timedelta(seconds=self.SYNC_OVERLAP)}
+            synced_at = database.utcnow()
+            cursor = self.db["revoked_tokens"].find(query, {"_id": 0, "jti": 1, "exp": 1})
+            async for entry in cursor:
+                self._revoked[entry["jti"]] = entry["exp"]
+            self._synced_at = synced_at
+            self._last_refresh = time.monotonic()
+            self._prune()
+    async def revoke(self, jti: str, exp: float):
+        """
+        Revokes a token id until its expiry time `exp` (epoch seconds).
+        """
+        self._revoked[jti] = exp
+        await self.db["revoked_tokens"].update_one(
+            {"jti": jti},
+            {"$setOnInsert": {
+                "jti": jti,
+                "exp": exp,
+                "expires_at": datetime.datetime.fromtimestamp(exp, datetime.timezone.utc).replace(tzinfo=None),
+                "revoked_at": database.utcnow()
+            }},
+            upsert=True
+        )
+    async def is_revoked(self, jti: str) -> bool:
+        await self.refresh()
+        return jti in self._revoked
+
 class AuthorizationManager:
     """
     Handles user authentication.
@@ -104,20 +181,90 @@ class AuthorizationManager:
     def __init__(
             self,
             config: config.Auth,
-            db: database.pymongo.database.Database,
-            twilio_client: TwilioClient
+            db: database.AsyncDatabase,
+            outbox: sms.SMSOutbox,
+            server_workers: int = 1
         ):
         self.config = config
         self.auth_strings = core.misc.strings.Auth()
         self.db = db
-        self.twilio_client = twilio_client
+        self.outbox = outbox
+        self.token_cache = cache.TTLCache(
+            max_size=config.token_cache_size,
+            ttl=config.token_cache_ttl
+        )
+        self.revocation_list = RevocationList(
+            db=db,
+            refresh_interval=config.revocation_refresh_interval
+        )
+        self.password_hasher = passwords.PasswordHasher(config, server_workers=server_workers)
+        if config.token_mode == "jwt" and config.jwt_active_key not in config.jwt_keys:
+            raise ValueError("Auth.jwt_active_key must name one of Auth.jwt_keys.")
+    def register_indexes(self, registry: database.IndexRegistry):
+        """
+        Registers lookup indexes and the TTL indexes that expire sessions.
+        """
+        registry.add("user_auth", "email", unique=True)
+        registry.add("auth_sessions", "auth_token", unique=True)
+        registry.add(
+            "auth_sessions",
+            "created_at",
+            name="created_at_ttl",
+            expire_after_seconds=self.config.auth_token_ttl
+        )
+        registry.add("otp_sessions", "session_id", unique=True)
+        registry.add(
+            "otp_sessions",
+            "created_at",
+            name="created_at_ttl",
+            expire_after_seconds=self.config.login_otp_ttl
+        )
+        self.revocation_list.register_indexes(registry)
+    async def migrate_session_dates(self, batch_size: int = 1000) -> tuple[int, int]:
+        """
+        Fixes sessions whose `created_at` is a float timestamp, as written
+        before session TTL indexes. TTL indexes skip non-date values, so
+        such sessions would never expire. Those already past their TTL are
+        deleted in one go; the rest get the same instant as a date.
+        Returns the numbers deleted and converted.
+        """
+        deleted = converted = 0
+        for collection, ttl in (
+                ("auth_sessions", self.config.auth_token_ttl),
+                ("otp_sessions", self.config.login_otp_ttl)):
+            # A numeric bound only matches numeric values.
+            result = await self.db[collection].delete_many({"created_at": {"$lt": time.time() - ttl}})
+            deleted += result.deleted_count
+            cursor = self.db[collection].find(
+                {"created_at": {"$type": "number"}},
+                {"_id": 1, "created_at": 1}
+            ).batch_size(batch_size)
+            batch = []
+            async for session in cursor:
+                batch.append(session)
+                if len(batch) >= batch_size:
+                    converted += await self._convert_session_dates(collection, batch)
+                    batch = []
+            converted += await self._convert_session_dates(collection, batch)
+        return deleted, converted
+    async def _convert_session_dates(self, collection: str, sessions: list[dict]) -> int:
+        results = await asyncio.gather(*(
+            self.db[collection].update_one(
+                {"_id": session["_id"], "created_at": session["created_at"]},
+                {"$set": {"created_at": datetime.datetime.fromtimestamp(
+                    session["created_at"], datetime.timezone.utc
+                ).replace(tzinfo=None)}}
+            )
+            for session in sessions
+        ))
+        return sum(result.modified_count for result in results)
     def otp_factory(
             self,
             phone_number: str | None = None,
             session_id: str | None= None
         ) -> OTPSession:
         return OTPSession(
-            twilio_client=self.twilio_client,
+            outbox=self.outbox,
             db=self.db,
             auth_strings=self.auth_strings,
             phone_number=phone_number,
@@ -125,7 +272,7 @@ class AuthorizationManager:
             ttl=self.config.login_otp_ttl,
             max_attempts=self.config.login_otp_max_attempts
         )
-    def login_email_step(
+    async def login_email_step(
             self,
             email: str
         ) -> tuple[bool, int]:
@@ -133,72 +280,188 @@ class AuthorizationManager:
         Handles email login step.
         Returns 404 if user is new, 200 if already exists.
         """ 
-        user = self.db["user_auth"].find_one({"email": email})
+        user = await self.db["user_auth"].find_one({"email": email}, {"_id": 1})
         if user is None:
             return True, 404
         return True, 200
-    def login_register(
+    async def login_register(
             self,
             email: str,
             password: str
         ) -> tuple[bool, int]:
         """
         Registers a new user.
+        Returns 503 if the password hasher is overloaded.
         """
-        user = self.db["user_auth"].find_one({"email": email})
+        user = await self.db["user_auth"].find_one({"email": email}, {"_id": 1})
         if user is not None:
             return True, 409
-        self.db["user_auth"].insert_one({
+        try:
+            password_hash = await self.password_hasher.hash(password)
+        except passwords.PasswordHasherBusy:
+            return False, 503
+        await self.db["user_auth"].insert_one({
             "user_id": secrets.token_hex(16),
             "email": email,
-            "password": password,
+            "password_hash": password_hash,
             "created_at": time.time()
         })
         return True, 200
-    def verify_creds(
+    async def verify_creds(
             self,
             email: str,
             password: str
         ) -> tuple[bool, int]:
         """
         Verifies user credentials.
+        Plaintext passwords from before hashing, and hashes made with old
+        parameters, are rehashed on a successful login.
+        Returns 503 if the password hasher is overloaded.
         """
-        user = self.db["user_auth"].find_one({"email": email})
+        user = await self.db["user_auth"].find_one(
+            {"email": email},
+            {"_id": 0, "password": 1, "password_hash": 1}
+        )
         if user is None:
             return False, 404
-        if user.get("password") != password:
-            return False, 401
+        try:
+            if "password_hash" in user:
+                if not await self.password_hasher.verify(password, user["password_hash"]):
+                    return False, 401
+                upgrade = self.password_hasher.needs_rehash(user["password_hash"])
+            else:
+                legacy = user.get("password")
+                if legacy is None or not hmac.compare_digest(legacy.encode(), password.encode()):
+                    return False, 401
+                upgrade = True
+            if upgrade:
+                await self.db["user_auth"].update_one(
+                    {"email": email},
+                    {
+                        "$set": {"password_hash": await self.password_hasher.hash(password)},
+                        "$unset": {"password": ""}
+                    }
+                )
+        except passwords.PasswordHasherBusy:
+            return False, 503
         return True, 200
-    def generate_auth_token(self, email: str) -> str:
+    def _issue_jwt(self, email: str) -> str:
+        now = int(time.time())
+        return jwt.encode(
+            {
+                "sub": email,
+                "iss": self.config.jwt_issuer,
+                "iat": now,
+                "exp": now + self.config.jwt_ttl,
+                "jti": secrets.token_hex(12),
+            },
+            self.config.jwt_keys[self.config.jwt_active_key],
+            algorithm=self.config.jwt_algorithm,
+            headers={"kid": self.config.jwt_active_key}
+        )
+    def _decode_jwt(self, auth_token: str) -> dict | None:
+        """
+        Validates a signed token and returns its claims, or None if invalid.
+        """
+        try:
+            key_id = jwt.get_unverified_header(auth_token).get("kid")
+            key = self.config.jwt_keys.get(key_id)
+            if key is None:
+                return None
+            return jwt.decode(
+                auth_token,
+                key,
+                algorithms=[self.config.jwt_algorithm],
+                issuer=self.config.jwt_issuer,
+                options={"require": ["exp", "sub", "jti"]}
+            )
+        except jwt.PyJWTError:
+            return None
+    @staticmethod
+    def _is_jwt(auth_token: str) -> bool:
+        return auth_token.count(".") == 2
+    async def generate_auth_token(self, email: str) -> str:
         """
-        Generates auth token for user and saves to database.
+        Generates auth token for user.
+        In jwt mode the token is signed and nothing is stored; otherwise it
+        is saved to auth_sessions.
         """
+        if self.config.token_mode == "jwt":
+            return self._issue_jwt(email)
         auth_token = secrets.token_hex(32)
-        self.db["auth_sessions"].insert_one({
+        await self.db["auth_sessions"].insert_one({
             "email": email,
             "auth_token": auth_token,
-            "created_at": time.time()
+            "created_at": database.utcnow()
         })
         return auth_token
-    def verify_auth_token(self, auth_token: str) -> tuple[bool, int]:
+    async def _resolve_auth_token(self, auth_token: str) -> str | None:
+        """
+        Returns the email an auth token belongs to, or None if it is invalid.
+        Signed tokens are checked without database access. Session results
+        are cached, including invalid tokens, so repeated requests with the
+        same token cost at most one database lookup per cache window.
+        """
+        if self.config.token_mode == "jwt" and self._is_jwt(auth_token):
+            claims = self._decode_jwt(auth_token)
+            if claims is None or await self.revocation_list.is_revoked(claims["jti"]):
+                return None
+            return claims["sub"]
+        email = self.token_cache.get(auth_token)
+        if email is not cache.MISSING:
+            return email
+        data = await self.db["auth_sessions"].find_one(
+            {"auth_token": auth_token},
+            {"_id": 0, "email": 1, "created_at": 1}
+        )
+        remaining = _expires_in(data.get("created_at"), self.config.auth_token_ttl) if data else 0.0
+        if remaining <= 0:
+            self.token_cache.set(auth_token, None, ttl=self.config.token_cache_negative_ttl)
+            return None
+        self.token_cache.set(
+            auth_token,
+            data.get("email"),
+            ttl=min(self.config.token_cache_ttl, remaining)
+        )
+        return data.get("email")
+    async def verify_auth_token(self, auth_token: str) -> tuple[bool, int]:
         """
         Verifies auth token.
         """
-        data = self.db["auth_sessions"].find_one({"auth_token": auth_token})
-        if data is None:
-            return False, 401
-        if data.get("created_at", 0) + self.config.auth_token_ttl < time.time():
+        if await self._resolve_auth_token(auth_token) is None:
             return False, 401
         return True, 200
-    def verify_authorization_header(self, header: str) -> str | None:
+    async def verify_authorization_header(self, header: str | None) -> tuple[str | None, int]:
         """
         Verifies Authorization header and returns email if valid.
         """
-        if not header.startswith("Bearer "):
+        auth_token = bearer_token(header)
+        if auth_token is None:
             return None, 401
-        auth_token = header.split(" ")[1]
-        valid, code = self.verify_auth_token(auth_token)
-        if not valid:
-            return None, code
-        data = self.db["auth_sessions"].find_one({"auth_token": auth_token})
-        return data.get("email"), 200
+        email = await self._resolve_auth_token(auth_token)
+        if email is None:
+            return None, 401
+        return email, 200
+    def invalidate_auth_token(self, auth_token: str) -> bool:
+        """
+        Drops an auth token from this process's token cache.
+        """
+        return self.token_cache.invalidate(auth_token)
+    async def revoke_auth_token(self, auth_token: str) -> bool:
+        """
+        Revokes an auth token.
+        Signed tokens are added to the revocation list; other workers pick the
+        revocation up within `Auth.revocation_refresh_interval` seconds.
+        Sessions are deleted and dropped from the token cache; other workers
+        keep accepting them until their cached entry expires, at most
+        `Auth.token_cache_ttl` seconds later.
+        """
+        if self.config.token_mode == "jwt" and self._is_jwt(auth_token):
+            claims = self._decode_jwt(auth_token)
+            if claims is None:
+                return False
+            await self.revocation_list.revoke(claims["jti"], claims["exp"])
+            return True
+        result = await self.db["auth_sessions"].delete_one({"auth_token": auth_token})
+        self.invalidate_auth_token(auth_token)
+        return result.deleted_count > 0
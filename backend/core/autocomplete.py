@@ -0,0 +1,333 @@
+"""
+Prefix autocomplete over listing titles and categories.
+Phrases are kept in an in-memory trie whose nodes cache their most popular
+completions, so a lookup is a walk of at most `max_prefix_length` nodes.
+A phrase's popularity is the number of listings carrying it. Most titles
+are unique, so they tie at 1 and are ordered alphabetically; categories and
+repeated titles rank above them. There is no demand signal such as views or
+orders behind the ranking.
+"""
+
+import asyncio
+import heapq
+import logging
+import sys
+import time
+import pymongo.errors
+from core import config, search
+
+logger = logging.getLogger("ecofinds")
+
+# Rough per-phrase bookkeeping cost beyond its strings (dict entries, tuple).
+PHRASE_OVERHEAD = 240
+
+def normalize_phrase(text: str | None) -> str:
+    """
+    Case-folds text, strips accents and punctuation and collapses spaces.
+    """
+    if not text:
+        return ""
+    return " ".join(search.TOKEN_PATTERN.findall(search.normalize(text)))
+
+def phrase_keys(text: str) -> list[str]:
+    """
+    Returns the keys a normalized phrase is found under: the phrase itself
+    and every suffix starting at a word other than a stopword, so "oak
+    dining table" also completes "dining" and "table".
+    """
+    words = text.split(" ")
+    keys = [" ".join(words[i:]) for i, word in enumerate(words) if i == 0 or word not in search.STOPWORDS]
+    return list(dict.fromkeys(keys))
+
+class _Node:
+    __slots__ = ("children", "top", "terminals")
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        # Most popular phrases in this subtree, best first.
+        self.top: list[tuple[str, str]] = []
+        # Phrases with a key ending here.
+        self.terminals: list[tuple[str, str]] | None = None
+
+class PrefixIndex:
+    """
+    Weighted phrase trie with cached top-k completions per node.
+    Phrases are identified by (kind, normalized text). Keys are truncated to
+    `max_prefix_length` characters; longer prefixes are answered by
+    filtering the phrases stored under their truncated prefix. New phrases are
+    refused once the estimated size reaches `max_bytes`.
+    """
+    def __init__(self, max_suggestions: int, max_prefix_length: int, max_bytes: int):
+        self.max_suggestions = max_suggestions
+        self.max_prefix_length = max_prefix_length
+        self.max_bytes = max_bytes
+        self.root = _Node()
+        self.weights: dict[tuple[str, str], int] = {}
+        self.display: dict[tuple[str, str], str] = {}
+        self.nodes = 1
+        self.dropped = 0
+        self.node_bytes = (
+            sys.getsizeof(_Node()) + sys.getsizeof({"a": None})
+            + sys.getsizeof([None] * max_suggestions)
+        )
+        self.bytes = self.node_bytes
+    def __len__(self) -> int:
+        return len(self.weights)
+    def _rank(self, phrase: tuple[str, str]):
+        return -self.weights[phrase], phrase[1], phrase[0]
+    def add(self, kind: str, text: str, display: str, delta: int = 1) -> bool:
+        """
+        Changes a phrase's weight by `delta`, adding or removing it as its
+        weight becomes positive or drops to zero.
+        Returns False if the phrase was refused for lack of memory.
+        """
+        if not text or not delta:
+            return True
+        phrase = (kind, text)
+        old = self.weights.get(phrase, 0)
+        new = max(old + delta, 0)
+        if old == new:
+            return True
+        phrase_bytes = sys.getsizeof(text) + sys.getsizeof(display) + PHRASE_OVERHEAD
+        if old == 0:
+            if self.bytes + phrase_bytes > self.max_bytes:
+                self.dropped += 1
+                return False
+            self.display[phrase] = display
+            self.bytes += phrase_bytes
+        if new:
+            self.weights[phrase] = new
+        else:
+            del self.weights[phrase]
+            self.bytes -= sys.getsizeof(text) + sys.getsizeof(self.display.pop(phrase)) + PHRASE_OVERHEAD
+        for key in phrase_keys(text):
+            self._update(phrase, key[:self.max_prefix_length], created=old == 0, removed=new == 0, decreased=new < old)
+        return True
+    def _update(self, phrase: tuple[str, str], key: str, created: bool, removed: bool, decreased: bool):
+        node = self.root
+        path = [node]
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                if removed:
+                    return
+                child = node.children[char] = _Node()
+                self.nodes += 1
+                self.bytes += self.node_bytes
+            node = child
+            path.append(node)
+        if created:
+            if node.terminals is None:
+                node.terminals = []
+            if phrase not in node.terminals:
+                node.terminals.append(phrase)
+        elif removed and node.terminals and phrase in node.terminals:
+            node.terminals.remove(phrase)
+        # Children first, so parents recompute from up-to-date lists.
+        for node in reversed(path):
+            if phrase in node.top:
+                if decreased:
+                    self._recompute(node)
+                else:
+                    node.top.sort(key=self._rank)
+            elif not removed and (len(node.top) < self.max_suggestions or self._rank(phrase) < self._rank(node.top[-1])):
+                node.top.append(phrase)
+                node.top.sort(key=self._rank)
+                del node.top[self.max_suggestions:]
+        if removed:
+            for depth in range(len(path) - 1, 0, -1):
+                node = path[depth]
+                if node.children or node.terminals:
+                    break
+                del path[depth - 1].children[key[depth - 1]]
+                self.nodes -= 1
+                self.bytes -= self.node_bytes
+    def _recompute(self, node: _Node):
+        candidates = set(node.terminals or ())
+        for child in node.children.values():
+            candidates.update(child.top)
+        # A removed phrase can linger in the lists of its other keys' paths
+        # until those are updated too.
+        candidates = [phrase for phrase in candidates if phrase in self.weights]
+        node.top = heapq.nsmallest(self.max_suggestions, candidates, key=self._rank)
+    def lookup(self, prefix: str, limit: int | None = None) -> list[tuple[str, str, int]]:
+        """
+        Returns up to `limit` (kind, display text, weight) completions of
+        `prefix`, most popular first.
+        """
+        text = normalize_phrase(prefix)
+        if not text:
+            return []
+        node = self.root
+        for char in text[:self.max_prefix_length]:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        top = node.top
+        if len(text) > self.max_prefix_length:
+            # Keys stop at this depth, so every phrase below the truncated
+            # prefix is a terminal here.
+            matches = (
+                phrase for phrase in node.terminals or ()
+                if any(key.startswith(text) for key in phrase_keys(phrase[1]))
+            )
+            top = heapq.nsmallest(limit or self.max_suggestions, matches, key=self._rank)
+        return [(phrase[0], self.display[phrase], self.weights[phrase]) for phrase in top[:limit]]
+
+class Autocomplete:
+    """
+    Listing title and category suggestions.
+    The owning manager applies its own writes as they happen. While its
+    listing change stream runs, new listings by any process are counted from
+    their change events; edits and deletions by other processes, whose
+    previous phrases the events do not carry, wait for the next rebuild in
+    `run`, which is then at most every `rebuild_interval`. Without the
+    stream, `run` rebuilds every `refresh_interval`.
+    """
+    def __init__(self, config: config.Autocomplete):
+        self.config = config
+        self.index = self._new_index()
+        self.ready = False
+        # Set by the owning manager while its listing change stream runs;
+        # `changed` is raised by listing changes that need a rebuild.
+        self.watched = False
+        self.changed = False
+        self.rebuilding = False
+        self.built_at = 0.0
+    def _new_index(self) -> PrefixIndex:
+        return PrefixIndex(
+            max_suggestions=self.config.max_suggestions,
+            max_prefix_length=self.config.max_prefix_length,
+            max_bytes=self.config.memory_mb * 1024 * 1024
+        )
+    @staticmethod
+    def _phrases(listing: dict) -> list[tuple[str, str, str]]:
+        phrases = []
+        for kind, field in (("title", "title"), ("category", "category")):
+            display = (listing.get(field) or "").strip()
+            text = normalize_phrase(display)
+            if text:
+                phrases.append((kind, text, display))
+        return phrases
+    def listing_written(self, listing: dict, previous: dict | None = None):
+        """
+        Counts a created or updated listing, replacing its previous phrases.
+        """
+        new = self._phrases(listing)
+        old = self._phrases(previous) if previous else []
+        old_keys = {(kind, text) for kind, text, _ in old}
+        new_keys = {(kind, text) for kind, text, _ in new}
+        for kind, text, display in old:
+            if (kind, text) not in new_keys:
+                self.index.add(kind, text, display, -1)
+        for kind, text, display in new:
+            if (kind, text) not in old_keys:
+                self.index.add(kind, text, display, 1)
+    def listing_deleted(self, previous: dict):
+        for kind, text, display in self._phrases(previous):
+            self.index.add(kind, text, display, -1)
+    def listing_changed(self, change: dict):
+        """
+        Applies a change event from the listing change stream. Inserts are
+        counted at once; title and category edits, replacements and
+        deletions raise `changed` for the next rebuild.
+        """
+        operation = change.get("operationType")
+        if operation == "insert":
+            listing = change.get("fullDocument")
+            if listing:
+                self.listing_written(listing)
+            # The rebuild in progress may not have seen it.
+            if self.rebuilding or not listing:
+                self.changed = True
+        elif operation == "update":
+            description = change.get("updateDescription") or {}
+            fields = list(description.get("updatedFields") or {}) + list(description.get("removedFields") or [])
+            if any(field.split(".", 1)[0] in ("title", "category") for field in fields):
+                self.changed = True
+        else:
+            self.changed = True
+    def suggest(self, prefix: str, limit: int | None = None) -> list[dict]:
+        """
+        Returns suggestions for a typed prefix, most popular first.
+        """
+        limit = min(limit or self.config.max_suggestions, self.config.max_suggestions)
+        return [
+            {"text": display, "kind": kind, "count": count}
+            for kind, display, count in self.index.lookup(prefix, limit)
+        ]
+    def _build(self, counts: dict[tuple[str, str], list]) -> PrefixIndex:
+        index = self._new_index()
+        # Most popular first, so the memory budget keeps the phrases that matter.
+        phrases = sorted(counts.items(), key=lambda item: -item[1][0])
+        for position, ((kind, text), (count, display)) in enumerate(phrases):
+            if not index.add(kind, text, display, count):
+                index.dropped = len(phrases) - position
+                break
+        return index
+    async def rebuild(self, collection) -> int:
+        """
+        Rebuilds the index from `product_listings` and swaps it in.
+        Titles and categories are counted in one pass over the collection,
+        and the trie is built in a worker thread. Returns the number of
+        phrases.
+        """
+        self.rebuilding = True
+        try:
+            index = await self._scan(collection)
+        finally:
+            self.rebuilding = False
+        if index.dropped:
+            logger.warning(
+                "Autocomplete memory budget of %s MB reached, %s phrases left out.",
+                self.config.memory_mb, index.dropped
+            )
+        self.index = index
+        self.ready = True
+        self.built_at = time.monotonic()
+        return len(index)
+    async def _scan(self, collection) -> PrefixIndex:
+        counts = {}
+        cursor = await collection.aggregate([
+            {"$project": {"_id": 0, "phrases": {"$objectToArray": {"title": "$title", "category": "$category"}}}},
+            {"$unwind": "$phrases"},
+            {"$group": {"_id": "$phrases", "count": {"$sum": 1}}},
+        ], allowDiskUse=True)
+        async for group in cursor:
+            kind, value = group["_id"]["k"], group["_id"]["v"]
+            display = (value if isinstance(value, str) else "").strip()
+            text = normalize_phrase(display)
+            if not text:
+                continue
+            entry = counts.get((kind, text))
+            if entry is None:
+                counts[(kind, text)] = [group["count"], display]
+            else:
+                entry[0] += group["count"]
+        return await asyncio.to_thread(self._build, counts)
+    async def run(self, collection):
+        """
+        Builds the index, then rebuilds it every `refresh_interval` seconds.
+        While the listing change stream runs, it is only rebuilt once a change
+        needs it and `rebuild_interval` seconds have passed since the last
+        build. Runs until cancelled.
+        """
+        while True:
+            if not self.ready or not self.watched or (
+                self.changed and time.monotonic() - self.built_at >= self.config.rebuild_interval
+            ):
+                self.changed = False
+                try:
+                    await self.rebuild(collection)
+                except pymongo.errors.PyMongoError as e:
+                    self.changed = True
+                    logger.warning("Autocomplete rebuild failed: %s", e)
+            if self.config.refresh_interval <= 0 and self.ready:
+                return
+            await asyncio.sleep(self.config.refresh_interval or 60)
+    def stats(self) -> dict:
+        return {
+            "phrases": len(self.index),
+            "nodes": self.index.nodes,
+            "bytes": self.index.bytes,
+            "dropped": self.index.dropped,
+        }
@@ -0,0 +1,107 @@
+"""
+In-process caches.
+"""
+
+import asyncio
+import collections
+import time
+
+MISSING = object()
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries expire after a TTL.
+    `None` is a valid cached value; `get` returns `MISSING` on a miss.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    def __len__(self) -> int:
+        return len(self._entries)
+    def get(self, key, default=MISSING):
+        """
+        Returns the cached value for `key`, or `default` if absent or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+    def set(self, key, value, ttl: float | None = None):
+        """
+        Caches `value` for `ttl` seconds (the cache default if None).
+        """
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    def invalidate(self, key) -> bool:
+        """
+        Drops `key` from the cache. Returns whether it was cached.
+        """
+        if self._entries.pop(key, None) is None:
+            return False
+        self.invalidations += 1
+        return True
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single call.
+    Callers arriving while a call is in flight share its result or
+    exception. A caller that is cancelled does not cancel the shared call.
+    """
+    def __init__(self):
+        self._calls: dict = {}
+        self.calls = 0
+        self.coalesced = 0
+    def __len__(self) -> int:
+        return len(self._calls)
+    async def do(self, key, function):
+        """
+        Awaits `function()`, or the call already running for `key`.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(function())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None) if self._calls.get(key) is task else None)
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
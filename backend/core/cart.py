@@ -1,14 +1,20 @@
-from core import database
+from core import database, product
 
 class CartManager:
-    def __init__(self, db: database.pymongo.database.Database):
+    def __init__(self, db: database.AsyncDatabase):
         self.db = db
 
-    def add_to_cart(self, email: str, product_id: str) -> bool:
+    def register_indexes(self, registry: database.IndexRegistry):
+        """
+        Registers the indexes used by cart lookups.
+        """
+        registry.add("carts", "email", unique=True)
+
+    async def add_to_cart(self, email: str, product_id: str) -> bool:
         """
         Adds a product to the user's cart.
         """
-        result = self.db["carts"].update_one(
+        result = await self.db["carts"].update_one(
             {"email": email},
             {"$addToSet": {
                 "products": product_id
@@ -17,34 +23,65 @@ class CartManager:
         )
         return result.acknowledged
 
-    def remove_from_cart(self, email: str, product_id: str) -> bool:
+    async def remove_from_cart(self, email: str, product_id: str) -> bool:
         """
         Removes a product from the user's cart.
         """
-        result = self.db["carts"].update_one(
-            {"email": email, "product_id": product_id},
+        result = await self.db["carts"].update_one(
+            {"email": email},
             {"$pull": {
                 "products": product_id
             }}
         )
         return result.modified_count > 0
 
-    def get_cart_items(self, email: str) -> list[dict]:
+    async def get_cart_items(self, email: str) -> list[dict]:
         """
         Fetches all items in the user's cart.
         """
-        results = self.db["carts"].find({"email": email})
-        cart_items = []
-        for item in results:
-            item.pop("_id", None)
-            cart_items.append(item)
-        return cart_items
+        return await self.db["carts"].find({"email": email}, {"_id": 0}).to_list(None)
+
+    async def get_cart(self, email: str) -> dict:
+        """
+        Fetches the user's cart with product details and total price.
+        Listings are resolved in the same aggregation as the cart, so a cart
+        view costs one round trip. Products whose listing no longer exists
+        are returned in `missing`.
+        """
+        cursor = await self.db["carts"].aggregate([
+            {"$match": {"email": email}},
+            {"$limit": 1},
+            {"$lookup": {
+                "from": "product_listings",
+                "localField": "products",
+                "foreignField": "product_id",
+                "as": "listings"
+            }},
+            {"$project": {
+                "_id": 0,
+                "products": 1,
+                **{f"listings.{field}": 1 for field in product.DISPLAY_FIELDS}
+            }},
+        ])
+        carts = await cursor.to_list(1)
+        if not carts:
+            return {"items": [], "missing": [], "total": 0}
+        listings = {listing["product_id"]: listing for listing in carts[0].get("listings", [])}
+        items = []
+        missing = []
+        for product_id in carts[0].get("products", []):
+            if product_id in listings:
+                items.append(listings[product_id])
+            else:
+                missing.append(product_id)
+        total = round(sum(item.get("price") or 0 for item in items), 2)
+        return {"items": items, "missing": missing, "total": total}
 
-    def clear_cart(self, email: str) -> bool:
+    async def clear_cart(self, email: str) -> bool:
         """
         Clears the user's cart.
         """
-        self.db["carts"].update_one(
+        await self.db["carts"].update_one(
             {"email": email},
             {"$set": {"products": []}}
         )
@@ -0,0 +1,196 @@
+"""
+Negotiated response compression.
+`CompressionMiddleware` compresses API responses with gzip, brotli or
+zstd, whichever the client accepts and the server prefers. Whole bodies
+below a size threshold are left alone, and streamed bodies are compressed
+chunk by chunk. brotli and zstd need the optional `brotli` and `zstandard`
+packages.
+"""
+
+import asyncio
+import logging
+import time
+import zlib
+from core import config, headers, metrics
+from starlette.datastructures import MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("ecofinds")
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+
+class GzipEncoder:
+    def __init__(self, config: config.Server):
+        self._compressor = zlib.compressobj(config.compression_gzip_level, zlib.DEFLATED, 31)
+    def compress(self, data: bytes, final: bool) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class BrotliEncoder:
+    def __init__(self, config: config.Server):
+        self._compressor = brotli.Compressor(quality=config.compression_brotli_quality)
+    def compress(self, data: bytes, final: bool) -> bytes:
+        output = self._compressor.process(data)
+        return output + (self._compressor.finish() if final else self._compressor.flush())
+
+class ZstdEncoder:
+    def __init__(self, config: config.Server):
+        self._compressor = zstandard.ZstdCompressor(level=config.compression_zstd_level).compressobj()
+    def compress(self, data: bytes, final: bool) -> bytes:
+        flush = zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return self._compressor.compress(data) + self._compressor.flush(flush)
+
+ENCODERS = {
+    "gzip": GzipEncoder,
+    "br": BrotliEncoder if brotli is not None else None,
+    "zstd": ZstdEncoder if zstandard is not None else None,
+}
+
+def _encode(encoder, data: bytes, final: bool) -> tuple[bytes, float]:
+    start = time.thread_time()
+    output = encoder.compress(data, final)
+    return output, time.thread_time() - start
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses by Accept-Encoding.
+    Responses that are already encoded, not textual, marked no-transform,
+    or complete and smaller than `compression_min_size` pass through.
+    Bodies and chunks of at least `compression_offload_size` bytes are
+    compressed in a worker thread instead of on the event loop.
+    """
+    def __init__(self, app, config: config.Server, registry: metrics.Registry | None = None):
+        self.app = app
+        self.config = config
+        self.encodings = []
+        for encoding in config.compression_encodings:
+            if encoding not in ENCODERS:
+                raise ValueError(f"Unknown compression encoding: {encoding}")
+            if ENCODERS[encoding] is None:
+                logger.info("%s compression is unavailable; its package is not installed.", encoding)
+                continue
+            self.encodings.append(encoding)
+        self.encodings = tuple(self.encodings)
+        self.bytes_in = self.bytes_saved = self.cpu_seconds = None
+        if registry is not None:
+            self.bytes_in = registry.counter(
+                "http_compression_bytes_in_total",
+                "Response bytes before compression.",
+                ("encoding",)
+            )
+            self.bytes_saved = registry.counter(
+                "http_compression_bytes_saved_total",
+                "Response bytes saved by compression.",
+                ("encoding",)
+            )
+            self.cpu_seconds = registry.counter(
+                "http_compression_cpu_seconds_total",
+                "CPU time spent compressing responses.",
+                ("encoding",)
+            )
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        encoding = headers.negotiate_encoding(accept_encoding, self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressedResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+    def compressible(self, status: int, response_headers: MutableHeaders) -> bool:
+        if status < 200 or status in (204, 304) or "content-encoding" in response_headers:
+            return False
+        if "no-transform" in response_headers.get("cache-control", ""):
+            return False
+        return response_headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+    async def compress(self, encoding: str, encoder, data: bytes, final: bool) -> bytes:
+        if len(data) >= self.config.compression_offload_size:
+            output, cpu = await asyncio.to_thread(_encode, encoder, data, final)
+        else:
+            output, cpu = _encode(encoder, data, final)
+        if self.bytes_in is not None:
+            self.bytes_in.inc(encoding, amount=len(data))
+            self.bytes_saved.inc(encoding, amount=len(data) - len(output))
+            self.cpu_seconds.inc(encoding, amount=cpu)
+        return output
+
+class CompressedResponder:
+    """
+    Compresses one response as its messages pass through.
+    The start message is held back until the first body message shows
+    whether the body is complete and worth compressing.
+    """
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start = None
+        self.encoder = None
+        self.passthrough = False
+    async def send(self, message):
+        if self.passthrough:
+            await self._send(message)
+            return
+        if message["type"] == "http.response.start":
+            response_headers = MutableHeaders(raw=message["headers"])
+            if not self.middleware.compressible(message["status"], response_headers):
+                self.passthrough = True
+                await self._send(message)
+                return
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            # e.g. http.response.pathsend: the file goes out as it is.
+            if self.start is not None:
+                await self._send(self.start)
+                self.start = None
+            self.passthrough = True
+            await self._send(message)
+            return
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.encoder is None:
+            start, self.start = self.start, None
+            response_headers = MutableHeaders(raw=start["headers"])
+            length = response_headers.get("content-length")
+            small = len(body) if not more_body else int(length) if length and length.isdigit() else None
+            if small is not None and small < self.middleware.config.compression_min_size:
+                self.passthrough = True
+                await self._send(start)
+                await self._send(message)
+                return
+            self.encoder = ENCODERS[self.encoding](self.middleware.config)
+            body = await self.middleware.compress(self.encoding, self.encoder, body, final=not more_body)
+            response_headers["Content-Encoding"] = self.encoding
+            response_headers.add_vary_header("Accept-Encoding")
+            etag = response_headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # The encoded bytes differ, so the tag can only match weakly.
+                response_headers["ETag"] = "W/" + etag
+            if more_body:
+                del response_headers["content-length"]
+            else:
+                response_headers["Content-Length"] = str(len(body))
+            await self._send(start)
+        else:
+            body = await self.middleware.compress(self.encoding, self.encoder, body, final=not more_body)
+        await self._send({"type": "http.response.body", "body": body, "more_body": more_body})
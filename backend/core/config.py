@@ -4,8 +4,9 @@ Author: github.com/bugbrekr
 Date: 31/08/2025
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import get_type_hints
+import os
 import toml
 
 @dataclass
@@ -17,12 +18,53 @@ class Server(SubConfig):
     cors_allowed_origins: tuple[str] = (
         "http://localhost:3000",
     )
+    # Token for the X-Admin-Token header on admin endpoints; empty disables them.
+    admin_token: str = ""
+    host: str = "127.0.0.1"
+    port: int = 8000
+    # Worker processes for `manage.py serve`; 0 uses every available core.
+    workers: int = 0
+    # Seconds in-flight requests get to finish on shutdown.
+    graceful_shutdown_timeout: float = 30.0
+    # Response compression codings in order of preference; empty disables
+    # compression. br and zstd are skipped unless the brotli and zstandard
+    # packages are installed.
+    compression_encodings: tuple[str, ...] = ("br", "zstd", "gzip")
+    # Complete responses smaller than this many bytes are sent uncompressed.
+    compression_min_size: int = 1024
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
+    compression_zstd_level: int = 3
+    # Bodies and stream chunks of at least this many bytes are compressed
+    # in a worker thread; lower it when raising the levels above.
+    compression_offload_size: int = 65536
 
 @dataclass
 class Auth(SubConfig):
     login_otp_ttl: int = 300
     login_otp_max_attempts: int = 5
     auth_token_ttl: int = 86400
+    token_cache_size: int = 10000
+    token_cache_ttl: int = 60
+    token_cache_negative_ttl: int = 5
+    # "session" stores tokens in auth_sessions, "jwt" issues signed tokens.
+    token_mode: str = "session"
+    # Signing keys by key id. Keep retired keys here until their tokens expire.
+    jwt_keys: dict[str, str] = field(default_factory=dict)
+    jwt_active_key: str = ""
+    jwt_algorithm: str = "HS256"
+    jwt_issuer: str = "ecofinds"
+    jwt_ttl: int = 3600
+    revocation_refresh_interval: int = 30
+    # scrypt cost parameters. Raising them rehashes passwords on next login.
+    password_hash_n: int = 16384
+    password_hash_r: int = 8
+    password_hash_p: int = 1
+    # Hashing processes per server worker; 0 shares the available cores
+    # between the server workers.
+    password_workers: int = 0
+    # Hashes allowed to wait for a worker before logins are rejected.
+    password_max_queue: int = 256
 
 @dataclass
 class Twilio(SubConfig):
@@ -30,22 +72,182 @@ class Twilio(SubConfig):
     auth_token: str
     sms_from_ph: str
 
+@dataclass
+class SMS(SubConfig):
+    # "twilio" or "fake"
+    provider: str = "twilio"
+    fake_latency: float = 0.0
+    workers: int = 4
+    max_attempts: int = 5
+    backoff_base: float = 2.0
+    backoff_max: float = 300.0
+    poll_interval: float = 1.0
+    lease_seconds: int = 60
+    # Seconds to keep sent and failed messages.
+    retention: int = 86400
+
 @dataclass
 class MongoDB(SubConfig):
     uri: str
     db: str
+    async_mode: bool = True
+    ensure_indexes: bool = True
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    # Milliseconds to wait for a pooled connection; 0 waits indefinitely.
+    wait_queue_timeout_ms: int = 0
+    # Milliseconds before idle pooled connections are closed; 0 keeps them.
+    max_idle_time_ms: int = 0
+    connect_timeout_ms: int = 20000
+    server_selection_timeout_ms: int = 30000
+    # Wire compressors in order of preference: "zstd", "snappy" or "zlib".
+    compressors: tuple[str, ...] = ()
+    # Read preference mode by manager: auth, profile, product, search, cart,
+    # orders or sms. Managers not listed read from the primary. Reads from
+    # secondaries can return data older than the last write; listing cache
+    # refills always read the primary, so stale listings are never cached.
+    read_preferences: dict[str, str] = field(default_factory=dict)
+    max_staleness_seconds: int = -1
+    # Write concern options by collection, e.g. otp_sessions = { w = 1, j = false }.
+    write_concerns: dict[str, dict] = field(default_factory=dict)
+
+@dataclass
+class Search(SubConfig):
+    backend: str = "index"
+    k1: float = 1.2
+    b: float = 0.75
+    title_weight: float = 3.0
+    category_weight: float = 2.0
+    description_weight: float = 1.0
+    # Best-scoring matches ranked for an unfiltered relevance search.
+    max_candidates: int = 1000
+    # Matches considered when a query is filtered, sorted by something other
+    # than relevance or faceted, and the postings read per term for it.
+    # Filters apply to the postings as they are read, so this counts
+    # matching listings. Beyond it, results and facets only cover the
+    # best-scoring matches, and the facets are marked approximate.
+    max_filter_candidates: int = 5000
+    # Highest-impact postings read per query term. Bounds the cost of common
+    # terms; listings matching them only weakly may be missed.
+    max_postings_per_term: int = 2000
+    # Seconds the document frequency of a term over that cap is cached.
+    term_count_ttl: int = 60
+    # Lower bounds of the price facet buckets, at least two, ascending.
+    # Prices at or above the last bound share one open-ended bucket; prices
+    # below the first one, or missing, are counted as `price_other`.
+    facet_price_boundaries: tuple[float, ...] = (0, 10, 25, 50, 100, 250, 500, 1000)
+    # Most frequent values returned for the category and seller facets.
+    facet_limit: int = 20
+
+@dataclass
+class ListingCache(SubConfig):
+    size: int = 10000
+    ttl: int = 300
+    negative_ttl: int = 30
+    change_stream: bool = True
+
+@dataclass
+class SearchCache(SubConfig):
+    # Cached search result pages; 0 disables the cache.
+    size: int = 2000
+    ttl: int = 30
+    # Cache-Control max-age for search responses.
+    max_age: int = 10
+
+@dataclass
+class Autocomplete(SubConfig):
+    enabled: bool = True
+    # Suggestions kept per prefix, and the most a lookup returns.
+    max_suggestions: int = 10
+    # Trie depth; longer prefixes are matched by filtering the phrases stored
+    # under their first `max_prefix_length` characters.
+    max_prefix_length: int = 24
+    # Approximate memory for the index; the least popular phrases are left
+    # out once it is reached.
+    memory_mb: int = 64
+    # Seconds between rebuilds from product_listings, which pick up writes
+    # made by other worker processes; 0 builds the index once. Every worker
+    # rebuilds its own index, so each rebuild costs one collection scan per
+    # worker.
+    refresh_interval: int = 300
+    # With the listing change stream running, new listings are added as
+    # their change events arrive, and the index is only rebuilt for title or
+    # category edits and deletions, at most once per this many seconds.
+    rebuild_interval: int = 1800
+
+@dataclass
+class Ingest(SubConfig):
+    batch_size: int = 1000
+    # Row errors kept in an import report; further errors are only counted.
+    max_errors: int = 1000
+    # Longest record, in characters, an import accepts. Parsing reads this
+    # far ahead, so it bounds an import's memory; longer records stop it.
+    max_record_size: int = 1 << 20
+
+@dataclass
+class Metrics(SubConfig):
+    enabled: bool = True
+    # Attribute MongoDB commands to routes through a driver command listener.
+    mongo_commands: bool = True
+
+@dataclass
+class SlowQueryLog(SubConfig):
+    enabled: bool = True
+    threshold_ms: float = 100.0
+    # Fraction of slow commands recorded.
+    sample_rate: float = 1.0
+    buffer_size: int = 200
+    explain: bool = True
+    # Slow commands waiting to be explained; more are recorded unexplained.
+    explain_queue: int = 16
+
+@dataclass
+class Static(SubConfig):
+    enabled: bool = True
+    # Frontend sources for `manage.py build-static`.
+    source: str = "../frontend"
+    # Build served by the app; nothing is served until it has been built.
+    directory: str = "build/static"
+    root_page: str = "home/index.html"
+    not_found_page: str = "404/index.html"
+    # Files up to this many bytes are served from memory, larger ones from disk.
+    memory_max_size: int = 262144
 
 @dataclass
 class Config:
     server: Server
     auth: Auth
     twilio: Twilio
+    sms: SMS
     mongodb: MongoDB
+    search: Search
+    listing_cache: ListingCache
+    search_cache: SearchCache
+    autocomplete: Autocomplete
+    ingest: Ingest
+    metrics: Metrics
+    slow_query_log: SlowQueryLog
+    static: Static
     def __init__(self, config: dict[str, dict[str, str]]):
         registered_types = get_type_hints(self)
         for k, v in config.items():
             if k in registered_types:
                 setattr(self, k, registered_types[k](**v))
+        for k, t in registered_types.items():
+            if not hasattr(self, k):
+                try:
+                    setattr(self, k, t())
+                except TypeError:
+                    # Sections with required fields are None when absent.
+                    setattr(self, k, None)
+
+def available_cores() -> int:
+    """
+    Cores this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
 
 def load_config(config_file: str = "config.toml") -> Config:
     """
@@ -0,0 +1,190 @@
+"""
+Per-process application services.
+The container owns the MongoDB client, the managers built on it and their
+background tasks. Build it once the serving process has started, e.g. in
+the FastAPI lifespan, never before a fork: pymongo clients and their
+monitor threads must not cross a fork.
+"""
+
+from core import auth, cart, config, database, metrics, orders, product, profile, sms
+import asyncio
+import logging
+
+logger = logging.getLogger("ecofinds")
+
+class Container:
+    """
+    Database client and managers for one process.
+    """
+    def __init__(self, config: config.Config, event_listeners: list | None = None):
+        self.config = config
+        self.db = database.connect(config.mongodb, event_listeners)
+        self.sms_outbox = sms.SMSOutbox(db=self.db.for_manager("sms"), config=config.sms)
+        self.authorization_manager = auth.AuthorizationManager(
+            config=config.auth,
+            db=self.db.for_manager("auth"),
+            outbox=self.sms_outbox,
+            server_workers=config.server.workers or 1,
+        )
+        self.profile_manager = profile.ProfileManager(db=self.db.for_manager("profile"))
+        self.product_manager = product.ProductListingManager(
+            db=self.db.for_manager("product"),
+            config=config.search,
+            cache_config=config.listing_cache,
+            search_db=self.db.for_manager("search"),
+            autocomplete_config=config.autocomplete,
+            search_cache_config=config.search_cache
+        )
+        self.cart_manager = cart.CartManager(db=self.db.for_manager("cart"))
+        self.order_manager = orders.OrderManager(db=self.db.for_manager("orders"))
+        self._tasks: list[asyncio.Task] = []
+    @property
+    def managers(self) -> tuple:
+        return (
+            self.authorization_manager,
+            self.profile_manager,
+            self.product_manager,
+            self.cart_manager,
+            self.order_manager,
+            self.sms_outbox,
+        )
+    def index_registry(self) -> database.IndexRegistry:
+        """
+        Returns the indexes declared by every manager.
+        """
+        registry = database.IndexRegistry()
+        for manager in self.managers:
+            manager.register_indexes(registry)
+        return registry
+    def register_metrics(self, registry: metrics.Registry):
+        """
+        Exports cache, autocomplete and password hasher statistics from this
+        container.
+        """
+        caches = (
+            ("token", self.authorization_manager.token_cache),
+            ("listing", self.product_manager.cache),
+            ("search", self.product_manager.search_cache),
+        )
+        search_flights = self.product_manager.search_flights
+        password_hasher = self.authorization_manager.password_hasher
+        def cache_stat(stat: str):
+            return lambda: {(name,): cache.stats()[stat] for name, cache in caches}
+        def cache_lookups() -> dict:
+            lookups = {}
+            for name, cache in caches:
+                stats = cache.stats()
+                lookups[(name, "hit")] = stats["hits"]
+                lookups[(name, "miss")] = stats["misses"]
+            return lookups
+        registry.gauge(
+            "cache_lookups_total",
+            "In-process cache lookups by result.",
+            ("cache", "result"),
+            cache_lookups,
+            kind="counter"
+        )
+        registry.gauge(
+            "cache_hit_ratio",
+            "Share of in-process cache lookups that hit, since startup.",
+            ("cache",),
+            cache_stat("hit_rate")
+        )
+        registry.gauge(
+            "cache_evictions_total",
+            "Entries dropped from in-process caches to make room.",
+            ("cache",),
+            cache_stat("evictions"),
+            kind="counter"
+        )
+        registry.gauge(
+            "cache_expirations_total",
+            "Entries found expired in in-process caches.",
+            ("cache",),
+            cache_stat("expirations"),
+            kind="counter"
+        )
+        registry.gauge(
+            "cache_invalidations_total",
+            "Entries dropped from in-process caches by writes.",
+            ("cache",),
+            cache_stat("invalidations"),
+            kind="counter"
+        )
+        registry.gauge(
+            "cache_entries",
+            "Entries held by in-process caches.",
+            ("cache",),
+            cache_stat("size")
+        )
+        registry.gauge(
+            "search_coalesced_total",
+            "Searches that waited for an identical search already in flight.",
+            (),
+            lambda: {(): search_flights.coalesced},
+            kind="counter"
+        )
+        if self.product_manager.autocomplete is not None:
+            autocomplete = self.product_manager.autocomplete
+            registry.gauge(
+                "autocomplete_index",
+                "Autocomplete phrases, trie nodes and estimated bytes.",
+                ("measure",),
+                lambda: {(measure,): value for measure, value in autocomplete.stats().items()}
+            )
+        registry.gauge(
+            "password_hash_queue_depth",
+            "Password hashes waiting for a worker.",
+            (),
+            lambda: {(): password_hasher.queued}
+        )
+        registry.gauge(
+            "password_hash_in_flight",
+            "Password hashes running in the worker pool.",
+            (),
+            lambda: {(): password_hasher.in_flight}
+        )
+        registry.gauge(
+            "password_hash_rejected_total",
+            "Password hashes rejected because the queue was full.",
+            (),
+            lambda: {(): password_hasher.rejected},
+            kind="counter"
+        )
+    async def start(self):
+        """
+        Applies indexes, if enabled, upgrades the search index and starts
+        the background workers.
+        """
+        if self.config.mongodb.ensure_indexes:
+            for status in await self.index_registry().apply(self.db):
+                if status.status in ("different", "failed"):
+                    logger.warning(
+                        "Index %s.%s is %s: %s",
+                        status.collection, status.name, status.status, status.detail
+                    )
+        await self.product_manager.search_index.upgrade()
+        if self.config.sms.workers > 0:
+            provider = sms.provider_factory(self.config.sms, self.config.twilio)
+            self.spawn(self.sms_outbox.run(provider))
+        if self.config.listing_cache.change_stream:
+            self.spawn(self.product_manager.watch_listing_changes())
+        if self.product_manager.autocomplete is not None:
+            self.spawn(self.product_manager.autocomplete.run(self.product_manager.db["product_listings"]))
+    def spawn(self, coroutine) -> asyncio.Task:
+        """
+        Runs a background task until the container is closed.
+        """
+        task = asyncio.create_task(coroutine)
+        self._tasks.append(task)
+        return task
+    async def close(self):
+        """
+        Stops background tasks, the password hashing pool and the client.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.authorization_manager.password_hasher.close()
+        await database.close(self.db)
@@ -1,7 +1,678 @@
+import asyncio
+import base64
+import collections
+import dataclasses
+import datetime
+import inspect
+import itertools
+import json
+import random
+import threading
 import pymongo
+import pymongo.asynchronous.database
+import pymongo.database
+import pymongo.errors
+import pymongo.monitoring
+import pymongo.read_preferences
+from core import config
 
-def factory(uri: str, db_name: str):
+class ThreadedCursor:
+    """
+    Awaitable wrapper around a blocking pymongo cursor.
+    Mirrors the subset of the async pymongo cursor API used by the managers.
+    """
+    def __init__(self, open_cursor, batch_size: int = 100):
+        self._open_cursor = open_cursor
+        self._cursor = None
+        self._batch_size = batch_size
+        self._buffer = collections.deque()
+        self._exhausted = False
+    def _ensure(self):
+        if self._cursor is None:
+            self._cursor = self._open_cursor()
+        return self._cursor
+    def _chain(self, method: str, *args, **kwargs) -> "ThreadedCursor":
+        getattr(self._ensure(), method)(*args, **kwargs)
+        return self
+    def sort(self, *args, **kwargs) -> "ThreadedCursor":
+        return self._chain("sort", *args, **kwargs)
+    def skip(self, *args, **kwargs) -> "ThreadedCursor":
+        return self._chain("skip", *args, **kwargs)
+    def limit(self, *args, **kwargs) -> "ThreadedCursor":
+        return self._chain("limit", *args, **kwargs)
+    def batch_size(self, batch_size: int) -> "ThreadedCursor":
+        self._batch_size = batch_size
+        return self._chain("batch_size", batch_size)
+    def _take(self, length: int | None) -> list:
+        cursor = self._ensure()
+        if length is None:
+            return list(cursor)
+        return list(itertools.islice(cursor, length))
+    async def to_list(self, length: int | None = None) -> list:
+        """
+        Fetches up to `length` documents (all if None).
+        """
+        docs = list(self._buffer)
+        self._buffer.clear()
+        if length is not None:
+            length = max(length - len(docs), 0)
+        docs.extend(await asyncio.to_thread(self._take, length))
+        return docs
+    async def explain(self) -> dict:
+        return await asyncio.to_thread(lambda: self._ensure().explain())
+    async def close(self):
+        if self._cursor is not None:
+            await asyncio.to_thread(self._cursor.close)
+    def __aiter__(self):
+        return self
+    async def __anext__(self):
+        if not self._buffer and not self._exhausted:
+            batch = await asyncio.to_thread(self._take, self._batch_size)
+            if len(batch) < self._batch_size:
+                self._exhausted = True
+            self._buffer.extend(batch)
+        if not self._buffer:
+            raise StopAsyncIteration
+        return self._buffer.popleft()
+
+class ThreadedChangeStream:
+    """
+    Awaitable wrapper around a blocking pymongo change stream.
+    Polls with `try_next` so no worker thread stays blocked for longer than
+    the server's await time, letting the consuming task be cancelled.
+    """
+    def __init__(self, open_stream):
+        self._open_stream = open_stream
+        self._stream = None
+    async def close(self):
+        if self._stream is not None:
+            await asyncio.to_thread(self._stream.close)
+    def __aiter__(self):
+        return self
+    async def __anext__(self):
+        if self._stream is None:
+            self._stream = await asyncio.to_thread(self._open_stream)
+        while True:
+            change = await asyncio.to_thread(self._stream.try_next)
+            if change is not None:
+                return change
+            if not self._stream.alive:
+                raise StopAsyncIteration
+
+class ThreadedCollection:
+    """
+    Awaitable wrapper around a blocking pymongo collection.
+    Every driver call runs in the default thread pool.
+    """
+    def __init__(self, collection: pymongo.collection.Collection):
+        self.delegate = collection
+    @property
+    def name(self) -> str:
+        return self.delegate.name
+    def find(self, *args, **kwargs) -> ThreadedCursor:
+        cursor = self.delegate.find(*args, **kwargs)
+        return ThreadedCursor(lambda: cursor)
+    async def aggregate(self, pipeline: list[dict], **kwargs) -> ThreadedCursor:
+        return ThreadedCursor(lambda: self.delegate.aggregate(pipeline, **kwargs))
+    async def watch(self, *args, **kwargs) -> ThreadedChangeStream:
+        kwargs.setdefault("max_await_time_ms", 1000)
+        return ThreadedChangeStream(lambda: self.delegate.watch(*args, **kwargs))
+    def __getattr__(self, name: str):
+        attr = getattr(self.delegate, name)
+        if not callable(attr):
+            return attr
+        async def method(*args, **kwargs):
+            return await asyncio.to_thread(attr, *args, **kwargs)
+        return method
+
+class ThreadedDatabase:
+    """
+    Awaitable wrapper around a blocking pymongo database.
+    Used when `MongoDB.async_mode` is disabled, so the managers keep a
+    single async code path on top of either driver.
+    """
+    def __init__(self, db: pymongo.database.Database):
+        self.delegate = db
+    @property
+    def name(self) -> str:
+        return self.delegate.name
+    @property
+    def client(self):
+        return self.delegate.client
+    def get_collection(self, name: str, **kwargs) -> ThreadedCollection:
+        return ThreadedCollection(self.delegate.get_collection(name, **kwargs))
+    def __getitem__(self, name: str) -> ThreadedCollection:
+        return self.get_collection(name)
+    async def command(self, *args, **kwargs) -> dict:
+        return await asyncio.to_thread(self.delegate.command, *args, **kwargs)
+    async def list_collection_names(self, *args, **kwargs) -> list[str]:
+        return await asyncio.to_thread(self.delegate.list_collection_names, *args, **kwargs)
+
+READ_PREFERENCES = {
+    "primary": pymongo.read_preferences.Primary,
+    "primaryPreferred": pymongo.read_preferences.PrimaryPreferred,
+    "secondary": pymongo.read_preferences.Secondary,
+    "secondaryPreferred": pymongo.read_preferences.SecondaryPreferred,
+    "nearest": pymongo.read_preferences.Nearest,
+}
+
+def read_preference(mode: str, max_staleness: int = -1):
+    """
+    Builds a read preference from its mode name.
+    Raises ValueError on an unknown mode.
+    """
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference: {mode}")
+    if mode == "primary":
+        return pymongo.read_preferences.Primary()
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+class ConfiguredDatabase:
+    """
+    Database wrapper that applies the configured per-collection write
+    concerns, and optionally a read preference, to every collection it
+    hands out. `for_manager` derives the database a manager should use.
+    """
+    def __init__(
+            self,
+            db,
+            config: config.MongoDB,
+            read_preference=None,
+            write_concerns: dict[str, pymongo.WriteConcern] | None = None
+        ):
+        self.delegate = db
+        self.config = config
+        self.read_preference = read_preference
+        if write_concerns is None:
+            write_concerns = {
+                collection: pymongo.WriteConcern(**options)
+                for collection, options in config.write_concerns.items()
+            }
+        self.write_concerns = write_concerns
+        self._collections = {}
+    def for_manager(self, manager: str) -> "ConfiguredDatabase":
+        """
+        Returns this database with the read preference configured for
+        `manager` in `MongoDB.read_preferences`, if any.
+        """
+        mode = self.config.read_preferences.get(manager)
+        if mode is None:
+            return self
+        return ConfiguredDatabase(
+            self.delegate,
+            self.config,
+            read_preference=read_preference(mode, self.config.max_staleness_seconds),
+            write_concerns=self.write_concerns
+        )
+    def _options(self, name: str) -> dict:
+        options = {}
+        if self.read_preference is not None:
+            options["read_preference"] = self.read_preference
+        if name in self.write_concerns:
+            options["write_concern"] = self.write_concerns[name]
+        return options
+    def get_collection(self, name: str, **kwargs):
+        if kwargs:
+            return self.delegate.get_collection(name, **(self._options(name) | kwargs))
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = self.delegate.get_collection(name, **self._options(name))
+        return collection
+    def __getitem__(self, name: str):
+        return self.get_collection(name)
+    def __getattr__(self, name: str):
+        return getattr(self.delegate, name)
+
+AsyncDatabase = pymongo.asynchronous.database.AsyncDatabase | ThreadedDatabase | ConfiguredDatabase
+
+def factory(
+        uri: str,
+        db_name: str,
+        async_mode: bool = False,
+        event_listeners: list | None = None,
+        **options
+    ) -> AsyncDatabase:
     """
     Creates a MongoDB database client.
+    Uses pymongo's asyncio client in async mode, otherwise the blocking
+    client behind a thread pool.
+    Extra keyword arguments are passed to the client.
+    A `mongomock://` URI gives an in-memory database for benchmarks and
+    local runs, and needs the `mongomock` package. It ignores
+    `event_listeners` and client options.
+    """
+    if uri.startswith("mongomock://"):
+        import mongomock
+        return ThreadedDatabase(mongomock.MongoClient()[db_name])
+    if event_listeners:
+        options["event_listeners"] = event_listeners
+    if async_mode:
+        return pymongo.AsyncMongoClient(uri, **options)[db_name]
+    return ThreadedDatabase(pymongo.MongoClient(uri, **options)[db_name])
+
+def client_options(config: config.MongoDB) -> dict:
+    """
+    Translates `MongoDB` pool, timeout and compression settings into
+    client options.
+    """
+    options = {
+        "maxPoolSize": config.max_pool_size,
+        "minPoolSize": config.min_pool_size,
+        "connectTimeoutMS": config.connect_timeout_ms,
+        "serverSelectionTimeoutMS": config.server_selection_timeout_ms,
+    }
+    if config.wait_queue_timeout_ms:
+        options["waitQueueTimeoutMS"] = config.wait_queue_timeout_ms
+    if config.max_idle_time_ms:
+        options["maxIdleTimeMS"] = config.max_idle_time_ms
+    if config.compressors:
+        options["compressors"] = ",".join(config.compressors)
+    return options
+
+def connect(config: config.MongoDB, event_listeners: list | None = None) -> ConfiguredDatabase:
+    """
+    Creates the application database from `MongoDB` settings.
+    """
+    db = factory(
+        uri=config.uri,
+        db_name=config.db,
+        async_mode=config.async_mode,
+        event_listeners=event_listeners,
+        **client_options(config)
+    )
+    return ConfiguredDatabase(db, config)
+
+async def close(db: AsyncDatabase):
+    """
+    Closes the client behind `db`; only the asyncio client's close is awaitable.
+    """
+    closed = db.client.close()
+    if inspect.isawaitable(closed):
+        await closed
+
+class PoolStats(pymongo.monitoring.ConnectionPoolListener):
+    """
+    Tracks connection pool utilization across all servers.
+    """
+    def __init__(self, max_pool_size: int):
+        self.max_pool_size = max_pool_size
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.created = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+        self._lock = threading.Lock()
+    def _add(self, **changes):
+        with self._lock:
+            for name, change in changes.items():
+                setattr(self, name, getattr(self, name) + change)
+    def pool_created(self, event):
+        pass
+    def pool_ready(self, event):
+        pass
+    def pool_cleared(self, event):
+        self._add(pool_clears=1)
+    def pool_closed(self, event):
+        pass
+    def connection_created(self, event):
+        self._add(open=1, created=1)
+    def connection_ready(self, event):
+        pass
+    def connection_closed(self, event):
+        self._add(open=-1)
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, checkout_failures=1)
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, in_use=1)
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+    def stats(self) -> dict:
+        return {
+            "max_pool_size": self.max_pool_size,
+            "open": self.open,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "created": self.created,
+            "checkout_failures": self.checkout_failures,
+            "pool_clears": self.pool_clears,
+        }
+
+def utcnow() -> datetime.datetime:
+    """
+    Returns the current UTC time as a naive datetime, matching what pymongo
+    returns for stored dates.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+@dataclasses.dataclass(frozen=True)
+class IndexSpec:
+    """
+    Declarative description of a MongoDB index.
+    """
+    collection: str
+    keys: tuple[tuple[str, int], ...]
+    name: str
+    unique: bool = False
+    expire_after_seconds: int | None = None
+    partial_filter_expression: dict | None = None
+    def options(self) -> dict:
+        options = {"name": self.name}
+        if self.unique:
+            options["unique"] = True
+        if self.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = self.expire_after_seconds
+        if self.partial_filter_expression is not None:
+            options["partialFilterExpression"] = self.partial_filter_expression
+        return options
+
+@dataclasses.dataclass
+class IndexStatus:
+    """
+    Result of comparing or applying an IndexSpec.
+    `status` is one of ok, missing, different, unregistered, created,
+    updated or failed.
+    """
+    collection: str
+    name: str
+    status: str
+    detail: str = ""
+
+class IndexRegistry:
+    """
+    Collects the indexes each manager needs and applies them idempotently.
+    """
+    def __init__(self):
+        self._specs: dict[tuple[str, str], IndexSpec] = {}
+    def add(
+            self,
+            collection: str,
+            keys: str | list[tuple[str, int]],
+            name: str | None = None,
+            unique: bool = False,
+            expire_after_seconds: int | None = None,
+            partial_filter_expression: dict | None = None
+        ) -> IndexSpec:
+        """
+        Registers an index. Keys use pymongo's format.
+        """
+        if isinstance(keys, str):
+            keys = [(keys, pymongo.ASCENDING)]
+        keys = tuple((field, direction) for field, direction in keys)
+        spec = IndexSpec(
+            collection=collection,
+            keys=keys,
+            name=name or "_".join(f"{field}_{direction}" for field, direction in keys),
+            unique=unique,
+            expire_after_seconds=expire_after_seconds,
+            partial_filter_expression=partial_filter_expression
+        )
+        self._specs[(collection, spec.name)] = spec
+        return spec
+    def specs(self) -> list[IndexSpec]:
+        return list(self._specs.values())
+    def collections(self) -> list[str]:
+        return sorted({spec.collection for spec in self._specs.values()})
+    @staticmethod
+    def _compare(spec: IndexSpec, info: dict) -> str:
+        differences = []
+        if tuple((field, int(direction)) for field, direction in info.get("key", [])) != spec.keys:
+            differences.append("keys")
+        if bool(info.get("unique", False)) != spec.unique:
+            differences.append("unique")
+        if info.get("expireAfterSeconds") != spec.expire_after_seconds:
+            differences.append("expireAfterSeconds")
+        if info.get("partialFilterExpression") != spec.partial_filter_expression:
+            differences.append("partialFilterExpression")
+        return ", ".join(differences)
+    async def diff(self, db: AsyncDatabase) -> list[IndexStatus]:
+        """
+        Compares the registry with the indexes present in the database.
+        """
+        report = []
+        for collection in self.collections():
+            existing = await db[collection].index_information()
+            registered = set()
+            for spec in self._specs.values():
+                if spec.collection != collection:
+                    continue
+                registered.add(spec.name)
+                if spec.name not in existing:
+                    report.append(IndexStatus(collection, spec.name, "missing"))
+                    continue
+                differences = self._compare(spec, existing[spec.name])
+                if differences:
+                    report.append(IndexStatus(collection, spec.name, "different", differences))
+                else:
+                    report.append(IndexStatus(collection, spec.name, "ok"))
+            for name in sorted(set(existing) - registered - {"_id_"}):
+                report.append(IndexStatus(collection, name, "unregistered"))
+        return report
+    async def apply(self, db: AsyncDatabase) -> list[IndexStatus]:
+        """
+        Creates missing indexes and updates TTLs that drifted.
+        Other differences are reported and left for an operator to resolve.
+        """
+        report = []
+        for status in await self.diff(db):
+            spec = self._specs.get((status.collection, status.name))
+            if status.status == "missing":
+                try:
+                    await db[spec.collection].create_index(list(spec.keys), **spec.options())
+                    report.append(IndexStatus(spec.collection, spec.name, "created"))
+                except pymongo.errors.PyMongoError as e:
+                    report.append(IndexStatus(spec.collection, spec.name, "failed", str(e)))
+            elif status.status == "different" and status.detail == "expireAfterSeconds":
+                try:
+                    await db.command(
+                        "collMod",
+                        spec.collection,
+                        index={"name": spec.name, "expireAfterSeconds": spec.expire_after_seconds}
+                    )
+                    report.append(IndexStatus(spec.collection, spec.name, "updated", status.detail))
+                except pymongo.errors.PyMongoError as e:
+                    report.append(IndexStatus(spec.collection, spec.name, "failed", str(e)))
+            else:
+                report.append(status)
+        return report
+
+def encode_cursor(values: list) -> str:
+    """
+    Encodes keyset pagination values into an opaque cursor string.
+    """
+    payload = [
+        {"$date": value.isoformat()} if isinstance(value, datetime.datetime) else value
+        for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Decodes a cursor created by `encode_cursor`.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list):
+            raise ValueError("Cursor payload is not a list.")
+        return [
+            datetime.datetime.fromisoformat(value["$date"]) if isinstance(value, dict) else value
+            for value in payload
+        ]
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+def keyset_filter(sort: list[tuple[str, int]], values: list) -> dict:
+    """
+    Builds a filter matching documents strictly after `values` in `sort` order.
+    """
+    if len(values) != len(sort):
+        raise ValueError("Invalid cursor.")
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prev_field: value for (prev_field, _), value in zip(sort[:i], values[:i])}
+        clause[field] = {"$gt" if direction == pymongo.ASCENDING else "$lt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+# Command fields added by the driver rather than the application.
+DRIVER_FIELDS = frozenset({"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"})
+# Read commands whose plans can be explained.
+EXPLAINABLE = frozenset({"find", "aggregate", "count", "distinct"})
+# Command fields holding query shapes worth recording.
+SHAPE_FIELDS = ("filter", "query", "pipeline", "sort", "projection", "updates", "deletes", "update", "key")
+
+def redact(value):
+    """
+    Replaces the values in a query with "?", keeping field names and
+    operators, so queries of the same shape look alike and no user data
+    is recorded.
+    """
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, dict) for item in value):
+            return [redact(item) for item in value]
+        return "?"
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value in (1, -1):
+        # Sort directions and projection flags are part of the shape.
+        return value
+    return "?"
+
+def error_name(failure: dict | None) -> str:
+    """
+    Names a server error by its code, without the message, which may quote
+    the values involved (e.g. the duplicate key).
+    """
+    failure = failure or {}
+    code = failure.get("code")
+    name = failure.get("codeName")
+    if name and code is not None:
+        return f"{name} ({code})"
+    if code is not None:
+        return f"Error {code}"
+    return "Command failed"
+
+def _plan_stages(plan: dict) -> list[str]:
+    stages = []
+    while plan:
+        stage = plan.get("stage", "")
+        if stage == "IXSCAN" and plan.get("indexName"):
+            stage = f"IXSCAN {plan['indexName']}"
+        stages.append(stage)
+        for key in ("inputStage", "queryPlan"):
+            if key in plan:
+                plan = plan[key]
+                break
+        else:
+            for child in plan.get("inputStages", []):
+                stages.extend(_plan_stages(child))
+            break
+    return stages
+
+def summarize_explain(result: dict) -> dict:
+    """
+    Reduces explain output to the winning plan's stages and the
+    examined/returned counts.
+    """
+    cursor = result
+    if "queryPlanner" not in result and result.get("stages"):
+        cursor = result["stages"][0].get("$cursor", {})
+    planner = cursor.get("queryPlanner", {})
+    stats = cursor.get("executionStats", {})
+    stages = _plan_stages(planner.get("winningPlan", {}))
+    return {
+        "plan": stages,
+        "collection_scan": "COLLSCAN" in stages,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+        "execution_ms": stats.get("executionTimeMillis"),
+    }
+
+class SlowQueryRecorder(pymongo.monitoring.CommandListener):
+    """
+    Records commands slower than `SlowQueryLog.threshold_ms` in a ring buffer.
+    Slow commands are sampled at `SlowQueryLog.sample_rate`. Sampled reads
+    are explained in the background by `run`, at most `explain_queue` at a
+    time, so the recorder adds no work to the requests it measures.
     """
-    return pymongo.MongoClient(uri)[db_name]
+    def __init__(self, config: config.SlowQueryLog):
+        self.config = config
+        self.records: collections.deque = collections.deque(maxlen=config.buffer_size)
+        self.seen = 0
+        self.dropped_explains = 0
+        self._pending: dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._explains: asyncio.Queue | None = None
+    @staticmethod
+    def _key(event) -> tuple:
+        return event.connection_id, event.request_id
+    def started(self, event: pymongo.monitoring.CommandStartedEvent):
+        with self._lock:
+            self._pending[self._key(event)] = event.command
+    def succeeded(self, event: pymongo.monitoring.CommandSucceededEvent):
+        self._finish(event, event.reply, error=None)
+    def failed(self, event: pymongo.monitoring.CommandFailedEvent):
+        self._finish(event, {}, error=error_name(event.failure))
+    def _finish(self, event, reply: dict, error: str | None):
+        duration_ms = event.duration_micros / 1000
+        with self._lock:
+            command = self._pending.pop(self._key(event), None)
+            if command is None or duration_ms < self.config.threshold_ms:
+                return
+            self.seen += 1
+        if self.config.sample_rate < 1 and random.random() >= self.config.sample_rate:
+            return
+        collection = command.get(event.command_name)
+        record = {
+            "time": utcnow(),
+            "database": event.database_name,
+            "collection": collection if isinstance(collection, str) else None,
+            "command": event.command_name,
+            "duration_ms": round(duration_ms, 2),
+            "shape": {field: redact(command[field]) for field in SHAPE_FIELDS if field in command},
+            "returned": len(reply.get("cursor", {}).get("firstBatch", [])) if "cursor" in reply else reply.get("n"),
+            "error": error,
+            "explain": None,
+        }
+        self.records.append(record)
+        if self.config.explain and event.command_name in EXPLAINABLE and self._loop is not None:
+            explainable = {
+                key: value for key, value in command.items()
+                if not key.startswith("$") and key not in DRIVER_FIELDS
+            }
+            self._loop.call_soon_threadsafe(self._queue_explain, explainable, record)
+    def _queue_explain(self, command: dict, record: dict):
+        try:
+            self._explains.put_nowait((command, record))
+        except asyncio.QueueFull:
+            self.dropped_explains += 1
+    def recent(self, limit: int | None = None) -> list[dict]:
+        """
+        Returns recorded slow commands, newest first.
+        """
+        records = list(reversed(self.records))
+        return records[:limit] if limit else records
+    async def run(self, db: AsyncDatabase):
+        """
+        Explains queued slow commands against `db` until cancelled.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._explains = asyncio.Queue(maxsize=self.config.explain_queue)
+        try:
+            while True:
+                command, record = await self._explains.get()
+                try:
+                    result = await db.command({"explain": command, "verbosity": "executionStats"})
+                    record["explain"] = summarize_explain(result)
+                except pymongo.errors.OperationFailure as e:
+                    record["explain"] = {"error": error_name(e.details)}
+                except Exception as e:
+                    record["explain"] = {"error": type(e).__name__}
+        finally:
+            self._loop = None
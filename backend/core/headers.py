@@ -0,0 +1,50 @@
+"""
+HTTP header helpers shared by the API, static files and compression.
+"""
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches `etag`, compared weakly.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tag = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in if_none_match.split(","))
+
+def accepted_encodings(accept_encoding: str | None) -> dict[str, float]:
+    """
+    Parses an Accept-Encoding header into a mapping of coding to q-value.
+    Codings refused with q=0 are kept, mapped to 0.
+    """
+    encodings = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[coding] = max(quality, 0.0)
+    return encodings
+
+def negotiate_encoding(accept_encoding: str | None, available: tuple[str, ...]) -> str | None:
+    """
+    Picks the coding from `available`, in order of preference, that the
+    client accepts with the highest q-value. Returns None for identity.
+    A `*` only stands for codings the header does not name.
+    """
+    accepted = accepted_encodings(accept_encoding)
+    best, best_quality = None, 0.0
+    for coding in available:
+        quality = accepted[coding] if coding in accepted else accepted.get("*", 0.0)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
@@ -0,0 +1,195 @@
+"""
+Bulk product listing ingest.
+Parses CSV or NDJSON incrementally from a stream of byte chunks and
+validates each row, so imports run in constant memory regardless of size.
+"""
+
+import codecs
+import collections
+import csv
+import dataclasses
+import orjson
+import pydantic
+
+FORMATS = ("csv", "ndjson")
+# Separator for multiple picture URLs in a single CSV cell.
+CSV_PICTURE_SEPARATOR = "|"
+
+class ListingRow(pydantic.BaseModel):
+    """
+    A single listing in an import file.
+    """
+    model_config = pydantic.ConfigDict(extra="ignore", str_strip_whitespace=True)
+    product_id: str | None = pydantic.Field(default=None, min_length=1, max_length=64)
+    title: str = pydantic.Field(min_length=1)
+    description: str = ""
+    price: float = pydantic.Field(ge=0)
+    category: str = pydantic.Field(min_length=1)
+    pictures: list[str] = []
+    seller_email: str | None = None
+    @pydantic.field_validator("pictures", mode="before")
+    @classmethod
+    def split_pictures(cls, value):
+        if isinstance(value, str):
+            return [p.strip() for p in value.split(CSV_PICTURE_SEPARATOR) if p.strip()]
+        return value
+    @pydantic.field_validator("product_id", "seller_email", mode="before")
+    @classmethod
+    def empty_as_none(cls, value):
+        return value or None
+
+@dataclasses.dataclass
+class ImportReport:
+    """
+    Outcome of a bulk import.
+    Only the first `max_errors` errors are kept; `failed` counts all of them.
+    """
+    rows: int = 0
+    inserted: int = 0
+    failed: int = 0
+    errors: list[dict] = dataclasses.field(default_factory=list)
+    max_errors: int = 1000
+    def error(self, row: int, message: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row, "error": message})
+    def as_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+class RecordTooLarge(Exception):
+    """
+    Raised when a record is longer than the import's maximum record size.
+    """
+
+async def iter_lines(chunks, max_size: int | None = None):
+    """
+    Splits an async iterator of UTF-8 byte chunks into lines.
+    Raises RecordTooLarge if a line grows beyond `max_size` characters.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.removesuffix("\r")
+        if max_size is not None and len(pending) > max_size:
+            raise RecordTooLarge
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.removesuffix("\r")
+
+async def iter_ndjson(chunks, max_record_size: int):
+    """
+    Yields (line number, record or error message) for each non-blank line.
+    A line longer than `max_record_size` ends the import with an error.
+    """
+    line_number = 0
+    try:
+        async for line in iter_lines(chunks, max_record_size):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record = orjson.loads(line)
+            except ValueError as e:
+                yield line_number, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, "Expected a JSON object."
+                continue
+            yield line_number, record
+    except RecordTooLarge:
+        yield line_number + 1, f"Line exceeds {max_record_size} characters; import stopped."
+
+class _LineBuffer:
+    """
+    Lines read ahead of a csv.reader. Running out before the input ends
+    means the record being read is longer than the read-ahead.
+    """
+    def __init__(self):
+        self.lines = collections.deque()
+        self.size = 0
+        self.exhausted = False
+    def append(self, line: str):
+        self.lines.append(line)
+        self.size += len(line)
+    def __iter__(self):
+        return self
+    def __next__(self) -> str:
+        if not self.lines:
+            if self.exhausted:
+                raise StopIteration
+            raise RecordTooLarge
+        line = self.lines.popleft()
+        self.size -= len(line)
+        return line
+
+async def iter_csv(chunks, max_record_size: int):
+    """
+    Yields (line number, record or error message) for each CSV record,
+    numbered by the line it starts on. The first record is the header.
+    A single csv.reader parses the whole input, so quoted fields may span
+    lines and quotes inside unquoted fields are literal. More than
+    `max_record_size` characters are read ahead of it; a record longer
+    than that ends the import with an error, which bounds memory.
+    """
+    lines = iter_lines(chunks, max_record_size)
+    buffer = _LineBuffer()
+    reader = csv.reader(buffer, strict=True)
+    header = None
+    while True:
+        start = reader.line_num + 1
+        try:
+            while not buffer.exhausted and buffer.size <= max_record_size:
+                try:
+                    buffer.append(await anext(lines) + "\n")
+                except StopAsyncIteration:
+                    buffer.exhausted = True
+            values = next(reader)
+        except StopIteration:
+            break
+        except RecordTooLarge:
+            yield start, f"Record exceeds {max_record_size} characters; import stopped."
+            return
+        except csv.Error as e:
+            yield start, f"Invalid CSV: {e}"
+            continue
+        if not values:
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield start, f"Expected {len(header)} fields, got {len(values)}."
+            continue
+        yield start, dict(zip(header, values))
+
+def iter_records(chunks, format: str, max_record_size: int):
+    """
+    Returns the record iterator for `format`, one of FORMATS.
+    """
+    if format == "csv":
+        return iter_csv(chunks, max_record_size)
+    if format == "ndjson":
+        return iter_ndjson(chunks, max_record_size)
+    raise ValueError(f"Unknown import format: {format}")
+
+def validate(record: dict) -> tuple[ListingRow | None, str | None]:
+    """
+    Validates a record, returning the row or a readable error.
+    """
+    try:
+        return ListingRow.model_validate(record), None
+    except pydantic.ValidationError as e:
+        return None, "; ".join(
+            f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}"
+            for error in e.errors()
+        )
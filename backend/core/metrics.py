@@ -0,0 +1,267 @@
+"""
+Application metrics in the Prometheus text format.
+Per-route request latency and status counts come from `MetricsMiddleware`;
+MongoDB commands are attributed to the request that issued them by
+`CommandMetrics`, a pymongo command listener.
+"""
+
+import bisect
+import contextvars
+import dataclasses
+import math
+import threading
+import time
+import pymongo.monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    """
+    Monotonic counter with labels.
+    """
+    kind = "counter"
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, _format_labels(self.labels, labels), value
+
+class Histogram:
+    """
+    Cumulative bucket histogram with labels.
+    """
+    kind = "histogram"
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values: dict[tuple, list[float]] = {}
+        self._lock = threading.Lock()
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket", _format_labels(self.labels, labels, le), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, labels), counts[-1]
+            yield f"{self.name}_count", _format_labels(self.labels, labels), cumulative
+
+class Gauge:
+    """
+    Metric whose values are read from a callback at scrape time.
+    The callback returns a mapping of label values to numbers. Use
+    kind="counter" for totals kept elsewhere, such as cache statistics.
+    """
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], callback, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.callback = callback
+        self.kind = kind
+    def samples(self):
+        for labels, value in self.callback().items():
+            yield self.name, _format_labels(self.labels, labels), value
+
+class Registry:
+    """
+    Collection of metrics rendered together on /metrics.
+    """
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram | Gauge] = {}
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+    def gauge(self, name: str, help: str, labels: tuple[str, ...], callback, kind: str = "gauge") -> Gauge:
+        """
+        Registers a callback gauge. Registering the same name again replaces
+        the callback, so services rebuilt in the same process re-export it.
+        """
+        existing = self._metrics.get(name)
+        if isinstance(existing, Gauge):
+            del self._metrics[name]
+        return self._add(Gauge(name, help, labels, callback, kind))
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+@dataclasses.dataclass
+class RequestContext:
+    """
+    Per-request state shared between the middleware and the command listener.
+    """
+    commands: list[tuple[str, str, float]] = dataclasses.field(default_factory=list)
+
+current_request: contextvars.ContextVar[RequestContext | None] = contextvars.ContextVar(
+    "ecofinds_metrics_request",
+    default=None
+)
+
+class CommandMetrics(pymongo.monitoring.CommandListener):
+    """
+    Records MongoDB commands by command name and collection, and hands them
+    to the request that issued them, found through a context variable that
+    the drivers carry into their worker threads.
+    """
+    # Commands that describe the connection rather than the application's work.
+    IGNORED = frozenset({"hello", "isMaster", "ismaster", "ping", "saslStart", "saslContinue", "endSessions"})
+    def __init__(self, registry: Registry):
+        self._pending: dict[tuple, tuple[RequestContext | None, str, str]] = {}
+        self._lock = threading.Lock()
+        self.duration = registry.histogram(
+            "mongo_command_duration_seconds",
+            "MongoDB command duration.",
+            ("command", "collection")
+        )
+        self.failures = registry.counter(
+            "mongo_command_failures_total",
+            "MongoDB commands that failed.",
+            ("command", "collection")
+        )
+    @staticmethod
+    def _key(event) -> tuple:
+        return event.connection_id, event.request_id
+    def started(self, event: pymongo.monitoring.CommandStartedEvent):
+        if event.command_name in self.IGNORED:
+            return
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            self._pending[self._key(event)] = (current_request.get(), event.command_name, collection)
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            pending = self._pending.pop(self._key(event), None)
+        if pending is None:
+            return
+        context, command, collection = pending
+        seconds = event.duration_micros / 1e6
+        self.duration.observe(seconds, command, collection)
+        if failed:
+            self.failures.inc(command, collection)
+        if context is not None:
+            context.commands.append((command, collection, seconds))
+    def succeeded(self, event: pymongo.monitoring.CommandSucceededEvent):
+        self._finish(event, failed=False)
+    def failed(self, event: pymongo.monitoring.CommandFailedEvent):
+        self._finish(event, failed=True)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status and MongoDB commands per route.
+    Routes are labelled by their path template, so path parameters do not
+    create new series; unmatched paths share one label.
+    """
+    def __init__(self, app, registry: Registry):
+        self.app = app
+        self.requests = registry.counter(
+            "http_requests_total",
+            "HTTP requests by route, method and status.",
+            ("route", "method", "status")
+        )
+        self.latency = registry.histogram(
+            "http_request_duration_seconds",
+            "HTTP request latency by route.",
+            ("route", "method")
+        )
+        self.in_flight = 0
+        registry.gauge(
+            "http_requests_in_flight",
+            "HTTP requests being handled.",
+            (),
+            lambda: {(): self.in_flight}
+        )
+        self.mongo_commands = registry.counter(
+            "mongo_commands_total",
+            "MongoDB commands issued, by the route that issued them.",
+            ("route", "command", "collection")
+        )
+        self.mongo_per_request = registry.histogram(
+            "mongo_commands_per_request",
+            "MongoDB commands issued per request.",
+            ("route",),
+            buckets=COUNT_BUCKETS
+        )
+        self.mongo_time = registry.histogram(
+            "mongo_time_per_request_seconds",
+            "Time spent in MongoDB commands per request.",
+            ("route",)
+        )
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        context = RequestContext()
+        token = current_request.set(context)
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.in_flight -= 1
+            current_request.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            self.requests.inc(route, method, str(status))
+            self.latency.observe(elapsed, route, method)
+            for command, collection, _ in context.commands:
+                self.mongo_commands.inc(route, command, collection)
+            self.mongo_per_request.observe(len(context.commands), route)
+            self.mongo_time.observe(sum(seconds for _, _, seconds in context.commands), route)
@@ -1,29 +1,231 @@
+import asyncio
+import re
+import secrets
 import time
+import pymongo
+import pymongo.errors
 from core import database
 
+IDEMPOTENCY_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+ORDER_PROJECTION = {
+    "_id": 0,
+    "order_id": 1,
+    "products": 1,
+    "created_at": 1,
+}
+
+ORDER_SORT = [("created_at", pymongo.DESCENDING), ("order_id", pymongo.DESCENDING)]
+
 class OrderManager:
-    def __init__(self, db: database.pymongo.database.Database):
+    def __init__(self, db: database.AsyncDatabase):
         self.db = db
 
-    def create_order(self, email: str, products: list[str]) -> bool:
+    def register_indexes(self, registry: database.IndexRegistry):
+        """
+        Registers the indexes used by order lookups.
+        """
+        registry.add("orders", [("email", pymongo.ASCENDING)] + ORDER_SORT)
+        registry.add("orders", ORDER_SORT)
+        registry.add(
+            "orders",
+            [("email", pymongo.ASCENDING), ("idempotency_key", pymongo.ASCENDING)],
+            unique=True,
+            partial_filter_expression={"idempotency_key": {"$type": "string"}}
+        )
+
+    async def create_order(self, email: str, products: list[str]) -> bool:
         """
         Creates a new order for the user.
         """
-        result = self.db["orders"].insert_one({
+        result = await self.db["orders"].insert_one({
+            "order_id": secrets.token_hex(16),
             "email": email,
             "products": products,
             "created_at": time.time(),
         })
         return result.acknowledged
 
-    def get_orders(self, email: str) -> list[dict]:
+    async def checkout(self, email: str, idempotency_key: str) -> tuple[dict | None, int]:
+        """
+        Turns the user's cart into an order.
+        The cart contents are claimed and emptied in one atomic update, so
+        products added concurrently land in the fresh cart instead of being
+        lost or ordered twice. The listings of the cart are looked up
+        alongside the claim, and the order is then written and the claim
+        released: three round trips. Retrying with the same idempotency key
+        returns the original order instead of creating a new one.
+        Returns the order and 200, or None and 404 if the cart is empty, or
+        None and 409 if none of its products are still listed.
+        Raises ValueError if the idempotency key is malformed.
+        """
+        if not IDEMPOTENCY_KEY_PATTERN.match(idempotency_key):
+            raise ValueError("Invalid idempotency key.")
+        cart, listed = await asyncio.gather(
+            self.db["carts"].find_one_and_update(
+                {"email": email, "products.0": {"$exists": True}, "checkout": {"$exists": False}},
+                [{"$set": {
+                    "checkout": {
+                        "key": idempotency_key,
+                        "claim": secrets.token_hex(8),
+                        "products": "$products",
+                    },
+                    "products": [],
+                }}],
+                return_document=pymongo.ReturnDocument.AFTER
+            ),
+            self._listed_in_cart(email)
+        )
+        if cart is not None:
+            return await self._place_order(email, cart["checkout"], listed)
+        # The cart is empty or already claimed: this is a retry, or an
+        # earlier checkout never placed its order.
+        cart, order = await asyncio.gather(
+            self.db["carts"].find_one({"email": email}, {"_id": 0, "checkout": 1}),
+            self.db["orders"].find_one({"email": email, "idempotency_key": idempotency_key}, ORDER_PROJECTION)
+        )
+        pending = (cart or {}).get("checkout")
+        if pending is not None:
+            placed = await self._place_order(email, pending)
+            if pending["key"] == idempotency_key:
+                return placed
+            # Its products are ordered or back in the cart; claim again.
+            return await self.checkout(email, idempotency_key)
+        if order is not None:
+            return order, 200
+        return None, 404
+
+    async def _listed_in_cart(self, email: str) -> tuple[set[str], set[str]]:
+        """
+        Returns the products in the user's cart, claimed or not, and those
+        of them that are still listed, in one aggregation.
+        """
+        cursor = await self.db["carts"].aggregate([
+            {"$match": {"email": email}},
+            {"$limit": 1},
+            {"$lookup": {
+                "from": "product_listings",
+                "localField": "products",
+                "foreignField": "product_id",
+                "as": "listed"
+            }},
+            {"$lookup": {
+                "from": "product_listings",
+                "localField": "checkout.products",
+                "foreignField": "product_id",
+                "as": "claimed"
+            }},
+            {"$project": {
+                "_id": 0,
+                "products": 1,
+                "checkout.products": 1,
+                "listed.product_id": 1,
+                "claimed.product_id": 1,
+            }},
+        ])
+        carts = await cursor.to_list(1)
+        if not carts:
+            return set(), set()
+        cart = carts[0]
+        seen = set(cart.get("products") or []) | set((cart.get("checkout") or {}).get("products") or [])
+        listed = {listing["product_id"] for listing in cart.get("listed", []) + cart.get("claimed", [])}
+        return seen, listed
+
+    async def _place_order(
+            self,
+            email: str,
+            checkout: dict,
+            listed: tuple[set[str], set[str]] | None = None
+        ) -> tuple[dict | None, int]:
+        """
+        Creates the order for a claimed checkout, unless it exists already,
+        and releases the claim. Products whose listing was deleted are not
+        ordered and dropped. `listed` is the result of `_listed_in_cart`;
+        claimed products it has not seen are looked up.
+        If the key was ordered by an earlier claim, the claimed products go
+        back to the cart. Returns the order and 200, or None and 409.
+        """
+        key = checkout["key"]
+        products = checkout["products"]
+        # Claims made before claim tokens existed have none.
+        token = checkout.get("claim")
+        seen, known = listed or (set(), set())
+        unseen = [product_id for product_id in products if product_id not in seen]
+        if unseen:
+            known = known | set(await self.db["product_listings"].distinct("product_id", {"product_id": {"$in": unseen}}))
+        ordered = [product_id for product_id in products if product_id in known]
+        query = {"email": email, "idempotency_key": key}
+        order = None
+        if ordered:
+            created = {
+                "order_id": secrets.token_hex(16),
+                "products": ordered,
+                "created_at": time.time(),
+            }
+            try:
+                order = await self.db["orders"].find_one_and_update(
+                    query,
+                    {"$setOnInsert": created | {"claim": token}},
+                    projection=ORDER_PROJECTION | {"claim": 1},
+                    upsert=True,
+                    return_document=pymongo.ReturnDocument.BEFORE
+                )
+            except pymongo.errors.DuplicateKeyError:
+                order = await self.db["orders"].find_one(query, ORDER_PROJECTION | {"claim": 1})
+            if order is None:
+                order = created | {"claim": token}
+        else:
+            order = await self.db["orders"].find_one(query, ORDER_PROJECTION | {"claim": 1})
+        claim = {"email": email, "checkout.key": key, "checkout.claim": token}
+        if order is not None and order.pop("claim", None) != token:
+            # A retry of an order placed earlier: nothing was ordered now.
+            await self.db["carts"].update_one(claim, [
+                {"$set": {"products": {"$concatArrays": [
+                    "$checkout.products",
+                    {"$filter": {"input": "$products", "cond": {"$not": {"$in": ["$$this", "$checkout.products"]}}}},
+                ]}}},
+                {"$project": {"checkout": 0}},
+            ])
+        else:
+            await self.db["carts"].update_one(claim, {"$unset": {"checkout": ""}})
+        if order is None:
+            return None, 409
+        return order, 200
+
+    async def get_orders(
+            self,
+            email: str,
+            after: str | None = None,
+            limit: int = 50
+        ) -> tuple[list[dict], str | None]:
+        """
+        Fetches a page of the user's orders, newest first.
+        Returns the orders and the cursor for the next page.
+        Raises ValueError on a malformed cursor.
+        """
+        query = {"email": email}
+        if after:
+            query = {"$and": [query, database.keyset_filter(ORDER_SORT, database.decode_cursor(after))]}
+        orders = await self.db["orders"].find(
+            query,
+            ORDER_PROJECTION
+        ).sort(ORDER_SORT).limit(limit + 1).to_list(None)
+        next_cursor = None
+        if len(orders) > limit:
+            orders = orders[:limit]
+            next_cursor = database.encode_cursor([orders[-1].get(field) for field, _ in ORDER_SORT])
+        return orders, next_cursor
+
+    async def iter_orders(self, email: str | None = None, batch_size: int = 500):
         """
-        Fetches all orders for the user.
+        Streams orders newest first without loading them all into memory.
+        Streams every user's orders, including their email, if `email` is None.
         """
-        results = self.db["orders"].find({"email": email})
-        orders = []
-        for order in results:
-            order.pop("_id", None)
-            order.pop("email", None)
-            orders.append(order)
-        return orders
+        query = {}
+        projection = ORDER_PROJECTION | {"email": 1}
+        if email is not None:
+            query = {"email": email}
+            projection = ORDER_PROJECTION
+        cursor = self.db["orders"].find(query, projection).sort(ORDER_SORT).batch_size(batch_size)
+        async for order in cursor:
+            yield order
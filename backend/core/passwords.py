@@ -0,0 +1,161 @@
+"""
+Password hashing.
+Hashes use scrypt and are stored as `scrypt$n=<n>,r=<r>,p=<p>$<salt>$<hash>`,
+so parameters can be raised later and old hashes upgraded on login.
+Hashing is CPU bound and runs in a process pool to keep the event loop free.
+"""
+
+import asyncio
+import base64
+import concurrent.futures
+import hashlib
+import hmac
+import multiprocessing
+import secrets
+from core import config
+
+SCHEME = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=128 * n * r * p + 1024 * 1024,
+        dklen=KEY_BYTES
+    )
+
+def hash_password(password: str, n: int, r: int, p: int) -> str:
+    """
+    Hashes a password with a random salt.
+    """
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _scrypt(password, salt, n, r, p)
+    return f"{SCHEME}$n={n},r={r},p={p}${_b64encode(salt)}${_b64encode(key)}"
+
+def parse_hash(encoded: str) -> tuple[dict[str, int], bytes, bytes]:
+    """
+    Splits an encoded hash into its parameters, salt and key.
+    Raises ValueError if the hash is malformed.
+    """
+    try:
+        scheme, params, salt, key = encoded.split("$")
+        if scheme != SCHEME:
+            raise ValueError(f"Unknown password hash scheme: {scheme}")
+        params = {name: int(value) for name, value in (item.split("=") for item in params.split(","))}
+        return {"n": params["n"], "r": params["r"], "p": params["p"]}, _b64decode(salt), _b64decode(key)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("Invalid password hash.") from e
+
+def verify_password(password: str, encoded: str) -> bool:
+    """
+    Checks a password against an encoded hash in constant time.
+    """
+    params, salt, key = parse_hash(encoded)
+    return hmac.compare_digest(_scrypt(password, salt, **params), key)
+
+def default_workers(server_workers: int = 1) -> int:
+    """
+    Hashing processes per server worker: the available cores, shared
+    between `server_workers` processes.
+    """
+    return max(1, config.available_cores() // max(server_workers, 1))
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when too many password hashes are already waiting.
+    """
+
+class PasswordHasher:
+    """
+    Runs password hashing in a bounded process pool.
+    At most `password_workers` hashes run at once; further requests wait,
+    up to `password_max_queue`, after which they are rejected with
+    PasswordHasherBusy so a login burst cannot grow an unbounded backlog.
+    Without `password_workers`, the cores are split between the
+    `server_workers` processes that each run a hasher.
+    """
+    def __init__(self, config: config.Auth, server_workers: int = 1):
+        self.config = config
+        self.params = {
+            "n": config.password_hash_n,
+            "r": config.password_hash_r,
+            "p": config.password_hash_p,
+        }
+        self.workers = config.password_workers or default_workers(server_workers)
+        self._executor = None
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        # Created on first use so importing processes (and forked server
+        # workers) don't each start a pool they never use. Pool processes
+        # are never forked from this one, whose client threads a fork
+        # would copy mid-flight.
+        if self._executor is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(method)
+            )
+        return self._executor
+    async def _run(self, function, *args):
+        if self.queued >= self.config.password_max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), function, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+    async def hash(self, password: str) -> str:
+        """
+        Hashes a password with the configured parameters.
+        """
+        return await self._run(hash_password, password, self.params["n"], self.params["r"], self.params["p"])
+    async def verify(self, password: str, encoded: str) -> bool:
+        """
+        Checks a password against an encoded hash.
+        """
+        return await self._run(verify_password, password, encoded)
+    def needs_rehash(self, encoded: str) -> bool:
+        """
+        Whether a hash was made with parameters other than the configured ones.
+        """
+        try:
+            params, _, _ = parse_hash(encoded)
+        except ValueError:
+            return True
+        return params != self.params
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -1,21 +1,217 @@
-from core import database
+from core import autocomplete, cache, config, database, ingest, search
+import asyncio
+import hashlib
+import logging
+import math
+import orjson
+import pymongo
+import pymongo.errors
+import re
 import secrets
 
+logger = logging.getLogger(__name__)
+
+LISTING_PROJECTION = {
+    "_id": 0,
+    "product_id": 1,
+    "title": 1,
+    "description": 1,
+    "price": 1,
+    "seller_email": 1,
+    "category": 1,
+    "pictures": 1,
+    "created_at": 1,
+}
+# Fields needed to render a listing in carts and other compact views.
+DISPLAY_FIELDS = ("product_id", "title", "price", "category", "pictures")
+# Server error codes meaning change streams are not supported by the
+# deployment (standalone server, or a storage engine without them).
+CHANGE_STREAMS_UNSUPPORTED = {40573, 40324}
+# Price facet bucket of prices outside the configured boundaries.
+PRICE_OTHER = "other"
+SEARCH_SORTS = {
+    "price": [("price", pymongo.ASCENDING), ("product_id", pymongo.ASCENDING)],
+    "-price": [("price", pymongo.DESCENDING), ("product_id", pymongo.DESCENDING)],
+    "created_at": [("created_at", pymongo.ASCENDING), ("product_id", pymongo.ASCENDING)],
+    "-created_at": [("created_at", pymongo.DESCENDING), ("product_id", pymongo.DESCENDING)],
+}
+
 class ProductListingManager:
-    def __init__(self, db: database.pymongo.database.Database):
+    def __init__(
+            self,
+            db: database.AsyncDatabase,
+            config: config.Search,
+            cache_config: config.ListingCache,
+            search_db: database.AsyncDatabase | None = None,
+            autocomplete_config: config.Autocomplete | None = None,
+            search_cache_config: config.SearchCache | None = None
+        ):
+        boundaries = config.facet_price_boundaries
+        if len(boundaries) < 2 or any(low >= high for low, high in zip(boundaries, boundaries[1:])):
+            raise ValueError("facet_price_boundaries must be at least two prices in ascending order.")
         self.db = db
+        self.config = config
+        self.cache_config = cache_config
+        # Listing cache refills read the primary: a lagging secondary would
+        # hand back the version a write just invalidated, to be cached for
+        # the full TTL.
+        self.cache_source = db.get_collection(
+            "product_listings",
+            read_preference=pymongo.ReadPreference.PRIMARY
+        )
+        self.search_index = search.SearchIndex(db=search_db or db, config=config)
+        self.cache = cache.TTLCache(
+            max_size=cache_config.size,
+            ttl=cache_config.ttl
+        )
+        # Bumped on every listing write; cached search pages from an older
+        # generation are never served.
+        self.search_generation = 0
+        self.search_cache = cache.TTLCache(
+            max_size=search_cache_config.size if search_cache_config else 0,
+            ttl=search_cache_config.ttl if search_cache_config else 0
+        )
+        self.search_flights = cache.SingleFlight()
+        self.autocomplete = None
+        if autocomplete_config is not None and autocomplete_config.enabled:
+            self.autocomplete = autocomplete.Autocomplete(autocomplete_config)
+
+    async def _listing_written(self, listing: dict, previous: dict | None = None):
+        """
+        Propagates a created or updated listing to the cache, search index
+        and autocomplete. `previous` is the listing before an update.
+        """
+        self.cache.invalidate(listing["product_id"])
+        await self.search_index.index_listing(listing)
+        self._bump_search_generation()
+        # While the change stream runs, new listings reach autocomplete
+        # through their change events, like those of other workers.
+        if self.autocomplete is not None and (previous is not None or not self.autocomplete.watched):
+            self.autocomplete.listing_written(listing, previous)
+
+    async def _listings_inserted(self, listings: list[dict]):
+        """
+        Propagates a batch of newly inserted listings to the cache and
+        search index.
+        """
+        for listing in listings:
+            self.cache.invalidate(listing["product_id"])
+        await self.search_index.index_many(listings)
+        self._bump_search_generation()
+        if self.autocomplete is not None and not self.autocomplete.watched:
+            for listing in listings:
+                self.autocomplete.listing_written(listing)
 
-    def get_product_listing(self, product_id: str) -> dict | None:
+    async def _listing_deleted(self, product_id: str, previous: dict | None = None):
         """
-        Fetches product listing by product ID.
+        Propagates a deleted listing to the cache, search index and
+        autocomplete. `previous` is the deleted listing.
         """
-        product = self.db["product_listings"].find_one({"product_id": product_id})
-        if product is None:
-            return None
-        product.pop("_id", None)
-        return product
+        self.cache.invalidate(product_id)
+        await self.search_index.remove_listing(product_id)
+        self._bump_search_generation()
+        if self.autocomplete is not None and previous is not None:
+            self.autocomplete.listing_deleted(previous)
 
-    def update_product_listing(
+    async def watch_listing_changes(self):
+        """
+        Keeps the listing cache coherent with writes made by other workers,
+        using a change stream on product_listings. Runs until cancelled.
+        Returns early when change streams are unavailable (e.g. standalone
+        servers), in which case cached entries expire after the cache TTL.
+        """
+        backoff = 1
+        while True:
+            stream = None
+            try:
+                stream = await self.db["product_listings"].watch(full_document="updateLookup")
+                if self.autocomplete is not None:
+                    self.autocomplete.watched = True
+                    # Listings written before the stream opened are only
+                    # counted by a rebuild.
+                    self.autocomplete.changed = True
+                async for change in stream:
+                    backoff = 1
+                    self._apply_listing_change(change)
+            except pymongo.errors.PyMongoError as e:
+                if getattr(e, "code", None) in CHANGE_STREAMS_UNSUPPORTED:
+                    logger.info("Listing change stream unavailable, relying on cache TTL: %s", e)
+                    return
+                logger.warning("Listing change stream failed, retrying in %ss: %s", backoff, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if stream is not None:
+                    await stream.close()
+                if self.autocomplete is not None:
+                    # Changes may be missed until the stream is back.
+                    self.autocomplete.watched = False
+                    self.autocomplete.changed = True
+            # Changes may have been missed while the stream was down.
+            self.cache.clear()
+            self._bump_search_generation()
+
+    def _bump_search_generation(self):
+        self.search_generation += 1
+        self.search_cache.clear()
+
+    def _apply_listing_change(self, change: dict):
+        # Writes by any worker, including this one, change search results.
+        self._bump_search_generation()
+        if self.autocomplete is not None:
+            self.autocomplete.listing_changed(change)
+        product_id = (change.get("fullDocument") or {}).get("product_id")
+        if change.get("operationType") in ("insert", "update", "replace") and product_id:
+            self.cache.invalidate(product_id)
+        else:
+            # Delete events only carry the _id, so drop everything.
+            self.cache.clear()
+
+    async def get_product_listing(self, product_id: str) -> dict | None:
+        """
+        Fetches product listing by product ID, through the listing cache.
+        """
+        product = self.cache.get(product_id)
+        if product is cache.MISSING:
+            product = await self.cache_source.find_one(
+                {"product_id": product_id},
+                LISTING_PROJECTION
+            )
+            self.cache.set(
+                product_id,
+                product,
+                ttl=None if product is not None else self.cache_config.negative_ttl
+            )
+        return dict(product) if product is not None else None
+
+    async def get_many(self, product_ids: list[str]) -> dict[str, dict]:
+        """
+        Fetches several listings by product ID, through the listing cache.
+        Listings that are not cached are loaded with a single query.
+        Returns a mapping of product ID to listing; missing IDs are omitted.
+        """
+        listings = {}
+        misses = []
+        for product_id in dict.fromkeys(product_ids):
+            product = self.cache.get(product_id)
+            if product is cache.MISSING:
+                misses.append(product_id)
+            elif product is not None:
+                listings[product_id] = dict(product)
+        if misses:
+            cursor = self.cache_source.find(
+                {"product_id": {"$in": misses}},
+                LISTING_PROJECTION
+            )
+            async for product in cursor:
+                self.cache.set(product["product_id"], product)
+                listings[product["product_id"]] = dict(product)
+            for product_id in misses:
+                if product_id not in listings:
+                    self.cache.set(product_id, None, ttl=self.cache_config.negative_ttl)
+        return listings
+
+    async def update_product_listing(
             self,
             product_id: str,
             title: str | None = None,
@@ -38,10 +234,22 @@ class ProductListingManager:
             update_data["category"] = category
         if pictures is not None:
             update_data["pictures"] = pictures
-        result = self.db["product_listings"].update_one({"product_id": product_id}, {"$set": update_data})
-        return result.modified_count > 0
+        if not update_data:
+            return False
+        # The listing before the update tells autocomplete which title and
+        # category to retire; the updated one follows from the $set.
+        previous = await self.db["product_listings"].find_one_and_update(
+            {"product_id": product_id},
+            {"$set": update_data},
+            projection=LISTING_PROJECTION,
+            return_document=pymongo.ReturnDocument.BEFORE
+        )
+        if previous is None:
+            return False
+        await self._listing_written(previous | update_data, previous)
+        return True
 
-    def create_product_listing(
+    async def create_product_listing(
             self,
             title: str,
             description: str,
@@ -61,49 +269,306 @@ class ProductListingManager:
             "seller_email": seller_email,
             "category": category,
             "pictures": pictures or [],
-            "created_at": database.datetime.datetime.utcnow()
+            "created_at": database.utcnow()
         }
-        result = self.db["product_listings"].insert_one(product_data)
+        result = await self.db["product_listings"].insert_one(product_data)
+        await self._listing_written(product_data)
         return result.acknowledged
-    def delete_product_listing(self, product_id: str) -> bool:
+    async def delete_product_listing(self, product_id: str) -> bool:
         """
         Deletes a product listing.
         """
-        result = self.db["product_listings"].delete_one({"product_id": product_id})
-        return result.deleted_count > 0
-    def search_product_listings(
+        previous = await self.db["product_listings"].find_one_and_delete(
+            {"product_id": product_id},
+            projection={"_id": 0, "title": 1, "category": 1}
+        )
+        if previous is None:
+            return False
+        await self._listing_deleted(product_id, previous)
+        return True
+    async def _insert_batch(self, batch: list[tuple[int, dict]], report: ingest.ImportReport):
+        listings = [listing for _, listing in batch]
+        failed = set()
+        try:
+            await self.db["product_listings"].insert_many(listings, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed.add(error["index"])
+                message = "Duplicate product_id." if error.get("code") == 11000 else error.get("errmsg", "Write failed.")
+                report.error(batch[error["index"]][0], message)
+        inserted = [listing for i, listing in enumerate(listings) if i not in failed]
+        report.inserted += len(inserted)
+        await self._listings_inserted(inserted)
+    async def import_listings(
             self,
-            query: str,
+            chunks,
+            format: str,
+            seller_email: str | None = None,
+            batch_size: int = 1000,
+            max_errors: int = 1000,
+            max_record_size: int = 1 << 20
+        ) -> ingest.ImportReport:
+        """
+        Bulk imports listings from an async iterator of CSV or NDJSON bytes.
+        Rows are validated and written in unordered batches, with the next
+        batch parsed while the previous one is written. If `seller_email` is
+        given it overrides the rows' own seller. Invalid rows are reported
+        and skipped; a record over `max_record_size` characters stops the
+        import. Raises ValueError on an unknown format.
+        """
+        records = ingest.iter_records(chunks, format, max_record_size)
+        report = ingest.ImportReport(max_errors=max_errors)
+        batch = []
+        pending = None
+        try:
+            async for row_number, record in records:
+                report.rows += 1
+                if isinstance(record, str):
+                    report.error(row_number, record)
+                    continue
+                row, error = ingest.validate(record)
+                if error is not None:
+                    report.error(row_number, error)
+                    continue
+                owner = seller_email or row.seller_email
+                if not owner:
+                    report.error(row_number, "seller_email: Field required")
+                    continue
+                batch.append((row_number, {
+                    "product_id": row.product_id or secrets.token_hex(16),
+                    "title": row.title,
+                    "description": row.description,
+                    "price": row.price,
+                    "seller_email": owner,
+                    "category": row.category,
+                    "pictures": row.pictures,
+                    "created_at": database.utcnow()
+                }))
+                if len(batch) >= batch_size:
+                    if pending is not None:
+                        await pending
+                    pending = asyncio.create_task(self._insert_batch(batch, report))
+                    batch = []
+        finally:
+            if pending is not None:
+                await pending
+        if batch:
+            await self._insert_batch(batch, report)
+        return report
+    def register_indexes(self, registry: database.IndexRegistry):
+        """
+        Registers the indexes used by listing lookups and search.
+        """
+        registry.add("product_listings", "product_id", unique=True)
+        for prefix in ([], ["category"], ["seller_email"]):
+            for field in ("price", "created_at"):
+                registry.add(
+                    "product_listings",
+                    [(key, pymongo.ASCENDING) for key in prefix + [field, "product_id"]]
+                )
+        self.search_index.register_indexes(registry)
+    async def search_product_listings(
+            self,
+            query: str | None = None,
             category: str | None = None,
             price_min: float | None = None,
             price_max: float | None = None,
-            seller_email: str | None = None
-        ) -> list[dict]:
+            seller_email: str | None = None,
+            sort: str = "relevance",
+            after: str | None = None,
+            limit: int = 20,
+            facets: bool = False
+        ) -> tuple[list[dict], str | None, dict | None]:
         """
-        Searches product listings by title or description.
+        Searches product listings by title, description or category.
+        Filters, sorting and keyset pagination run in the database, except
+        for relevance order, which follows the search index ranking.
+        With `facets`, category, price and seller counts over all matching
+        listings are computed in the same aggregation as the page.
+        Filtered, non-relevance and faceted queries consider up to
+        `max_filter_candidates` index matches, filtered by the index, rather
+        than `max_candidates`.
+        Returns a page of listings, the cursor for the next page and the
+        facets, if requested.
+        Raises ValueError on an unknown sort or a malformed cursor.
         """
-        results = self.db["product_listings"].find({
-            "$or": [
-                {"title": {"$regex": query, "$options": "i"}},
-                {"description": {"$regex": query, "$options": "i"}},
-                {"category": {"$regex": query, "$options": "i"}}
+        if sort != "relevance" and sort not in SEARCH_SORTS:
+            raise ValueError(f"Unknown sort: {sort}")
+        after_values = database.decode_cursor(after) if after else None
+        query_filter = {}
+        if category:
+            query_filter["category"] = category
+        if price_min is not None or price_max is not None:
+            query_filter["price"] = {}
+            if price_min is not None:
+                query_filter["price"]["$gte"] = price_min
+            if price_max is not None:
+                query_filter["price"]["$lte"] = price_max
+        if seller_email:
+            query_filter["seller_email"] = seller_email
+        ranked_ids = None
+        approximate = False
+        if query and self.config.backend == "regex":
+            pattern = re.escape(query)
+            query_filter["$or"] = [
+                {"title": {"$regex": pattern, "$options": "i"}},
+                {"description": {"$regex": pattern, "$options": "i"}},
+                {"category": {"$regex": pattern, "$options": "i"}}
             ]
-        })
-        filtered_results = []
-        for result in results:
-            match = True
-            if category and result.get("category") != category:
-                match = False
-            if price_min is not None and result.get("price", 0) < price_min:
-                match = False
-            if price_max is not None and result.get("price", 0) > price_max:
-                match = False
-            if seller_email and result.get("seller_email") != seller_email:
-                match = False
-            if match:
-                filtered_results.append(result)
-        listings = []
-        for product in filtered_results:
-            product.pop("_id", None)
-            listings.append(product)
-        return listings
+        elif query:
+            # Filters and other sorts must see every match, not just the
+            # best-scoring ones. The filters are applied by the index, so
+            # only matching listings count towards `candidates`. A term cut
+            # off at `candidates` postings alone fills `ranked`, so it is
+            # reported as approximate too.
+            narrowed = bool(query_filter) or sort != "relevance" or facets
+            candidates = self.config.max_filter_candidates if narrowed else self.config.max_candidates
+            ranked = await self.search_index.search(
+                query,
+                candidates,
+                max_postings=candidates if narrowed else None,
+                filters=dict(query_filter)
+            )
+            if not ranked:
+                return [], None, ({"categories": [], "price": [], "sellers": [], "price_other": 0, "approximate": False} if facets else None)
+            approximate = len(ranked) >= candidates
+            ranked_ids = [product_id for product_id, _ in ranked]
+            query_filter["product_id"] = {"$in": ranked_ids}
+        if sort == "relevance" and ranked_ids is None:
+            sort = "-created_at"
+        facet_counts = None
+        if sort == "relevance":
+            # Rank order comes from the search index; the database only
+            # applies the filters, and the page is hydrated through the cache.
+            if after_values is not None and (len(after_values) != 1 or not isinstance(after_values[0], int)):
+                raise ValueError("Invalid cursor.")
+            if facets:
+                result = await self._facet_search(
+                    query_filter,
+                    {"matches": [{"$project": {"_id": 0, "product_id": 1}}]}
+                )
+                facet_counts = self._facet_counts(result, approximate)
+                matched = {listing["product_id"] for listing in result["matches"]}
+                ranks = [rank for rank, product_id in enumerate(ranked_ids) if product_id in matched]
+            elif len(query_filter) > 1:
+                matches = await self.db["product_listings"].find(
+                    query_filter,
+                    {"_id": 0, "product_id": 1}
+                ).to_list(None)
+                matched = {listing["product_id"] for listing in matches}
+                ranks = [rank for rank, product_id in enumerate(ranked_ids) if product_id in matched]
+            else:
+                ranks = list(range(len(ranked_ids)))
+            if after_values is not None:
+                ranks = [rank for rank in ranks if rank > after_values[0]]
+            ranks = ranks[:limit + 1]
+            found = await self.get_many([ranked_ids[rank] for rank in ranks])
+            listings = [
+                found[ranked_ids[rank]] | {"_rank": rank}
+                for rank in ranks
+                if ranked_ids[rank] in found
+            ]
+            sort_keys = [("_rank", pymongo.ASCENDING)]
+        else:
+            sort_keys = SEARCH_SORTS[sort]
+            if facets:
+                page = [{"$sort": dict(sort_keys)}, {"$limit": limit + 1}, {"$project": LISTING_PROJECTION}]
+                if after_values is not None:
+                    page.insert(0, {"$match": database.keyset_filter(sort_keys, after_values)})
+                result = await self._facet_search(query_filter, {"results": page})
+                facet_counts = self._facet_counts(result, approximate)
+                listings = result["results"]
+            else:
+                if after_values is not None:
+                    query_filter = {"$and": [query_filter, database.keyset_filter(sort_keys, after_values)]}
+                listings = await self.db["product_listings"].find(
+                    query_filter,
+                    LISTING_PROJECTION
+                ).sort(sort_keys).limit(limit + 1).to_list(None)
+        next_cursor = None
+        if len(listings) > limit:
+            listings = listings[:limit]
+            next_cursor = database.encode_cursor([listings[-1].get(field) for field, _ in sort_keys])
+        for listing in listings:
+            listing.pop("_rank", None)
+        return listings, next_cursor, facet_counts
+    async def cached_search(self, **arguments) -> tuple[dict, str]:
+        """
+        Runs `search_product_listings` through the search result cache.
+        Concurrent identical searches share one database query. Returns the
+        page (results, next and facets, if requested) and a weak ETag of its
+        content. Raises ValueError like search_product_listings.
+        """
+        query = arguments.get("query") or ""
+        if self.config.backend != "regex":
+            # The index only sees terms, so case, accents and spacing do not
+            # change the results. A query without any terms matches nothing,
+            # so it keeps its own key rather than sharing the browse page's.
+            query = " ".join(search.tokenize(query)) or query.strip()
+            if not query:
+                arguments["query"] = None
+        key = (self.search_generation, query, tuple(sorted(
+            (name, value) for name, value in arguments.items() if name != "query"
+        )))
+        entry = self.search_cache.get(key)
+        if entry is not cache.MISSING:
+            return entry
+        generation = self.search_generation
+        async def run():
+            listings, next_cursor, facets = await self.search_product_listings(**arguments)
+            page = {"results": listings, "next": next_cursor}
+            if facets is not None:
+                page["facets"] = facets
+            etag = 'W/"' + hashlib.blake2b(orjson.dumps(page, default=str), digest_size=12).hexdigest() + '"'
+            # A write during the search makes the page stale before it is cached.
+            if generation == self.search_generation:
+                self.search_cache.set(key, (page, etag))
+            return page, etag
+        return await self.search_flights.do(key, run)
+    async def _facet_search(self, query_filter: dict, pipelines: dict) -> dict:
+        """
+        Runs `pipelines` together with the facet counts over the listings
+        matching `query_filter`, in a single `$facet` aggregation.
+        Only the leading `$match` can use indexes; the page pipeline sorts
+        the matches in memory, which is why facets are meant for the first
+        page of a search.
+        """
+        def count_by(field: str) -> list[dict]:
+            return [
+                {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": self.config.facet_limit},
+            ]
+        # The last bucket is open-ended; prices below the first bound,
+        # missing or not numbers go to the default bucket.
+        boundaries = list(self.config.facet_price_boundaries) + [math.inf]
+        facet = pipelines | {
+            "categories": count_by("category"),
+            "price": [{"$bucket": {
+                "groupBy": "$price",
+                "boundaries": boundaries,
+                "default": PRICE_OTHER,
+                "output": {"count": {"$sum": 1}},
+            }}],
+            "sellers": count_by("seller_email"),
+        }
+        cursor = await self.db["product_listings"].aggregate([
+            {"$match": query_filter},
+            {"$facet": facet}
+        ])
+        result = await cursor.to_list(None)
+        return result[0]
+    def _facet_counts(self, result: dict, approximate: bool = False) -> dict:
+        boundaries = self.config.facet_price_boundaries
+        upper = dict(zip(boundaries, boundaries[1:]))
+        return {
+            "categories": [{"value": bucket["_id"], "count": bucket["count"]} for bucket in result["categories"]],
+            "price": [
+                {"min": bucket["_id"], "max": upper.get(bucket["_id"]), "count": bucket["count"]}
+                for bucket in result["price"]
+                if bucket["_id"] != PRICE_OTHER
+            ],
+            "price_other": sum(bucket["count"] for bucket in result["price"] if bucket["_id"] == PRICE_OTHER),
+            "sellers": [{"value": bucket["_id"], "count": bucket["count"]} for bucket in result["sellers"]],
+            "approximate": approximate,
+        }
@@ -0,0 +1,310 @@
+"""
+Inverted index search over product listings.
+Listings are tokenized into a postings collection and ranked with BM25.
+"""
+
+import asyncio
+import collections
+import math
+import re
+import unicodedata
+import logging
+import pymongo
+from core import cache, config, database
+
+logger = logging.getLogger("ecofinds")
+
+STOPWORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in",
+    "is", "it", "of", "on", "or", "the", "to", "with",
+})
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Format of the postings, kept in the stats document. 1: postings carry
+# their impact. 2: postings carry FILTER_FIELDS.
+INDEX_VERSION = 2
+# Postings of a term, best first, for reading a capped number of them.
+IMPACT_ORDER = [("impact", pymongo.DESCENDING), ("product_id", pymongo.ASCENDING)]
+# Listing fields copied onto every posting, so searches can be filtered
+# on them while the postings are read.
+FILTER_FIELDS = ("category", "price", "seller_email")
+
+def normalize(text: str) -> str:
+    """
+    Case-folds text and strips accents.
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def tokenize(text: str | None) -> list[str]:
+    """
+    Splits text into normalized search terms.
+    """
+    if not text:
+        return []
+    return [
+        _stem(token)
+        for token in TOKEN_PATTERN.findall(normalize(text))
+        if token not in STOPWORDS
+    ]
+
+class SearchIndex:
+    """
+    BM25 inverted index over product listings, stored in MongoDB.
+    Uses `<prefix>_postings`, `<prefix>_docs` and `<prefix>_stats`.
+    Postings carry the listing's FILTER_FIELDS.
+    """
+    def __init__(
+            self,
+            db: database.AsyncDatabase,
+            config: config.Search,
+            collection_prefix: str = "search"
+        ):
+        self.db = db
+        self.config = config
+        self.collection_prefix = collection_prefix
+        self.postings = db[f"{collection_prefix}_postings"]
+        self.docs = db[f"{collection_prefix}_docs"]
+        self.stats = db[f"{collection_prefix}_stats"]
+        # Format of the index as last seen; filters are only applied to
+        # postings that carry the filtered fields.
+        self.version = INDEX_VERSION
+        # Document frequencies of terms over `max_postings_per_term`. Such
+        # terms are common, so their counts change slowly in relative terms.
+        self.term_counts = cache.TTLCache(max_size=10000, ttl=config.term_count_ttl)
+    def analyze(self, listing: dict) -> tuple[dict[str, float], float]:
+        """
+        Returns weighted term frequencies and document length for a listing.
+        """
+        fields = (
+            ("title", self.config.title_weight),
+            ("category", self.config.category_weight),
+            ("description", self.config.description_weight),
+        )
+        terms = collections.defaultdict(float)
+        length = 0.0
+        for field, weight in fields:
+            for token in tokenize(listing.get(field)):
+                terms[token] += weight
+                length += weight
+        return terms, length
+    def impact(self, tf: float, length: float, avg_length: float) -> float:
+        """
+        Returns a posting's BM25 term frequency component, without the idf.
+        """
+        k1, b = self.config.k1, self.config.b
+        return tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / max(avg_length, 1e-9)))
+    def register_indexes(self, registry: database.IndexRegistry):
+        registry.add(
+            self.postings.name,
+            [("term", pymongo.ASCENDING), ("product_id", pymongo.ASCENDING)],
+            unique=True
+        )
+        registry.add(self.postings.name, [("term", pymongo.ASCENDING)] + IMPACT_ORDER)
+        registry.add(self.postings.name, [("term", pymongo.ASCENDING), ("category", pymongo.ASCENDING)] + IMPACT_ORDER)
+        registry.add(self.postings.name, "product_id")
+        registry.add(self.docs.name, "product_id", unique=True)
+    async def index_many(self, listings: list[dict]):
+        """
+        Adds listings to the index.
+        Listings must not be indexed already; use `index_listing` to replace.
+        """
+        if not listings:
+            return
+        analyzed = [(listing, *self.analyze(listing)) for listing in listings]
+        docs = [{"product_id": listing["product_id"], "length": length} for listing, _, length in analyzed]
+        total_length = sum(doc["length"] for doc in docs)
+        # Impacts use the average length as of this batch. They only order a
+        # term's postings; scores are computed with the current average.
+        stats = await self.stats.find_one({"_id": "stats"}) or {}
+        avg_length = (stats.get("total_length", 0) + total_length) / (stats.get("doc_count", 0) + len(docs))
+        postings = [
+            {
+                "term": term,
+                "product_id": listing["product_id"],
+                "tf": tf,
+                "dl": length,
+                "impact": self.impact(tf, length, avg_length),
+                **{field: listing.get(field) for field in FILTER_FIELDS},
+            }
+            for listing, terms, length in analyzed
+            for term, tf in terms.items()
+        ]
+        await self.docs.insert_many(docs, ordered=False)
+        if postings:
+            await self.postings.insert_many(postings, ordered=False)
+        await self.stats.update_one(
+            {"_id": "stats"},
+            {
+                "$inc": {"doc_count": len(docs), "total_length": total_length},
+                "$setOnInsert": {"version": INDEX_VERSION},
+            },
+            upsert=True
+        )
+    async def index_listing(self, listing: dict):
+        """
+        Indexes a listing, replacing any previous version of it.
+        """
+        await self.remove_listing(listing["product_id"])
+        await self.index_many([listing])
+    async def remove_listing(self, product_id: str) -> bool:
+        """
+        Removes a listing from the index.
+        """
+        doc = await self.docs.find_one_and_delete(
+            {"product_id": product_id},
+            projection={"_id": 0, "length": 1}
+        )
+        if doc is None:
+            return False
+        await self.postings.delete_many({"product_id": product_id})
+        await self.stats.update_one(
+            {"_id": "stats"},
+            {"$inc": {"doc_count": -1, "total_length": -doc.get("length", 0)}}
+        )
+        return True
+    async def search(
+            self,
+            query: str,
+            limit: int | None = None,
+            max_postings: int | None = None,
+            filters: dict | None = None
+        ) -> list[tuple[str, float]]:
+        """
+        Returns (product_id, score) pairs ordered by descending BM25 score.
+        At most `max_postings_per_term` postings are read per term, those
+        with the highest impact, so a common term costs no more than a rare
+        one. Listings matching a common term only weakly may be left out.
+        `max_postings` overrides that cap, for callers that need every match.
+        `filters` is a query on FILTER_FIELDS applied to the postings as they
+        are read, so the cap counts matching listings only. An index from
+        before filter fields ignores it; callers filter the results anyway.
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        if self.version < 2:
+            filters = None
+        cap = max_postings or self.config.max_postings_per_term
+        stats, *postings = await asyncio.gather(
+            self.stats.find_one({"_id": "stats"}),
+            *(
+                self.postings.find(
+                    {"term": term} | (filters or {}),
+                    {"_id": 0, "product_id": 1, "tf": 1, "dl": 1}
+                ).sort(IMPACT_ORDER).limit(cap).to_list(None)
+                for term in terms
+            )
+        )
+        doc_count = (stats or {}).get("doc_count", 0)
+        if doc_count <= 0:
+            return []
+        self.version = stats.get("version", 0)
+        # Unfiltered terms below the cap were read in full; the others are
+        # counted in the index, without reading their postings.
+        document_frequency = {term: len(term_postings) for term, term_postings in zip(terms, postings)}
+        uncounted = []
+        for term, df in document_frequency.items():
+            if filters or df >= cap:
+                count = self.term_counts.get(term)
+                if count is cache.MISSING:
+                    uncounted.append(term)
+                else:
+                    document_frequency[term] = count
+        counts = await asyncio.gather(*(self.postings.count_documents({"term": term}) for term in uncounted))
+        for term, count in zip(uncounted, counts):
+            document_frequency[term] = count
+            self.term_counts.set(term, count)
+        avg_length = stats.get("total_length", 0) / doc_count
+        scores = collections.defaultdict(float)
+        for term, term_postings in zip(terms, postings):
+            df = document_frequency[term]
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for posting in term_postings:
+                scores[posting["product_id"]] += idf * self.impact(posting["tf"], posting["dl"], avg_length)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit or self.config.max_candidates]
+    async def upgrade(self) -> int:
+        """
+        Brings an index written by an older version up to date in place.
+        Postings without an impact, which capped reads would rank last, get
+        one computed with the current average length. Filter fields can only
+        be added by a rebuild; until then, filtered searches filter the
+        listings after reading the postings. Returns the number of postings
+        updated.
+        """
+        stats = await self.stats.find_one({"_id": "stats"})
+        if stats is None:
+            return 0
+        self.version = stats.get("version", 0)
+        if self.version < 2:
+            logger.warning(
+                "The search index predates filter fields; run `manage.py rebuild-search-index` "
+                "so filtered searches can use it."
+            )
+        if self.version >= 1:
+            return 0
+        avg_length = max(stats.get("total_length", 0) / max(stats.get("doc_count", 0), 1), 1e-9)
+        k1, b = self.config.k1, self.config.b
+        # The pipeline form of `impact`.
+        result = await self.postings.update_many(
+            {"impact": {"$exists": False}},
+            [{"$set": {"impact": {"$divide": [
+                {"$multiply": ["$tf", k1 + 1]},
+                {"$add": ["$tf", {"$multiply": [k1, {"$add": [1 - b, {"$multiply": [b / avg_length, "$dl"]}]}]}]},
+            ]}}}]
+        )
+        await self.stats.update_one({"_id": "stats", "version": stats.get("version")}, {"$set": {"version": 1}})
+        self.version = 1
+        if result.modified_count:
+            logger.info("Computed the impact of %d search postings.", result.modified_count)
+        return result.modified_count
+    async def rebuild(self, batch_size: int = 1000) -> int:
+        """
+        Rebuilds the index from `product_listings`.
+        The new index is built in staging collections and swapped in once
+        complete, so searches keep working during the rebuild. Listing writes
+        made while a rebuild is running may be missed.
+        """
+        staging = SearchIndex(
+            self.db,
+            self.config,
+            collection_prefix=f"{self.collection_prefix}_rebuild"
+        )
+        for collection in (staging.postings, staging.docs, staging.stats):
+            await collection.drop()
+        registry = database.IndexRegistry()
+        staging.register_indexes(registry)
+        await registry.apply(self.db)
+        count = 0
+        batch = []
+        cursor = self.db["product_listings"].find(
+            {},
+            {"_id": 0, "product_id": 1, "title": 1, "description": 1, **{field: 1 for field in FILTER_FIELDS}}
+        )
+        async for listing in cursor:
+            batch.append(listing)
+            if len(batch) >= batch_size:
+                await staging.index_many(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            await staging.index_many(batch)
+            count += len(batch)
+        await staging.stats.update_one(
+            {"_id": "stats"},
+            {"$setOnInsert": {"doc_count": 0, "total_length": 0, "version": INDEX_VERSION}},
+            upsert=True
+        )
+        for source, target in (
+                (staging.postings, self.postings),
+                (staging.docs, self.docs),
+                (staging.stats, self.stats)):
+            await source.rename(target.name, dropTarget=True)
+        return count
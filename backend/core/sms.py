@@ -0,0 +1,184 @@
+"""
+SMS delivery.
+Messages are queued durably in `sms_outbox` and sent by background workers,
+so request handlers never wait on the SMS provider.
+"""
+
+import asyncio
+import datetime
+import logging
+import random
+import secrets
+import time
+import pymongo
+import pymongo.errors
+from twilio.rest import Client
+from core import config, database
+
+logger = logging.getLogger(__name__)
+
+class TwilioClient:
+    """
+    Twilio client wrapper.
+    """
+    def __init__(self, account_sid: str, auth_token: str, sms_from_ph: str):
+        self.c = Client(account_sid, auth_token)
+        self.sms_from_ph = sms_from_ph
+    def send_sms(self, to: str, body: str):
+        """
+        Sends SMS using Twilio API.
+        """
+        self.c.messages.create(
+            body = body,
+            from_=self.sms_from_ph,
+            to=to
+        )
+
+class FakeSMSClient:
+    """
+    SMS provider that records messages instead of sending them.
+    Used for local development, tests and load runs.
+    """
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, keep: int = 1000):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.keep = keep
+        self.sent: list[dict] = []
+    def send_sms(self, to: str, body: str):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("Simulated SMS provider failure.")
+        self.sent.append({"to": to, "body": body, "sent_at": time.time()})
+        del self.sent[:-self.keep]
+
+def provider_factory(sms_config: config.SMS, twilio_config: config.Twilio | None = None):
+    """
+    Creates the SMS provider selected by `SMS.provider`.
+    """
+    if sms_config.provider == "fake":
+        return FakeSMSClient(latency=sms_config.fake_latency)
+    if sms_config.provider == "twilio":
+        if twilio_config is None:
+            raise ValueError("The twilio SMS provider needs a [twilio] config section.")
+        return TwilioClient(
+            account_sid=twilio_config.account_sid,
+            auth_token=twilio_config.auth_token,
+            sms_from_ph=twilio_config.sms_from_ph
+        )
+    raise ValueError(f"Unknown SMS provider: {sms_config.provider}")
+
+class SMSOutbox:
+    """
+    Durable SMS queue backed by the `sms_outbox` collection.
+    Message status goes pending -> sending -> sent, or back to pending with
+    a backoff after a failed attempt, and to failed once attempts run out.
+    """
+    def __init__(self, db: database.AsyncDatabase, config: config.SMS):
+        self.db = db
+        self.config = config
+        self._wakeup = asyncio.Event()
+    def register_indexes(self, registry: database.IndexRegistry):
+        registry.add("sms_outbox", "message_id", unique=True)
+        registry.add("sms_outbox", [("status", pymongo.ASCENDING), ("next_attempt_at", pymongo.ASCENDING)])
+        registry.add("sms_outbox", [("status", pymongo.ASCENDING), ("lease_until", pymongo.ASCENDING)])
+        registry.add(
+            "sms_outbox",
+            "completed_at",
+            name="completed_at_ttl",
+            expire_after_seconds=self.config.retention
+        )
+    async def enqueue(self, to: str, body: str) -> str:
+        """
+        Queues an SMS for delivery and returns its message ID.
+        """
+        now = database.utcnow()
+        message_id = secrets.token_hex(16)
+        await self.db["sms_outbox"].insert_one({
+            "message_id": message_id,
+            "to": to,
+            "body": body,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now
+        })
+        self._wakeup.set()
+        return message_id
+    async def get_status(self, message_id: str) -> dict | None:
+        """
+        Fetches the delivery status of a message.
+        """
+        return await self.db["sms_outbox"].find_one(
+            {"message_id": message_id},
+            {"_id": 0, "message_id": 1, "status": 1, "attempts": 1, "last_error": 1, "sent_at": 1}
+        )
+    async def _claim(self) -> dict | None:
+        """
+        Leases the next due message, including messages whose previous lease
+        expired because a worker died mid-send.
+        """
+        now = database.utcnow()
+        return await self.db["sms_outbox"].find_one_and_update(
+            {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "sending", "lease_until": {"$lte": now}},
+            ]},
+            {
+                "$set": {
+                    "status": "sending",
+                    "lease_until": now + datetime.timedelta(seconds=self.config.lease_seconds)
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("next_attempt_at", pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.config.backoff_base ** attempts, self.config.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+    async def _deliver(self, provider, message: dict):
+        lease = {"message_id": message["message_id"], "status": "sending", "attempts": message["attempts"]}
+        try:
+            await asyncio.to_thread(provider.send_sms, to=message["to"], body=message["body"])
+        except Exception as e:
+            now = database.utcnow()
+            if message["attempts"] >= self.config.max_attempts:
+                update = {"status": "failed", "completed_at": now}
+                logger.warning("SMS %s failed permanently: %s", message["message_id"], e)
+            else:
+                update = {
+                    "status": "pending",
+                    "next_attempt_at": now + datetime.timedelta(seconds=self._backoff(message["attempts"]))
+                }
+            await self.db["sms_outbox"].update_one(lease, {"$set": {**update, "last_error": str(e)}})
+            return
+        now = database.utcnow()
+        await self.db["sms_outbox"].update_one(
+            lease,
+            {"$set": {"status": "sent", "sent_at": now, "completed_at": now}}
+        )
+    async def _worker(self, provider):
+        while True:
+            try:
+                message = await self._claim()
+            except pymongo.errors.PyMongoError as e:
+                logger.warning("SMS outbox claim failed: %s", e)
+                message = None
+            if message is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.config.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._deliver(provider, message)
+            except pymongo.errors.PyMongoError as e:
+                # The lease expires and the message is retried.
+                logger.warning("SMS outbox update failed: %s", e)
+    async def run(self, provider):
+        """
+        Drains the outbox with `SMS.workers` concurrent senders until cancelled.
+        """
+        await asyncio.gather(*(self._worker(provider) for _ in range(self.config.workers)))
@@ -0,0 +1,234 @@
+"""
+Static site build and delivery for the `frontend/` tree.
+`build` copies the site with content-hashed asset names, rewrites the
+references to them in HTML and CSS and precompresses text files with gzip
+and, if the `brotli` package is installed, brotli. `StaticSite` serves the
+build: hashed assets are immutable, pages revalidate with ETags, and the
+best precompressed variant is picked from Accept-Encoding.
+"""
+
+import dataclasses
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+from core import config, headers
+from starlette.responses import FileResponse, Response
+
+logger = logging.getLogger("ecofinds")
+
+MANIFEST = "manifest.json"
+# Encodings in order of preference when the client accepts several.
+ENCODINGS = ("br", "gzip")
+EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/xml", "image/svg+xml")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+REFERENCE_PATTERNS = {
+    ".html": re.compile(r"""(?P<prefix>\b(?:href|src)\s*=\s*["'])(?P<url>[^"'#?]+)"""),
+    ".css": re.compile(r"""(?P<prefix>url\(\s*["']?)(?P<url>[^"')#?]+)"""),
+}
+
+def content_type(path: str) -> str:
+    guessed, _ = mimetypes.guess_type(path)
+    guessed = guessed or "application/octet-stream"
+    if guessed.startswith("text/") or guessed == "application/javascript":
+        guessed += "; charset=utf-8"
+    return guessed
+
+def _hashed_name(path: str, digest: str) -> str:
+    root, extension = posixpath.splitext(path)
+    return f"{root}.{digest[:12]}{extension}"
+
+def _rewrite(path: str, text: str, urls: dict[str, str]) -> str:
+    """
+    Points references in an HTML or CSS file at the hashed asset URLs.
+    """
+    pattern = REFERENCE_PATTERNS.get(posixpath.splitext(path)[1])
+    if pattern is None:
+        return text
+    directory = posixpath.dirname(path)
+    def replace(match: re.Match) -> str:
+        url = match["url"].strip()
+        if "://" in url or url.startswith(("//", "data:", "mailto:")):
+            return match[0]
+        target = posixpath.normpath(url.lstrip("/") if url.startswith("/") else posixpath.join(directory, url))
+        if target not in urls:
+            return match[0]
+        return match["prefix"] + "/" + urls[target]
+    return pattern.sub(replace, text)
+
+def build(source: str, output: str, gzip_level: int = 9, brotli_quality: int = 11) -> dict:
+    """
+    Builds the site in `source` into `output`, replacing a previous build.
+    HTML keeps its name, since pages are addressed by URL; every other file
+    gets a content hash in its name. Returns the manifest.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        logger.warning("brotli is not installed; only gzip variants are built.")
+    if os.path.exists(output):
+        if not os.path.exists(os.path.join(output, MANIFEST)):
+            raise ValueError(f"{output} exists and is not a static build; refusing to replace it.")
+        shutil.rmtree(output)
+    paths = []
+    for directory, _, files in os.walk(source):
+        for name in files:
+            relative = os.path.relpath(os.path.join(directory, name), source)
+            paths.append(relative.replace(os.sep, "/"))
+    # Assets before the stylesheets that reference them, pages last.
+    order = {".css": 1, ".html": 2}
+    paths.sort(key=lambda path: (order.get(posixpath.splitext(path)[1], 0), path))
+    urls = {}
+    files = {}
+    for path in paths:
+        with open(os.path.join(source, path), "rb") as f:
+            data = f.read()
+        if posixpath.splitext(path)[1] in REFERENCE_PATTERNS:
+            data = _rewrite(path, data.decode("utf-8"), urls).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        name = path if path.endswith(".html") else _hashed_name(path, digest)
+        urls[path] = name
+        variants = {None: data}
+        media_type = content_type(path)
+        if media_type.startswith(COMPRESSIBLE_TYPES):
+            variants["gzip"] = gzip.compress(data, compresslevel=gzip_level, mtime=0)
+            if brotli is not None:
+                variants["br"] = brotli.compress(data, quality=brotli_quality)
+        encodings = {}
+        for encoding, body in variants.items():
+            if encoding is not None and len(body) >= len(data):
+                continue
+            file = name + (EXTENSIONS[encoding] if encoding else "")
+            os.makedirs(os.path.dirname(os.path.join(output, file)), exist_ok=True)
+            with open(os.path.join(output, file), "wb") as f:
+                f.write(body)
+            if encoding is not None:
+                encodings[encoding] = file
+        files[path] = {
+            "file": name,
+            "hash": digest[:24],
+            "content_type": media_type,
+            "size": len(data),
+            "encodings": encodings,
+        }
+    manifest = {"files": files}
+    with open(os.path.join(output, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+@dataclasses.dataclass
+class Variant:
+    path: str
+    size: int
+    etag: str
+    encoding: str | None = None
+    body: bytes | None = None
+    stat: os.stat_result | None = None
+
+@dataclasses.dataclass
+class Asset:
+    content_type: str
+    cache_control: str
+    variants: dict[str | None, Variant]
+
+class StaticSite:
+    """
+    ASGI app serving a site built by `build`.
+    Files up to `memory_max_size` bytes are held in memory; larger ones are
+    sent from disk with FileResponse, which uses the server's sendfile
+    support where it has it.
+    """
+    def __init__(self, config: config.Static):
+        self.config = config
+        self.directory = config.directory
+        with open(os.path.join(self.directory, MANIFEST), encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.routes: dict[str, Asset] = {}
+        for path, entry in manifest["files"].items():
+            variants = {None: self._variant(entry["file"], f'"{entry["hash"]}"')}
+            for encoding, file in entry["encodings"].items():
+                variants[encoding] = self._variant(file, f'"{entry["hash"]}-{encoding}"', encoding)
+            immutable = entry["file"] != path
+            self.routes[entry["file"]] = Asset(
+                entry["content_type"],
+                IMMUTABLE if immutable else REVALIDATE,
+                variants
+            )
+            if immutable:
+                # The original name stays reachable, but must revalidate.
+                self.routes[path] = Asset(entry["content_type"], REVALIDATE, variants)
+            if path.endswith("/index.html"):
+                page = self.routes[path]
+                self.routes[path.removesuffix("index.html")] = page
+                self.routes[path.removesuffix("/index.html")] = page
+        if config.root_page in self.routes:
+            self.routes[""] = self.routes[config.root_page]
+        self.not_found = self.routes.get(config.not_found_page)
+    def _variant(self, file: str, etag: str, encoding: str | None = None) -> Variant:
+        path = os.path.join(self.directory, file)
+        stat = os.stat(path)
+        body = None
+        if stat.st_size <= self.config.memory_max_size:
+            with open(path, "rb") as f:
+                body = f.read()
+        return Variant(path, stat.st_size, etag, encoding, body, stat)
+    def _response(self, scope, asset: Asset, status_code: int = 200) -> Response:
+        request_headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        encoding = headers.negotiate_encoding(
+            request_headers.get("accept-encoding"),
+            tuple(encoding for encoding in ENCODINGS if encoding in asset.variants)
+        )
+        variant = asset.variants[encoding]
+        response_headers = {"ETag": variant.etag, "Cache-Control": asset.cache_control}
+        if len(asset.variants) > 1:
+            response_headers["Vary"] = "Accept-Encoding"
+        if status_code == 200 and headers.etag_matches(request_headers.get("if-none-match"), variant.etag):
+            return Response(status_code=304, headers=response_headers)
+        if encoding is not None:
+            response_headers["Content-Encoding"] = encoding
+        if variant.body is None:
+            return FileResponse(
+                variant.path,
+                status_code=status_code,
+                headers=response_headers,
+                media_type=asset.content_type,
+                stat_result=variant.stat
+            )
+        body = variant.body
+        if scope["method"] == "HEAD":
+            response_headers["Content-Length"] = str(len(body))
+            body = b""
+        return Response(body, status_code=status_code, headers=response_headers, media_type=asset.content_type)
+    async def __call__(self, scope, receive, send):
+        path = scope["path"].removeprefix(scope.get("root_path", "")).lstrip("/")
+        if scope["method"] not in ("GET", "HEAD"):
+            response = Response(status_code=405, headers={"Allow": "GET, HEAD"})
+        elif path in self.routes:
+            response = self._response(scope, self.routes[path])
+        elif self.not_found is not None:
+            response = self._response(scope, self.not_found, status_code=404)
+        else:
+            response = Response(status_code=404)
+        await response(scope, receive, send)
+
+def fallback(site: StaticSite, not_found, api_prefix: str = "/a/"):
+    """
+    Returns an ASGI app to install as the router's default, which Starlette
+    calls only after routing found no match: 405s for API paths and
+    trailing-slash redirects still happen first. Paths under `api_prefix`
+    and non-HTTP scopes go to `not_found`.
+    """
+    async def app(scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].startswith(api_prefix):
+            await site(scope, receive, send)
+        else:
+            await not_found(scope, receive, send)
+    return app
@@ -4,42 +4,99 @@ Author: github.com/bugbrekr
 Date: 31/08/2025
 """
 
-from typing import Annotated
+import contextlib
+import hmac
+import orjson
+import logging
+import os
+from typing import Annotated, Literal
 import core.auth
+import core.compression
 import core.config
+import core.container
 import core.database
-import core.profile
-import core.product
-import core.cart
-import core.orders
+import core.headers
+import core.metrics
+import core.static
+import schemas.admin
 import schemas.auth
 import schemas.cart
-from fastapi import FastAPI, Header
+import schemas.orders
+import schemas.product
+import schemas.profile
+import schemas.response
+from fastapi import Depends, FastAPI, Header, Query, Request, Response
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+logger = logging.getLogger("ecofinds")
 
-config = core.config.load_config()
+config = core.config.load_config(os.environ.get("ECOFINDS_CONFIG", "config.toml"))
+# Set by `manage.py serve` to the number of worker processes it started.
+config.server.workers = int(os.environ.get("ECOFINDS_WORKERS", config.server.workers))
 
-db = core.database.factory(
-    uri=config.mongodb.uri,
-    db_name=config.mongodb.db
+metrics_registry = core.metrics.Registry()
+command_metrics = None
+if config.metrics.enabled and config.metrics.mongo_commands:
+    command_metrics = core.metrics.CommandMetrics(metrics_registry)
+
+slow_query_recorder = None
+if config.slow_query_log.enabled:
+    slow_query_recorder = core.database.SlowQueryRecorder(config.slow_query_log)
+
+pool_stats = core.database.PoolStats(config.mongodb.max_pool_size)
+
+metrics_registry.gauge(
+    "mongo_pool_connections",
+    "MongoDB pool connections by state, across all servers.",
+    ("state",),
+    lambda: {("open",): pool_stats.open, ("in_use",): pool_stats.in_use, ("waiting",): pool_stats.waiting}
 )
-twilioc = core.auth.TwilioClient(
-    account_sid=config.twilio.account_sid,
-    auth_token=config.twilio.auth_token,
-    sms_from_ph=config.twilio.sms_from_ph
+metrics_registry.gauge(
+    "mongo_pool_max_size",
+    "Configured maximum MongoDB pool size per server.",
+    (),
+    lambda: {(): pool_stats.max_pool_size}
 )
-
-authorization_manager = core.auth.AuthorizationManager(
-    config=config.auth,
-    db=db,
-    twilio_client=twilioc,
+metrics_registry.gauge(
+    "mongo_pool_checkout_failures_total",
+    "MongoDB connection checkouts that failed or timed out.",
+    (),
+    lambda: {(): pool_stats.checkout_failures},
+    kind="counter"
 )
-profile_manager = core.profile.ProfileManager(db=db)
-product_manager = core.product.ProductListingManager(db=db)
-cart_manager = core.cart.CartManager(db=db)
-order_manager = core.orders.OrderManager(db=db)
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are created here rather than at import, so every worker
+    # process gets its own.
+    container = core.container.Container(
+        config,
+        event_listeners=[listener for listener in (command_metrics, slow_query_recorder, pool_stats) if listener]
+    )
+    container.register_metrics(metrics_registry)
+    await container.start()
+    if slow_query_recorder is not None:
+        container.spawn(slow_query_recorder.run(container.db))
+    app.state.container = container
+    try:
+        yield
+    finally:
+        await container.close()
+
+def get_container(request: Request) -> core.container.Container:
+    return request.app.state.container
+
+Container = Annotated[core.container.Container, Depends(get_container)]
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Added first so it sits innermost, inside the metrics middleware.
+if config.server.compression_encodings:
+    app.add_middleware(core.compression.CompressionMiddleware, config=config.server, registry=metrics_registry)
+
+if config.metrics.enabled:
+    app.add_middleware(core.metrics.MetricsMiddleware, registry=metrics_registry)
 
 app.add_middleware(
     CORSMiddleware,
@@ -49,42 +106,93 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/a/auth/generateOTP")
-def auth_generate_otp(otp_request: schemas.auth.OTPRequest):
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Serves application metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics_registry.render(), media_type=core.metrics.CONTENT_TYPE)
+
+def is_admin(token: str | None) -> bool:
+    admin_token = config.server.admin_token
+    return bool(admin_token) and token is not None and hmac.compare_digest(token, admin_token)
+
+@app.get("/a/admin/slow-queries", response_model=schemas.admin.SlowQueriesResponse, response_model_exclude_unset=True)
+async def get_slow_queries(
+        limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+        x_admin_token: Annotated[str | None, Header()] = None
+    ):
+    """
+    Lists recent slow MongoDB commands, newest first.
+    Requires the X-Admin-Token header.
+    """
+    if not is_admin(x_admin_token):
+        return {
+            "success": False,
+            "code": 403,
+        }
+    if slow_query_recorder is None:
+        return {
+            "success": False,
+            "code": 404,
+            "message": "The slow query log is disabled."
+        }
+    return {
+        "success": True,
+        "code": 200,
+        "seen": slow_query_recorder.seen,
+        "queries": slow_query_recorder.recent(limit)
+    }
+
+async def ndjson_stream(documents, chunk_size: int = 100):
+    """
+    Encodes an async iterator of documents as NDJSON, a chunk of lines at a time.
+    """
+    lines = []
+    async for document in documents:
+        lines.append(orjson.dumps(document, default=str))
+        if len(lines) >= chunk_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+@app.post("/a/auth/generateOTP", response_model=schemas.auth.OTPResponse, response_model_exclude_unset=True)
+async def auth_generate_otp(container: Container, otp_request: schemas.auth.OTPRequest):
     """
     Generates and sends OTP to user's phone number.
     """
-    otp_session = authorization_manager.otp_factory(
+    otp_session = container.authorization_manager.otp_factory(
         phone_number=otp_request.phone_number
     )
-    session_id = otp_session.send_otp()
+    session_id = await otp_session.send_otp()
     return {
         "success": True,
         "code": 200,
         "session_id": session_id
     }
 
-@app.post("/a/auth/verifyOTP")
-def auth_verify_otp(otp_validation_request: schemas.auth.OTPValidationRequest):
+@app.post("/a/auth/verifyOTP", response_model=schemas.auth.AuthTokenResponse, response_model_exclude_unset=True)
+async def auth_verify_otp(container: Container, otp_validation_request: schemas.auth.OTPValidationRequest):
     """
     Verifies OTP for the session.
     """
-    otp_session = authorization_manager.otp_factory(
+    otp_session = container.authorization_manager.otp_factory(
         session_id=otp_validation_request.session_id
     )
-    res, res_code = otp_session.verify_otp(otp_validation_request.otp)
+    res, res_code = await otp_session.verify_otp(otp_validation_request.otp)
     return {
         "success": res,
         "code": res_code,
         "auth_token": "helloworld"
     }
 
-@app.post("/a/auth/login/email")
-def auth_login_email(login_request: schemas.auth.LoginEmailRequest):
+@app.post("/a/auth/login/email", response_model=schemas.auth.LoginEmailResponse, response_model_exclude_unset=True)
+async def auth_login_email(container: Container, login_request: schemas.auth.LoginEmailRequest):
     """
     Authenticates user with email and password.
     """
-    res, code = authorization_manager.login_email_step(
+    res, code = await container.authorization_manager.login_email_step(
         email=login_request.email
     )
     return {
@@ -93,12 +201,12 @@ def auth_login_email(login_request: schemas.auth.LoginEmailRequest):
         "redirect_url": "/login/password"
     }
 
-@app.post("/a/auth/login/password")
-def auth_login_password(login_request: schemas.auth.LoginPasswordRequest):
+@app.post("/a/auth/login/password", response_model=schemas.auth.AuthTokenResponse, response_model_exclude_unset=True)
+async def auth_login_password(container: Container, login_request: schemas.auth.LoginPasswordRequest):
     """
     Authenticates user with email and password.
     """
-    res, code = authorization_manager.verify_creds(
+    res, code = await container.authorization_manager.verify_creds(
         email=login_request.email,
         password=login_request.password
     )
@@ -114,14 +222,20 @@ def auth_login_password(login_request: schemas.auth.LoginPasswordRequest):
             "code": code,
             "message": "Invalid credentials."
         }
+    if code == 503:
+        return {
+            "success": False,
+            "code": code,
+            "message": "The server is busy. Please try again."
+        }
     if code != 200:
         return {
             "success": False,
             "code": code,
             "message": "An unknown error occurred."
         }
-    auth_token = authorization_manager.generate_auth_token(
-        user_id=login_request.email
+    auth_token = await container.authorization_manager.generate_auth_token(
+        email=login_request.email
     )
     return {
         "success": True,
@@ -129,12 +243,12 @@ def auth_login_password(login_request: schemas.auth.LoginPasswordRequest):
         "auth_token": auth_token
     }
 
-@app.post("/a/auth/login/register")
-def auth_login_register(register_request: schemas.auth.LoginRegisterRequest):
+@app.post("/a/auth/login/register", response_model=schemas.auth.AuthTokenResponse, response_model_exclude_unset=True)
+async def auth_login_register(container: Container, register_request: schemas.auth.LoginRegisterRequest):
     """
     Registers a new user with name, email and password.
     """
-    _, code = authorization_manager.login_register(
+    _, code = await container.authorization_manager.login_register(
         email=register_request.email,
         password=register_request.password
     )
@@ -144,16 +258,22 @@ def auth_login_register(register_request: schemas.auth.LoginRegisterRequest):
             "code": code,
             "message": "User already exists. Please login."
         }
+    if code == 503:
+        return {
+            "success": False,
+            "code": code,
+            "message": "The server is busy. Please try again."
+        }
     if code != 200:
         return {
             "success": False,
             "code": code,
             "message": "An unknown error occurred."
         }
-    auth_token = authorization_manager.generate_auth_token(
+    auth_token = await container.authorization_manager.generate_auth_token(
         email=register_request.email
     )
-    profile_manager.create_user_profile(
+    await container.profile_manager.create_user_profile(
         email=register_request.email,
         full_name=register_request.full_name
     )
@@ -163,12 +283,12 @@ def auth_login_register(register_request: schemas.auth.LoginRegisterRequest):
         "auth_token": auth_token
     }
 
-@app.post("/a/auth/verifyToken")
-def auth_verify_token(verify_request: schemas.auth.VerifyTokenRequest):
+@app.post("/a/auth/verifyToken", response_model=schemas.response.APIResponse, response_model_exclude_unset=True)
+async def auth_verify_token(container: Container, verify_request: schemas.auth.VerifyTokenRequest):
     """
     Verifies auth token.
     """
-    res, code = authorization_manager.verify_auth_token(
+    res, code = await container.authorization_manager.verify_auth_token(
         auth_token=verify_request.auth_token
     )
     return {
@@ -176,12 +296,29 @@ def auth_verify_token(verify_request: schemas.auth.VerifyTokenRequest):
         "code": code
     }
 
-@app.get("/a/profile/my")
-def get_profile(Authorization: Annotated[str | None, Header()] = None):
+@app.post("/a/auth/logout", response_model=schemas.response.APIResponse, response_model_exclude_unset=True)
+async def auth_logout(container: Container, Authorization: Annotated[str | None, Header()] = None):
+    """
+    Revokes the auth token in the Authorization header.
+    """
+    auth_token = core.auth.bearer_token(Authorization)
+    if auth_token is None:
+        return {
+            "success": False,
+            "code": 401,
+        }
+    res = await container.authorization_manager.revoke_auth_token(auth_token)
+    return {
+        "success": res,
+        "code": 200 if res else 401
+    }
+
+@app.get("/a/profile/my", response_model=schemas.profile.ProfileResponse, response_model_exclude_unset=True)
+async def get_profile(container: Container, Authorization: Annotated[str | None, Header()] = None):
     """
     Fetches user profile by email.
     """
-    email, code = authorization_manager.verify_authorization_header(Authorization)
+    email, code = await container.authorization_manager.verify_authorization_header(Authorization)
     if code != 200:
         return {
             "success": False,
@@ -193,7 +330,7 @@ def get_profile(Authorization: Annotated[str | None, Header()] = None):
             "code": 404,
             "message": "Profile not found."
         }
-    profile = profile_manager.get_user_profile(email=email)
+    profile = await container.profile_manager.get_user_profile(email=email)
     if not profile:
         return {
             "success": False,
@@ -206,24 +343,140 @@ def get_profile(Authorization: Annotated[str | None, Header()] = None):
         "profile": profile
     }
 
-@app.get("/a/products/search")
-def search_products(query: str):
+@app.get("/a/products/search", response_model=schemas.product.SearchResponse, response_model_exclude_unset=True)
+async def search_products(
+        container: Container,
+        response: Response,
+        query: str = "",
+        category: str | None = None,
+        price_min: float | None = None,
+        price_max: float | None = None,
+        seller_email: str | None = None,
+        sort: Literal["relevance", "price", "-price", "created_at", "-created_at"] = "relevance",
+        after: str | None = None,
+        limit: Annotated[int, Query(ge=1, le=100)] = 20,
+        facets: bool = False,
+        if_none_match: Annotated[str | None, Header()] = None
+    ):
+    """
+    Searches for products based on a query string and filters.
+    Pass the returned `next` cursor as `after` to fetch the next page.
+    Set `facets` to also get category, price and seller counts.
+    Pages are cached briefly and carry an ETag; sending it back in
+    If-None-Match gets a 304 while the results are unchanged.
+    """
+    try:
+        page, etag = await container.product_manager.cached_search(
+            query=query,
+            category=category,
+            price_min=price_min,
+            price_max=price_max,
+            seller_email=seller_email,
+            sort=sort,
+            after=after,
+            limit=limit,
+            facets=facets
+        )
+    except ValueError:
+        return {
+            "success": False,
+            "code": 400,
+            "message": "Invalid search cursor."
+        }
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={config.search_cache.max_age}"
+    }
+    if core.headers.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return {
+        "success": True,
+        "code": 200,
+        **page
+    }
+
+@app.get("/a/products/autocomplete", response_model=schemas.product.AutocompleteResponse, response_model_exclude_unset=True)
+async def autocomplete_products(
+        container: Container,
+        prefix: Annotated[str, Query(max_length=100)] = "",
+        limit: Annotated[int, Query(ge=1, le=50)] = 10
+    ):
     """
-    Searches for products based on a query string.
+    Suggests listing titles and categories starting with `prefix`.
+    Served from memory, so it is cheap enough to call on every keystroke.
     """
-    results = product_manager.search_products(query)
+    autocomplete = container.product_manager.autocomplete
+    if autocomplete is None:
+        return {
+            "success": False,
+            "code": 404,
+            "message": "Autocomplete is disabled."
+        }
     return {
         "success": True,
         "code": 200,
-        "results": results
+        "suggestions": autocomplete.suggest(prefix, limit)
     }
 
-@app.post("/a/cart/add")
-def add_to_cart(request: schemas.cart.AddToCartRequest, Authorization: Annotated[str | None, Header()] = None):
+@app.post("/a/products/import", response_model=schemas.product.ImportResponse, response_model_exclude_unset=True)
+async def import_products(
+        container: Container,
+        request: Request,
+        format: Literal["csv", "ndjson"] | None = None,
+        Authorization: Annotated[str | None, Header()] = None
+    ):
+    """
+    Bulk imports the user's listings from a CSV or NDJSON request body.
+    The format defaults to CSV for text/csv bodies and NDJSON otherwise.
+    The body is streamed, so uploads of any size are accepted.
+    """
+    email, code = await container.authorization_manager.verify_authorization_header(Authorization)
+    if code != 200:
+        return {
+            "success": False,
+            "code": code,
+        }
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    report = await container.product_manager.import_listings(
+        request.stream(),
+        format=format,
+        seller_email=email,
+        batch_size=config.ingest.batch_size,
+        max_errors=config.ingest.max_errors,
+        max_record_size=config.ingest.max_record_size
+    )
+    return {
+        "success": True,
+        "code": 200,
+        "report": report.as_dict()
+    }
+
+@app.get("/a/products/{product_id}", response_model=schemas.product.ProductResponse, response_model_exclude_unset=True)
+async def get_product(container: Container, product_id: str):
+    """
+    Fetches a product listing by product ID.
+    """
+    product = await container.product_manager.get_product_listing(product_id)
+    if product is None:
+        return {
+            "success": False,
+            "code": 404,
+            "message": "Product not found."
+        }
+    return {
+        "success": True,
+        "code": 200,
+        "product": product
+    }
+
+@app.post("/a/cart/add", response_model=schemas.response.APIResponse, response_model_exclude_unset=True)
+async def add_to_cart(container: Container, request: schemas.cart.AddToCartRequest, Authorization: Annotated[str | None, Header()] = None):
     """
     Adds a product to the user's cart.
     """
-    email, code = authorization_manager.verify_authorization_header(Authorization)
+    email, code = await container.authorization_manager.verify_authorization_header(Authorization)
     if code != 200:
         return {
             "success": False,
@@ -235,7 +488,7 @@ def add_to_cart(request: schemas.cart.AddToCartRequest, Authorization: Annotated
             "code": 404,
             "message": "Profile not found."
         }
-    res = cart_manager.add_to_cart(email=email, product_id=request.product_id)
+    res = await container.cart_manager.add_to_cart(email=email, product_id=request.product_id)
     if not res:
         return {
             "success": False,
@@ -248,12 +501,12 @@ def add_to_cart(request: schemas.cart.AddToCartRequest, Authorization: Annotated
         "message": "Product added to cart."
     }
 
-@app.post("/a/cart/remove")
-def remove_from_cart(request: schemas.cart.RemoveFromCartRequest, Authorization: Annotated[str | None, Header()] = None):
+@app.post("/a/cart/remove", response_model=schemas.response.APIResponse, response_model_exclude_unset=True)
+async def remove_from_cart(container: Container, request: schemas.cart.RemoveFromCartRequest, Authorization: Annotated[str | None, Header()] = None):
     """
     Removes a product from the user's cart.
     """
-    email, code = authorization_manager.verify_authorization_header(Authorization)
+    email, code = await container.authorization_manager.verify_authorization_header(Authorization)
     if code != 200:
         return {
             "success": False,
@@ -265,7 +518,7 @@ def remove_from_cart(request: schemas.cart.RemoveFromCartRequest, Authorization:
             "code": 404,
             "message": "Profile not found."
         }
-    res = cart_manager.remove_from_cart(email=email, product_id=request.product_id)
+    res = await container.cart_manager.remove_from_cart(email=email, product_id=request.product_id)
     if not res:
         return {
             "success": False,
@@ -278,12 +531,102 @@ def remove_from_cart(request: schemas.cart.RemoveFromCartRequest, Authorization:
         "message": "Product removed from cart."
     }
 
-@app.get("/a/cart/")
-def get_cart_items(Authorization: Annotated[str | None, Header()] = None):
+@app.post("/a/cart/checkout", response_model=schemas.orders.CheckoutResponse, response_model_exclude_unset=True)
+async def checkout(
+        container: Container,
+        Authorization: Annotated[str | None, Header()] = None,
+        idempotency_key: Annotated[str | None, Header()] = None
+    ):
+    """
+    Places an order for everything in the user's cart and empties it.
+    Clients must send an Idempotency-Key header and reuse it when retrying.
+    """
+    email, code = await container.authorization_manager.verify_authorization_header(Authorization)
+    if code != 200:
+        return {
+            "success": False,
+            "code": code,
+        }
+    if not idempotency_key:
+        return {
+            "success": False,
+            "code": 400,
+            "message": "Idempotency-Key header is required."
+        }
+    try:
+        order, code = await container.order_manager.checkout(email=email, idempotency_key=idempotency_key)
+    except ValueError:
+        return {
+            "success": False,
+            "code": 400,
+            "message": "Invalid Idempotency-Key header."
+        }
+    if order is None:
+        return {
+            "success": False,
+            "code": code,
+            "message": "Cart is empty." if code == 404 else "None of the products in the cart are listed anymore."
+        }
+    return {
+        "success": True,
+        "code": 200,
+        "order": order
+    }
+
+@app.get("/a/orders", response_model=schemas.orders.OrdersResponse, response_model_exclude_unset=True)
+async def get_orders(
+        container: Container,
+        after: str | None = None,
+        limit: Annotated[int, Query(ge=1, le=100)] = 20,
+        Authorization: Annotated[str | None, Header()] = None
+    ):
+    """
+    Fetches a page of the user's orders, newest first.
+    Pass the returned `next` cursor as `after` to fetch the next page.
+    """
+    email, code = await container.authorization_manager.verify_authorization_header(Authorization)
+    if code != 200:
+        return {
+            "success": False,
+            "code": code,
+        }
+    try:
+        orders, next_cursor = await container.order_manager.get_orders(email=email, after=after, limit=limit)
+    except ValueError:
+        return {
+            "success": False,
+            "code": 400,
+            "message": "Invalid orders cursor."
+        }
+    return {
+        "success": True,
+        "code": 200,
+        "orders": orders,
+        "next": next_cursor
+    }
+
+@app.get("/a/orders/export")
+async def export_orders(container: Container, Authorization: Annotated[str | None, Header()] = None):
     """
-    Fetches all items in the user's cart.
+    Streams all of the user's orders as NDJSON.
     """
-    email, code = authorization_manager.verify_authorization_header(Authorization)
+    email, code = await container.authorization_manager.verify_authorization_header(Authorization)
+    if code != 200:
+        return {
+            "success": False,
+            "code": code,
+        }
+    return StreamingResponse(
+        ndjson_stream(container.order_manager.iter_orders(email=email)),
+        media_type="application/x-ndjson"
+    )
+
+@app.get("/a/cart/", response_model=schemas.cart.CartResponse, response_model_exclude_unset=True)
+async def get_cart_items(container: Container, Authorization: Annotated[str | None, Header()] = None):
+    """
+    Fetches all items in the user's cart with product details and total.
+    """
+    email, code = await container.authorization_manager.verify_authorization_header(Authorization)
     if code != 200:
         return {
             "success": False,
@@ -295,9 +638,22 @@ def get_cart_items(Authorization: Annotated[str | None, Header()] = None):
             "code": 404,
             "message": "Profile not found."
         }
-    items = cart_manager.get_cart_items(email=email)
+    cart = await container.cart_manager.get_cart(email=email)
     return {
         "success": True,
         "code": 200,
-        "items": items
-    }
\ No newline at end of file
+        "items": cart["items"],
+        "missing": cart["missing"],
+        "total": cart["total"]
+    }
+
+# The site answers only what routing left unmatched, so API paths keep
+# their 404s, 405s and trailing-slash redirects.
+if config.static.enabled:
+    if os.path.exists(os.path.join(config.static.directory, core.static.MANIFEST)):
+        app.router.default = core.static.fallback(core.static.StaticSite(config.static), app.router.not_found)
+    else:
+        logger.warning(
+            "No static build in %s; run `python manage.py build-static` to serve the frontend.",
+            config.static.directory
+        )
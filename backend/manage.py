@@ -0,0 +1,201 @@
+"""
+Backend management commands.
+Usage: python manage.py <command> [options]
+"""
+
+import argparse
+import asyncio
+import orjson
+import os
+import sys
+import core.config
+import core.container
+import core.database
+import core.ingest
+import core.static
+
+async def rebuild_search_index(config: core.config.Config, args: argparse.Namespace):
+    """
+    Rebuilds the product search index from existing listings.
+    """
+    container = core.container.Container(config)
+    try:
+        count = await container.product_manager.search_index.rebuild(batch_size=args.batch_size)
+    finally:
+        await container.close()
+    print(f"Indexed {count} product listings.")
+
+async def read_chunks(path: str, chunk_size: int = 1 << 20):
+    with open(path, "rb") as f:
+        while chunk := await asyncio.to_thread(f.read, chunk_size):
+            yield chunk
+
+async def import_products(config: core.config.Config, args: argparse.Namespace):
+    """
+    Bulk imports product listings from a CSV or NDJSON file.
+    """
+    container = core.container.Container(config)
+    format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    try:
+        report = await container.product_manager.import_listings(
+            read_chunks(args.path),
+            format=format,
+            seller_email=args.seller_email,
+            batch_size=args.batch_size or config.ingest.batch_size,
+            max_errors=config.ingest.max_errors,
+            max_record_size=config.ingest.max_record_size
+        )
+    finally:
+        await container.close()
+    for error in report.errors:
+        print(f"row {error['row']}: {error['error']}", file=sys.stderr)
+    print(f"Imported {report.inserted} of {report.rows} rows, {report.failed} failed.")
+    if report.failed:
+        sys.exit(1)
+
+def print_index_report(report: list[core.database.IndexStatus]):
+    for status in report:
+        line = f"{status.status:<12} {status.collection}.{status.name}"
+        if status.detail:
+            line += f" ({status.detail})"
+        print(line)
+
+async def ensure_indexes(config: core.config.Config, args: argparse.Namespace):
+    """
+    Creates missing indexes and updates TTL indexes.
+    """
+    container = core.container.Container(config)
+    try:
+        report = await container.index_registry().apply(container.db)
+    finally:
+        await container.close()
+    print_index_report(report)
+    if any(status.status in ("different", "failed") for status in report):
+        sys.exit(1)
+
+async def migrate_session_dates(config: core.config.Config, args: argparse.Namespace):
+    """
+    Converts float session timestamps to dates so TTL indexes expire them.
+    """
+    container = core.container.Container(config)
+    try:
+        deleted, converted = await container.authorization_manager.migrate_session_dates()
+    finally:
+        await container.close()
+    print(f"Deleted {deleted} expired sessions and converted {converted}.")
+
+async def check_indexes(config: core.config.Config, args: argparse.Namespace):
+    """
+    Reports indexes that are missing or differ from the registry.
+    """
+    container = core.container.Container(config)
+    try:
+        report = await container.index_registry().diff(container.db)
+    finally:
+        await container.close()
+    print_index_report(report)
+    if any(status.status in ("missing", "different") for status in report):
+        sys.exit(1)
+
+async def export_orders(config: core.config.Config, args: argparse.Namespace):
+    """
+    Exports orders as NDJSON, streaming from the database.
+    """
+    container = core.container.Container(config)
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        async for order in container.order_manager.iter_orders(email=args.email):
+            output.write(orjson.dumps(order, default=str).decode() + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        await container.close()
+
+def build_static(config: core.config.Config, args: argparse.Namespace):
+    """
+    Builds the frontend for serving: hashed asset names and precompressed files.
+    """
+    manifest = core.static.build(
+        args.source or config.static.source,
+        args.output or config.static.directory
+    )
+    for path, entry in sorted(manifest["files"].items()):
+        encodings = ", ".join(entry["encodings"]) or "-"
+        print(f"{path:<40} {entry['file']:<48} {entry['size']:>8} {encodings}")
+
+def serve(config: core.config.Config, args: argparse.Namespace):
+    """
+    Serves the API with one worker process per available core.
+    SIGINT or SIGTERM stops accepting connections and lets in-flight
+    requests finish before the workers shut down.
+    """
+    import uvicorn
+    workers = args.workers or config.server.workers or core.config.available_cores()
+    # Workers import main themselves and read the config from here. The
+    # worker count lets each size its share of the password hashing pool.
+    os.environ["ECOFINDS_CONFIG"] = os.path.abspath(args.config)
+    os.environ["ECOFINDS_WORKERS"] = str(workers)
+    uvicorn.run(
+        "main:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host=args.host or config.server.host,
+        port=args.port or config.server.port,
+        workers=workers,
+        timeout_graceful_shutdown=config.server.graceful_shutdown_timeout,
+        proxy_headers=True,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="EcoFinds backend management.")
+    parser.add_argument(
+        "--config",
+        default=os.environ.get("ECOFINDS_CONFIG", "config.toml"),
+        help="Path to config.toml (default: $ECOFINDS_CONFIG or config.toml)."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = subparsers.add_parser("rebuild-search-index", help=rebuild_search_index.__doc__.strip())
+    rebuild.add_argument("--batch-size", type=int, default=1000)
+    rebuild.set_defaults(handler=rebuild_search_index)
+
+    ingest = subparsers.add_parser("import-products", help=import_products.__doc__.strip())
+    ingest.add_argument("path")
+    ingest.add_argument("--format", choices=core.ingest.FORMATS, help="Defaults to the file extension.")
+    ingest.add_argument("--seller-email", help="Seller for every row, overriding the seller_email column.")
+    ingest.add_argument("--batch-size", type=int)
+    ingest.set_defaults(handler=import_products)
+
+    indexes = subparsers.add_parser("ensure-indexes", help=ensure_indexes.__doc__.strip())
+    indexes.set_defaults(handler=ensure_indexes)
+
+    check = subparsers.add_parser("check-indexes", help=check_indexes.__doc__.strip())
+    check.set_defaults(handler=check_indexes)
+
+    sessions = subparsers.add_parser("migrate-session-dates", help=migrate_session_dates.__doc__.strip())
+    sessions.set_defaults(handler=migrate_session_dates)
+
+    export = subparsers.add_parser("export-orders", help=export_orders.__doc__.strip())
+    export.add_argument("--email", help="Only export this user's orders.")
+    export.add_argument("--output", help="File to write to (default: stdout).")
+    export.set_defaults(handler=export_orders)
+
+    static = subparsers.add_parser("build-static", help=build_static.__doc__.strip())
+    static.add_argument("--source", help="Defaults to static.source.")
+    static.add_argument("--output", help="Defaults to static.directory.")
+    static.set_defaults(handler=build_static)
+
+    server = subparsers.add_parser("serve", help=serve.__doc__.strip().splitlines()[0])
+    server.add_argument("--host", help="Defaults to server.host.")
+    server.add_argument("--port", type=int, help="Defaults to server.port.")
+    server.add_argument("--workers", type=int, help="Defaults to server.workers, or one per available core.")
+    server.set_defaults(handler=serve)
+
+    args = parser.parse_args()
+    config = core.config.load_config(args.config)
+    if asyncio.iscoroutinefunction(args.handler):
+        asyncio.run(args.handler(config, args))
+    else:
+        args.handler(config, args)
+
+if __name__ == "__main__":
+    main()
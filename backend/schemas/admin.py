@@ -0,0 +1,27 @@
+import datetime
+from pydantic import BaseModel
+from schemas.response import APIResponse
+
+class ExplainSummary(BaseModel):
+    plan: list[str] | None = None
+    collection_scan: bool | None = None
+    docs_examined: int | None = None
+    keys_examined: int | None = None
+    returned: int | None = None
+    execution_ms: int | None = None
+    error: str | None = None
+
+class SlowQuery(BaseModel):
+    time: datetime.datetime
+    database: str
+    collection: str | None
+    command: str
+    duration_ms: float
+    shape: dict
+    returned: int | None
+    error: str | None
+    explain: ExplainSummary | None
+
+class SlowQueriesResponse(APIResponse):
+    seen: int | None = None
+    queries: list[SlowQuery] | None = None
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from schemas.response import APIResponse
 
 class OTPRequest(BaseModel):
     phone_number: str
@@ -21,3 +22,12 @@ class LoginRegisterRequest(BaseModel):
 
 class VerifyTokenRequest(BaseModel):
     auth_token: str
+
+class OTPResponse(APIResponse):
+    session_id: str | None = None
+
+class AuthTokenResponse(APIResponse):
+    auth_token: str | None = None
+
+class LoginEmailResponse(APIResponse):
+    redirect_url: str | None = None
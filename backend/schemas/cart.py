@@ -1,11 +1,17 @@
 from pydantic import BaseModel
+from schemas.product import ListingSummary
+from schemas.response import APIResponse
 
 class CartItem(BaseModel):
-    product_id: int
+    product_id: str
     quantity: int
 
 class AddToCartRequest(BaseModel):
-    product_id: int
+    product_id: str
 
 class RemoveFromCartRequest(BaseModel):
-    product_id: int
\ No newline at end of file
+    product_id: str
+class CartResponse(APIResponse):
+    items: list[ListingSummary] | None = None
+    missing: list[str] | None = None
+    total: float | None = None
@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from schemas.response import APIResponse
+
+class Order(BaseModel):
+    order_id: str
+    products: list[str]
+    created_at: float
+
+class CheckoutResponse(APIResponse):
+    order: Order | None = None
+
+class OrdersResponse(APIResponse):
+    orders: list[Order] | None = None
+    next: str | None = None
@@ -0,0 +1,63 @@
+import datetime
+from pydantic import BaseModel
+from schemas.response import APIResponse
+
+class ListingSummary(BaseModel):
+    product_id: str
+    title: str | None = None
+    price: float | None = None
+    category: str | None = None
+    pictures: list[str] | None = None
+
+class Listing(ListingSummary):
+    description: str | None = None
+    seller_email: str | None = None
+    created_at: datetime.datetime | None = None
+
+class ProductResponse(APIResponse):
+    product: Listing | None = None
+
+class FacetCount(BaseModel):
+    value: str | None = None
+    count: int
+
+class PriceBucket(BaseModel):
+    min: float
+    max: float | None = None
+    count: int
+
+class SearchFacets(BaseModel):
+    categories: list[FacetCount]
+    price: list[PriceBucket]
+    # Listings whose price is below the first bucket or missing.
+    price_other: int = 0
+    sellers: list[FacetCount]
+    # Counts cover only the best-scoring matches of a very broad query.
+    approximate: bool = False
+
+class SearchResponse(APIResponse):
+    results: list[Listing] | None = None
+    next: str | None = None
+    facets: SearchFacets | None = None
+
+class Suggestion(BaseModel):
+    text: str
+    kind: str
+    count: int
+
+class AutocompleteResponse(APIResponse):
+    suggestions: list[Suggestion] | None = None
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportReport(BaseModel):
+    rows: int
+    inserted: int
+    failed: int
+    errors: list[ImportRowError]
+    errors_truncated: bool
+
+class ImportResponse(APIResponse):
+    report: ImportReport | None = None
@@ -0,0 +1,10 @@
+from pydantic import BaseModel, ConfigDict
+from schemas.response import APIResponse
+
+class Profile(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    email: str
+    full_name: str | None = None
+
+class ProfileResponse(APIResponse):
+    profile: Profile | None = None
@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+
+class APIResponse(BaseModel):
+    """
+    Fields shared by every response. Routes serialize with
+    `response_model_exclude_unset`, so only the keys a handler sets are sent.
+    """
+    success: bool
+    code: int
+    message: str | None = None
@@ -0,0 +1,10 @@
+import pytest
+from core import database
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def db() -> database.AsyncDatabase:
+    return database.factory("mongomock://", "test")
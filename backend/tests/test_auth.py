@@ -0,0 +1,106 @@
+import datetime
+import time
+import jwt
+import pytest
+from core import auth, config, database, sms
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def manager(db):
+    manager = auth.AuthorizationManager(
+        config=config.Auth(),
+        db=db,
+        outbox=sms.SMSOutbox(db, config.SMS())
+    )
+    yield manager
+    manager.password_hasher.close()
+
+@pytest.fixture
+def jwt_config():
+    return config.Auth(token_mode="jwt", jwt_keys={"k1": "secret-one", "k2": "secret-two"}, jwt_active_key="k2")
+
+@pytest.fixture
+def jwt_manager(db, jwt_config):
+    manager = auth.AuthorizationManager(config=jwt_config, db=db, outbox=sms.SMSOutbox(db, config.SMS()))
+    yield manager
+    manager.password_hasher.close()
+
+async def test_float_session_dates_are_migrated(manager):
+    now = time.time()
+    await manager.db["auth_sessions"].insert_many([
+        {"auth_token": "old", "created_at": now - 2 * manager.config.auth_token_ttl},
+        {"auth_token": "recent", "created_at": now - 60},
+        {"auth_token": "current", "created_at": datetime.datetime(2030, 1, 1)},
+    ])
+    await manager.db["otp_sessions"].insert_one({"session_id": "s", "created_at": now - 2 * manager.config.login_otp_ttl})
+    assert await manager.migrate_session_dates() == (2, 1)
+    sessions = {session["auth_token"]: session["created_at"] for session in await manager.db["auth_sessions"].find({}).to_list(None)}
+    assert sessions.keys() == {"recent", "current"}
+    expected = datetime.datetime.fromtimestamp(now - 60, datetime.timezone.utc).replace(tzinfo=None)
+    assert abs((sessions["recent"] - expected).total_seconds()) < 0.01
+    assert await manager.db["otp_sessions"].count_documents({}) == 0
+    assert await manager.migrate_session_dates() == (0, 0)
+
+async def test_session_lookups_are_cached(manager):
+    auth_token = await manager.generate_auth_token("a@b")
+    assert await manager.verify_authorization_header(f"Bearer {auth_token}") == ("a@b", 200)
+    await manager.db["auth_sessions"].delete_many({})
+    assert await manager.verify_authorization_header(f"Bearer {auth_token}") == ("a@b", 200)
+    assert manager.token_cache.hits == 1
+    assert manager.invalidate_auth_token(auth_token)
+    assert await manager.verify_auth_token(auth_token) == (False, 401)
+
+async def test_unknown_tokens_are_cached_briefly(manager):
+    assert await manager.verify_auth_token("unknown") == (False, 401)
+    await manager.db["auth_sessions"].insert_one({"email": "a@b", "auth_token": "unknown", "created_at": database.utcnow()})
+    assert await manager.verify_auth_token("unknown") == (False, 401)
+    manager.token_cache.invalidate("unknown")
+    assert await manager.verify_auth_token("unknown") == (True, 200)
+
+async def test_revoked_sessions_leave_the_cache(manager):
+    auth_token = await manager.generate_auth_token("a@b")
+    assert await manager.verify_auth_token(auth_token) == (True, 200)
+    assert await manager.revoke_auth_token(auth_token)
+    assert await manager.verify_auth_token(auth_token) == (False, 401)
+
+async def test_signed_tokens_are_verified_without_sessions(jwt_manager):
+    auth_token = await jwt_manager.generate_auth_token("a@b")
+    assert await jwt_manager.db["auth_sessions"].count_documents({}) == 0
+    assert await jwt_manager.verify_authorization_header(f"Bearer {auth_token}") == ("a@b", 200)
+    assert jwt.get_unverified_header(auth_token)["kid"] == "k2"
+    assert await jwt_manager.verify_auth_token(auth_token[:-2] + "xx") == (False, 401)
+
+async def test_signed_tokens_follow_key_rotation(jwt_manager, jwt_config):
+    retired = jwt.encode(
+        {"sub": "a@b", "iss": "ecofinds", "exp": int(time.time()) + 60, "jti": "j"},
+        "secret-one", algorithm="HS256", headers={"kid": "k1"}
+    )
+    assert await jwt_manager.verify_auth_token(retired) == (True, 200)
+    del jwt_config.jwt_keys["k1"]
+    assert await jwt_manager.verify_auth_token(retired) == (False, 401)
+    expired = jwt.encode(
+        {"sub": "a@b", "iss": "ecofinds", "exp": int(time.time()) - 60, "jti": "j"},
+        "secret-two", algorithm="HS256", headers={"kid": "k2"}
+    )
+    assert await jwt_manager.verify_auth_token(expired) == (False, 401)
+
+async def test_revoked_signed_tokens_are_rejected_by_every_worker(db, jwt_manager, jwt_config):
+    other = auth.AuthorizationManager(config=jwt_config, db=db, outbox=sms.SMSOutbox(db, config.SMS()))
+    try:
+        auth_token = await jwt_manager.generate_auth_token("a@b")
+        assert await other.verify_auth_token(auth_token) == (True, 200)
+        assert await jwt_manager.revoke_auth_token(auth_token)
+        assert await jwt_manager.verify_auth_token(auth_token) == (False, 401)
+        await other.revocation_list.refresh(force=True)
+        assert await other.verify_auth_token(auth_token) == (False, 401)
+    finally:
+        other.password_hasher.close()
+
+def test_jwt_mode_needs_a_known_active_key(db):
+    with pytest.raises(ValueError):
+        auth.AuthorizationManager(
+            config=config.Auth(token_mode="jwt", jwt_keys={"k1": "secret"}, jwt_active_key="k2"),
+            db=db,
+            outbox=sms.SMSOutbox(db, config.SMS())
+        )
@@ -0,0 +1,80 @@
+import asyncio
+import random
+import time
+import pytest
+from core import autocomplete, config
+
+pytestmark = pytest.mark.anyio
+
+async def test_rebuild_counts_titles_and_categories_in_one_pass(db):
+    await db["product_listings"].insert_many([
+        {"title": "Oak Chair", "category": "Furniture"},
+        {"title": "oak chair", "category": "Furniture"},
+        {"title": "Oak Table", "category": "Furniture"},
+        {"title": None},
+        {"category": "Garden"},
+    ])
+    suggestions = autocomplete.Autocomplete(config.Autocomplete())
+    assert await suggestions.rebuild(db["product_listings"]) == 4
+    assert suggestions.suggest("oak") == [
+        {"text": "Oak Chair", "kind": "title", "count": 2},
+        {"text": "Oak Table", "kind": "title", "count": 1},
+    ]
+    assert suggestions.suggest("fur") == [{"text": "Furniture", "kind": "category", "count": 3}]
+    assert suggestions.suggest("table")[0]["text"] == "Oak Table"
+
+async def test_rebuilds_wait_for_listing_changes(db, monkeypatch):
+    suggestions = autocomplete.Autocomplete(config.Autocomplete(refresh_interval=0.01, rebuild_interval=0.3))
+    rebuilds = []
+    async def rebuild(collection):
+        rebuilds.append(collection)
+        suggestions.ready = True
+        suggestions.built_at = time.monotonic()
+        return 0
+    monkeypatch.setattr(suggestions, "rebuild", rebuild)
+    suggestions.watched = True
+    task = asyncio.create_task(suggestions.run(db["product_listings"]))
+    await asyncio.sleep(0.1)
+    assert len(rebuilds) == 1
+    suggestions.changed = True
+    await asyncio.sleep(0.1)
+    assert len(rebuilds) == 1
+    await asyncio.sleep(0.3)
+    assert len(rebuilds) == 2
+    suggestions.watched = False
+    await asyncio.sleep(0.1)
+    assert len(rebuilds) > 3
+    task.cancel()
+
+def test_change_events_count_new_listings_without_a_rebuild():
+    suggestions = autocomplete.Autocomplete(config.Autocomplete())
+    suggestions.listing_changed({"operationType": "insert", "fullDocument": {"title": "Oak Chair", "category": "Furniture"}})
+    suggestions.listing_changed({"operationType": "update", "updateDescription": {"updatedFields": {"price": 5}, "removedFields": []}})
+    assert suggestions.changed is False
+    assert suggestions.suggest("oak") == [{"text": "Oak Chair", "kind": "title", "count": 1}]
+    suggestions.listing_changed({"operationType": "update", "updateDescription": {"updatedFields": {"title": "Pine Chair"}}})
+    assert suggestions.changed is True
+    suggestions.changed = False
+    suggestions.listing_changed({"operationType": "delete", "documentKey": {"_id": 1}})
+    assert suggestions.changed is True
+
+def test_lookups_match_a_brute_force_scan():
+    rng = random.Random(3)
+    words = ["oak", "table", "tab", "chair", "lamp", "lamb", "red", "re"]
+    index = autocomplete.PrefixIndex(max_suggestions=5, max_prefix_length=6, max_bytes=1 << 24)
+    weights = {}
+    for _ in range(400):
+        text = " ".join(rng.choices(words, k=rng.randint(1, 3)))
+        delta = rng.choice([1, 1, 2, -1])
+        index.add("title", text, text, delta)
+        weights[text] = max(weights.get(text, 0) + delta, 0)
+    for prefix in ["o", "ta", "tab", "lam", "red ta", "oak table", "chair lamp r", "x"]:
+        expected = sorted(
+            (
+                (-weight, text) for text, weight in weights.items()
+                if weight and any(key.startswith(prefix) for key in autocomplete.phrase_keys(text))
+            )
+        )[:5]
+        assert [(kind, text, weight) for kind, text, weight in index.lookup(prefix)] == [
+            ("title", text, -weight) for weight, text in expected
+        ]
@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from core import cache
+
+pytestmark = pytest.mark.anyio
+
+async def test_concurrent_calls_share_one_result():
+    flight = cache.SingleFlight()
+    release = asyncio.Event()
+    calls = []
+    async def load():
+        calls.append(1)
+        await release.wait()
+        return {"page": 1}
+    waiters = [asyncio.create_task(flight.do("q", load)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters)
+    assert len(calls) == 1 and flight.calls == 1 and flight.coalesced == 4
+    assert all(result is results[0] for result in results)
+    assert len(flight) == 0
+    assert await flight.do("q", load) == {"page": 1}
+    assert len(calls) == 2
+
+async def test_exceptions_are_shared_and_not_cached():
+    flight = cache.SingleFlight()
+    release = asyncio.Event()
+    async def fail():
+        await release.wait()
+        raise RuntimeError("down")
+    waiters = [asyncio.create_task(flight.do("q", fail)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    async def succeed():
+        return 1
+    assert await flight.do("q", succeed) == 1
+
+async def test_cancelled_callers_leave_the_shared_call_running():
+    flight = cache.SingleFlight()
+    release = asyncio.Event()
+    async def load():
+        await release.wait()
+        return 1
+    first = asyncio.create_task(flight.do("q", load))
+    second = asyncio.create_task(flight.do("q", load))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    assert await second == 1
+    with pytest.raises(asyncio.CancelledError):
+        await first
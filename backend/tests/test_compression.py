@@ -0,0 +1,74 @@
+import gzip
+import zlib
+import fastapi
+import pytest
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+from core import compression, config, metrics
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+@pytest.fixture
+def client(registry):
+    app = fastapi.FastAPI()
+    @app.get("/large")
+    async def large():
+        return JSONResponse({"items": ["listing"] * 500}, headers={"ETag": '"v1"'})
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            for i in range(50):
+                yield b'{"order": %d}\n' % i
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+    @app.get("/encoded")
+    async def encoded():
+        return Response(gzip.compress(b"x" * 5000), media_type="text/plain", headers={"Content-Encoding": "gzip"})
+    @app.get("/image")
+    async def image():
+        return Response(b"\x89PNG" * 1000, media_type="image/png")
+    app.add_middleware(compression.CompressionMiddleware, config=config.Server(compression_encodings=("gzip",)), registry=registry)
+    return TestClient(app)
+
+def raw(client, path, accept_encoding="gzip"):
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+def test_large_bodies_are_compressed(client, registry):
+    response, body = raw(client, "/large")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"v1"'
+    assert int(response.headers["content-length"]) == len(body)
+    assert b"listing" in gzip.decompress(body)
+    saved = registry._metrics["http_compression_bytes_saved_total"].value("gzip")
+    assert saved == registry._metrics["http_compression_bytes_in_total"].value("gzip") - len(body)
+
+def test_small_and_refused_responses_pass_through(client):
+    response, body = raw(client, "/small")
+    assert "content-encoding" not in response.headers and body == b'{"ok":true}'
+    response, _ = raw(client, "/large", "gzip;q=0, *")
+    assert "content-encoding" not in response.headers
+    response, _ = raw(client, "/large", "identity")
+    assert "content-encoding" not in response.headers
+
+def test_streams_are_compressed_chunk_by_chunk(client):
+    response, body = raw(client, "/stream")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    lines = zlib.decompress(body, 31).splitlines()
+    assert lines[0] == b'{"order": 0}' and len(lines) == 50
+
+def test_encoded_and_binary_responses_are_left_alone(client):
+    response, body = raw(client, "/encoded")
+    assert gzip.decompress(body) == b"x" * 5000
+    response, body = raw(client, "/image")
+    assert "content-encoding" not in response.headers and len(body) == 4000
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(ValueError):
+        compression.CompressionMiddleware(None, config.Server(compression_encodings=("lz4",)))
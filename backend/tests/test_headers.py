@@ -0,0 +1,22 @@
+from core import headers
+
+def test_refused_coding_is_not_picked_through_wildcard():
+    assert headers.negotiate_encoding("gzip;q=0, *", ("gzip",)) is None
+    assert headers.negotiate_encoding("gzip;q=0, *", ("br", "gzip")) == "br"
+    assert headers.negotiate_encoding("*;q=0.5, gzip;q=0", ("gzip", "br")) == "br"
+
+def test_preference_and_quality():
+    assert headers.negotiate_encoding("gzip, br", ("br", "gzip")) == "br"
+    assert headers.negotiate_encoding("gzip, br;q=0.5", ("br", "gzip")) == "gzip"
+    assert headers.negotiate_encoding("identity", ("br", "gzip")) is None
+    assert headers.negotiate_encoding(None, ("gzip",)) is None
+    assert headers.negotiate_encoding("GZIP;Q=1", ("gzip",)) == "gzip"
+
+def test_accepted_encodings_keeps_refusals():
+    assert headers.accepted_encodings("gzip;q=0, br;q=0.8, zstd;q=bad") == {"gzip": 0.0, "br": 0.8, "zstd": 0.0}
+
+def test_etag_matches_weakly():
+    assert headers.etag_matches('W/"a", "b"', '"a"')
+    assert headers.etag_matches("*", '"a"')
+    assert not headers.etag_matches('"c"', 'W/"a"')
+    assert not headers.etag_matches(None, '"a"')
@@ -0,0 +1,53 @@
+import pytest
+from core import config, ingest, product
+
+pytestmark = pytest.mark.anyio
+
+async def chunks(data: bytes, size: int = 7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+async def parse(text: str, format: str = "csv", max_record_size: int = 1000) -> list:
+    return [item async for item in ingest.iter_records(chunks(text.encode()), format, max_record_size)]
+
+async def test_quoted_fields_span_lines():
+    rows = await parse('title,description\r\nChair,"Oak,\r\nwith ""arms"""\r\n\r\nLamp,Brass\r\n')
+    assert rows == [
+        (2, {"title": "Chair", "description": 'Oak,\nwith "arms"'}),
+        (5, {"title": "Lamp", "description": "Brass"}),
+    ]
+
+async def test_quotes_inside_unquoted_fields_are_literal():
+    text = "title,price\n" + "".join(f'{size}" monitor,{size}\n' for size in (24, 27, 32, 40, 55))
+    rows = await parse(text)
+    assert [row for _, row in rows] == [{"title": f'{size}" monitor', "price": str(size)} for size in (24, 27, 32, 40, 55)]
+    assert [number for number, _ in rows] == [2, 3, 4, 5, 6]
+
+async def test_truncated_final_record_is_an_error():
+    rows = await parse('title,price\nChair,10\nLamp,"12\n')
+    assert rows[0] == (2, {"title": "Chair", "price": "10"})
+    assert rows[1][0] == 3 and rows[1][1].startswith("Invalid CSV")
+    assert len(rows) == 2
+
+async def test_wrong_field_counts_keep_their_row_numbers():
+    rows = await parse("title,price\nChair\nLamp,12\n")
+    assert rows == [(2, "Expected 2 fields, got 1."), (3, {"title": "Lamp", "price": "12"})]
+
+async def test_unterminated_quote_stops_at_the_record_size():
+    text = 'title,price\nChair,"10\n' + "Lamp,12\n" * 10000
+    rows = await parse(text, max_record_size=200)
+    assert rows == [(2, "Record exceeds 200 characters; import stopped.")]
+
+async def test_long_ndjson_lines_stop_the_import():
+    text = '{"title": "Chair"}\n{"title": "' + "x" * 300 + '"}\n'
+    rows = await parse(text, "ndjson", max_record_size=200)
+    assert rows == [(1, {"title": "Chair"}), (2, "Line exceeds 200 characters; import stopped.")]
+
+async def test_import_reports_rows_and_errors(db):
+    manager = product.ProductListingManager(db, config.Search(), config.ListingCache(change_stream=False))
+    text = 'title,price,category\n27" monitor,120,electronics\nLamp,-1,home\n"Desk\nlamp",15,home\n'
+    report = await manager.import_listings(chunks(text.encode()), "csv", seller_email="a@b")
+    assert (report.rows, report.inserted, report.failed) == (3, 2, 1)
+    assert report.errors[0]["row"] == 3
+    titles = sorted(listing["title"] for listing in await db["product_listings"].find({}).to_list(None))
+    assert titles == ['27" monitor', "Desk\nlamp"]
@@ -0,0 +1,85 @@
+import types
+import fastapi
+import httpx
+import pytest
+from core import config, container, metrics
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def services():
+    services = container.Container(config.Config({"mongodb": {"uri": "mongomock://", "db": "test"}}))
+    yield services
+    await services.close()
+
+def samples(registry: metrics.Registry) -> dict[str, str]:
+    return dict(line.rsplit(" ", 1) for line in registry.render().splitlines() if not line.startswith("#"))
+
+def test_histograms_render_cumulative_buckets():
+    registry = metrics.Registry()
+    latency = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(seconds, "/a")
+    exported = samples(registry)
+    assert exported['latency_seconds_bucket{route="/a",le="0.1"}'] == "2"
+    assert exported['latency_seconds_bucket{route="/a",le="1"}'] == "3"
+    assert exported['latency_seconds_bucket{route="/a",le="+Inf"}'] == "4"
+    assert exported['latency_seconds_count{route="/a"}'] == "4"
+    assert float(exported['latency_seconds_sum{route="/a"}']) == pytest.approx(3.65)
+    assert "# TYPE latency_seconds histogram" in registry.render()
+
+def test_counter_labels_are_escaped_and_names_unique():
+    registry = metrics.Registry()
+    errors = registry.counter("errors_total", "Errors.", ("reason",))
+    errors.inc('say "hi"\n')
+    errors.inc('say "hi"\n', amount=2)
+    assert samples(registry) == {'errors_total{reason="say \\"hi\\"\\n"}': "3"}
+    with pytest.raises(ValueError):
+        registry.counter("errors_total", "Errors.")
+
+async def test_requests_are_recorded_by_route_with_their_commands():
+    registry = metrics.Registry()
+    listener = metrics.CommandMetrics(registry)
+    app = fastapi.FastAPI()
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: str):
+        command = {"find": "items", "filter": {"item_id": item_id}}
+        started = types.SimpleNamespace(connection_id=("db", 27017), request_id=1, command_name="find", command=command)
+        listener.started(started)
+        listener.succeeded(types.SimpleNamespace(connection_id=("db", 27017), request_id=1, duration_micros=2000))
+        return {}
+    app.add_middleware(metrics.MetricsMiddleware, registry=registry)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        assert (await client.get("/items/1")).status_code == 200
+        assert (await client.get("/items/2")).status_code == 200
+        assert (await client.get("/missing")).status_code == 404
+    exported = samples(registry)
+    assert exported['http_requests_total{route="/items/{item_id}",method="GET",status="200"}'] == "2"
+    assert exported['http_requests_total{route="unmatched",method="GET",status="404"}'] == "1"
+    assert exported['mongo_commands_total{route="/items/{item_id}",command="find",collection="items"}'] == "2"
+    assert exported['mongo_commands_per_request_bucket{route="/items/{item_id}",le="1"}'] == "2"
+    assert exported['mongo_command_duration_seconds_count{command="find",collection="items"}'] == "2"
+    assert exported['http_requests_in_flight'] == "0"
+
+async def test_cache_statistics_are_exported(services):
+    registry = metrics.Registry()
+    services.register_metrics(registry)
+    listing_cache = services.product_manager.cache
+    listing_cache.max_size = 2
+    for key in ("a", "b", "c"):
+        listing_cache.set(key, {})
+    listing_cache.set("d", {}, ttl=-1)
+    listing_cache._entries["c"] = (0, {})
+    listing_cache.get("b")
+    listing_cache.get("c")
+    listing_cache.get("a")
+    listing_cache.invalidate("b")
+    exported = samples(registry)
+    assert exported['cache_evictions_total{cache="listing"}'] == "1"
+    assert exported['cache_expirations_total{cache="listing"}'] == "1"
+    assert exported['cache_invalidations_total{cache="listing"}'] == "1"
+    assert exported['cache_lookups_total{cache="listing",result="hit"}'] == "1"
+    assert exported['cache_lookups_total{cache="listing",result="miss"}'] == "2"
+    assert float(exported['cache_hit_ratio{cache="listing"}']) == pytest.approx(1 / 3)
+    assert exported['cache_entries{cache="listing"}'] == "0"
+    assert exported['cache_evictions_total{cache="search"}'] == "0"
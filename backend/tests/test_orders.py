@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from core import cart, database, orders
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def managers(db):
+    registry = database.IndexRegistry()
+    order_manager = orders.OrderManager(db)
+    order_manager.register_indexes(registry)
+    await registry.apply(db)
+    await db["product_listings"].insert_many([{"product_id": f"p{i}"} for i in range(1, 5)])
+    return cart.CartManager(db), order_manager
+
+async def test_retry_after_new_items_returns_original_order(managers):
+    carts, order_manager = managers
+    await carts.add_to_cart("a@b", "p1")
+    first, code = await order_manager.checkout("a@b", "K1")
+    assert code == 200 and first["products"] == ["p1"]
+    await carts.add_to_cart("a@b", "p2")
+    second, code = await order_manager.checkout("a@b", "K2")
+    assert code == 200 and second["products"] == ["p2"]
+    await carts.add_to_cart("a@b", "p3")
+    retry, code = await order_manager.checkout("a@b", "K1")
+    assert code == 200 and retry == first
+    # p3 was not claimed by the retry and is still in the cart.
+    assert (await carts.get_cart_items("a@b"))[0]["products"] == ["p3"]
+    third, code = await order_manager.checkout("a@b", "K3")
+    assert code == 200 and third["products"] == ["p3"]
+    assert await order_manager.db["orders"].count_documents({"email": "a@b"}) == 3
+
+async def test_unplaced_claim_is_ordered_before_a_new_checkout(managers):
+    carts, order_manager = managers
+    await carts.add_to_cart("a@b", "p1")
+    # A checkout that claimed the cart and died before placing its order.
+    await order_manager.db["carts"].update_one(
+        {"email": "a@b"},
+        {"$set": {"checkout": {"key": "K1", "products": ["p1"]}, "products": ["p2"]}}
+    )
+    second, code = await order_manager.checkout("a@b", "K2")
+    assert code == 200 and second["products"] == ["p2"]
+    first, code = await order_manager.checkout("a@b", "K1")
+    assert code == 200 and first["products"] == ["p1"]
+    assert await order_manager.db["orders"].count_documents({"email": "a@b"}) == 2
+
+async def test_retry_returns_same_order(managers):
+    carts, order_manager = managers
+    await carts.add_to_cart("a@b", "p1")
+    order, _ = await order_manager.checkout("a@b", "K1")
+    assert await order_manager.checkout("a@b", "K1") == (order, 200)
+    assert await order_manager.db["orders"].count_documents({}) == 1
+
+async def test_empty_cart(managers):
+    _, order_manager = managers
+    assert await order_manager.checkout("a@b", "K1") == (None, 404)
+
+async def test_deleted_listings_are_not_ordered(managers):
+    carts, order_manager = managers
+    await carts.add_to_cart("a@b", "p1")
+    await carts.add_to_cart("a@b", "gone")
+    order, code = await order_manager.checkout("a@b", "K1")
+    assert code == 200 and order["products"] == ["p1"]
+    assert (await carts.get_cart_items("a@b"))[0]["products"] == []
+    await carts.add_to_cart("a@b", "gone")
+    assert await order_manager.checkout("a@b", "K2") == (None, 409)
+
+async def test_invalid_key(managers):
+    _, order_manager = managers
+    with pytest.raises(ValueError):
+        await order_manager.checkout("a@b", "not a key!")
+
+async def test_concurrent_checkouts_with_one_key_place_one_order(managers):
+    carts, order_manager = managers
+    await carts.add_to_cart("a@b", "p1")
+    await carts.add_to_cart("a@b", "p2")
+    results = await asyncio.gather(*(order_manager.checkout("a@b", "K1") for _ in range(3)))
+    assert {code for _, code in results} == {200}
+    assert len({order["order_id"] for order, _ in results}) == 1
+    assert await order_manager.db["orders"].count_documents({}) == 1
+    assert (await carts.get_cart_items("a@b"))[0]["products"] == []
+
+async def test_claim_left_after_its_order_was_placed_is_released(managers):
+    carts, order_manager = managers
+    await carts.add_to_cart("a@b", "p1")
+    order, _ = await order_manager.checkout("a@b", "K1")
+    # The same checkout, as if it had died after writing the order.
+    claim = await order_manager.db["orders"].find_one({"order_id": order["order_id"]})
+    await order_manager.db["carts"].update_one(
+        {"email": "a@b"},
+        {"$set": {"checkout": {"key": "K1", "claim": claim["claim"], "products": ["p1"]}, "products": ["p2"]}}
+    )
+    assert await order_manager.checkout("a@b", "K1") == (order, 200)
+    second, code = await order_manager.checkout("a@b", "K2")
+    assert code == 200 and second["products"] == ["p2"]
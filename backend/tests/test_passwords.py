@@ -0,0 +1,22 @@
+import pytest
+from core import config, passwords
+
+pytestmark = pytest.mark.anyio
+
+def test_cores_are_shared_between_server_workers(monkeypatch):
+    monkeypatch.setattr(config, "available_cores", lambda: 8)
+    assert passwords.default_workers(1) == 8
+    assert passwords.default_workers(4) == 2
+    assert passwords.default_workers(16) == 1
+    assert passwords.PasswordHasher(config.Auth(), server_workers=8).workers == 1
+    assert passwords.PasswordHasher(config.Auth(password_workers=3), server_workers=8).workers == 3
+
+async def test_hashes_in_a_pool_that_does_not_fork():
+    hasher = passwords.PasswordHasher(config.Auth(password_hash_n=16, password_workers=1))
+    try:
+        encoded = await hasher.hash("hunter2")
+        assert await hasher.verify("hunter2", encoded)
+        assert not await hasher.verify("hunter3", encoded)
+        assert hasher._executor._mp_context.get_start_method() in ("forkserver", "spawn")
+    finally:
+        hasher.close()
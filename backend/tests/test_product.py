@@ -0,0 +1,79 @@
+import datetime
+import pytest
+from core import config, database, product
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def manager(db):
+    return product.ProductListingManager(
+        db=db,
+        config=config.Search(),
+        cache_config=config.ListingCache(change_stream=False)
+    )
+
+@pytest.mark.filterwarnings("error::DeprecationWarning")
+async def test_created_at_is_naive_utc(manager):
+    await manager.create_product_listing("Chair", "Oak chair.", 10, "a@b", "furniture", [])
+    listing = await manager.db["product_listings"].find_one({})
+    assert listing["created_at"].tzinfo is None
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    assert abs(listing["created_at"] - now).total_seconds() < 5
+
+async def test_newest_first_pages_see_every_listing_once(manager):
+    for i in range(7):
+        await manager.create_product_listing(f"Chair {i}", "Oak chair.", 10 + i, "a@b", "furniture", [])
+    seen = []
+    after = None
+    while True:
+        listings, after, _ = await manager.search_product_listings(sort="-created_at", after=after, limit=3)
+        seen.extend(listing["product_id"] for listing in listings)
+        if after is None:
+            break
+    assert len(seen) == len(set(seen)) == 7
+
+async def test_cache_refills_read_the_primary():
+    mongodb = config.MongoDB(uri="mongomock://", db="test", read_preferences={"product": "secondaryPreferred"})
+    db = database.connect(mongodb).for_manager("product")
+    manager = product.ProductListingManager(db=db, config=config.Search(), cache_config=config.ListingCache(change_stream=False))
+    assert db["product_listings"].delegate.read_preference.mongos_mode == "secondaryPreferred"
+    assert manager.cache_source.delegate.read_preference.mongos_mode == "primary"
+    await manager.create_product_listing("Chair", "Oak chair.", 10, "a@b", "furniture", [])
+    listing = await manager.db["product_listings"].find_one({})
+    assert (await manager.get_product_listing(listing["product_id"]))["title"] == "Chair"
+
+async def test_queries_without_terms_do_not_share_the_browse_page(manager):
+    await manager.create_product_listing("Chair", "Oak chair.", 10, "a@b", "furniture", [])
+    for query in ("the", "!!!"):
+        page, _ = await manager.cached_search(query=query)
+        assert page["results"] == []
+    for query in ("", "   "):
+        page, _ = await manager.cached_search(query=query)
+        assert [listing["title"] for listing in page["results"]] == ["Chair"]
+    page, _ = await manager.cached_search(query="  CHAIRS ")
+    assert [listing["title"] for listing in page["results"]] == ["Chair"]
+
+async def test_price_facets_keep_outliers_out_of_the_top_bucket(db):
+    manager = product.ProductListingManager(
+        db=db,
+        config=config.Search(facet_price_boundaries=(0, 10, 100)),
+        cache_config=config.ListingCache(change_stream=False)
+    )
+    for price in (-5, 5, 30, 2000, 150):
+        await manager.create_product_listing("Chair", "Oak chair.", price, "a@b", "furniture", [])
+    _, _, facets = await manager.search_product_listings(facets=True)
+    assert facets["price"] == [
+        {"min": 0, "max": 10, "count": 1},
+        {"min": 10, "max": 100, "count": 1},
+        {"min": 100, "max": None, "count": 2},
+    ]
+    assert facets["price_other"] == 1
+
+@pytest.mark.parametrize("boundaries", [(), (10,), (0, 50, 10), (0, 0, 10)])
+def test_price_facet_boundaries_are_checked(db, boundaries):
+    with pytest.raises(ValueError):
+        product.ProductListingManager(
+            db=db,
+            config=config.Search(facet_price_boundaries=boundaries),
+            cache_config=config.ListingCache(change_stream=False)
+        )
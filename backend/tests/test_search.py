@@ -0,0 +1,124 @@
+import random
+import pytest
+from core import config, product, search
+
+pytestmark = pytest.mark.anyio
+
+WORDS = "oak walnut chair table lamp red blue vintage shirt cotton wool desk".split()
+
+@pytest.fixture
+async def index(db):
+    index = search.SearchIndex(db, config.Search())
+    rng = random.Random(1)
+    await index.index_many([
+        {
+            "product_id": f"p{i:04d}",
+            "title": " ".join(rng.choices(WORDS, k=3)),
+            "description": " ".join(rng.choices(WORDS, k=rng.randint(2, 30))),
+            "category": rng.choice(WORDS),
+        }
+        for i in range(600)
+    ])
+    return index
+
+async def test_capped_postings_keep_the_best_single_term_matches(index):
+    exact = await index.search("walnut", 50)
+    index.config.max_postings_per_term = 60
+    capped = await index.search("walnut", 50)
+    assert capped == exact
+
+async def test_capped_postings_bound_the_candidates(index):
+    index.config.max_postings_per_term = 40
+    ranked = await index.search("oak chair")
+    assert 40 <= len(ranked) <= 80
+    assert ranked == sorted(ranked, key=lambda item: (-item[1], item[0]))
+
+async def test_unknown_terms(index):
+    assert await index.search("zeppelin") == []
+    assert await index.search("the of") == []
+
+@pytest.fixture
+async def manager(db):
+    manager = product.ProductListingManager(
+        db=db,
+        config=config.Search(max_candidates=50, max_postings_per_term=40, max_filter_candidates=100),
+        cache_config=config.ListingCache(change_stream=False)
+    )
+    for i in range(60):
+        await manager.create_product_listing(
+            title=f"Shirt {i}", description="Cotton shirt.", price=100 + i,
+            seller_email="a@b", category="Clothing", pictures=[]
+        )
+    # Weak matches that rank below the 50 best, but are the cheapest.
+    for i in range(3):
+        await manager.create_product_listing(
+            title=f"Cushion {i}", description="Covers sewn from an old shirt, " + "soft " * 30,
+            price=5 + i, seller_email="c@d", category="Home", pictures=[]
+        )
+    return manager
+
+async def test_filters_see_matches_beyond_the_relevance_candidates(manager):
+    listings, _, _ = await manager.search_product_listings(query="shirt", category="Home")
+    assert sorted(listing["title"] for listing in listings) == ["Cushion 0", "Cushion 1", "Cushion 2"]
+
+async def test_price_sort_and_paging_cover_every_match(manager):
+    seen = []
+    after = None
+    while True:
+        listings, after, _ = await manager.search_product_listings(query="shirt", sort="price", after=after, limit=20)
+        seen.extend(listing["price"] for listing in listings)
+        if after is None:
+            break
+    assert len(seen) == 63
+    assert seen == sorted(seen) and seen[0] == 5
+
+async def test_facets_count_every_match(manager):
+    _, _, facets = await manager.search_product_listings(query="shirt", facets=True)
+    assert {bucket["value"]: bucket["count"] for bucket in facets["categories"]} == {"Clothing": 60, "Home": 3}
+    assert facets["approximate"] is False
+
+async def test_facets_are_approximate_when_capped(manager):
+    manager.config.max_filter_candidates = 10
+    _, _, facets = await manager.search_product_listings(query="shirt", facets=True)
+    assert facets["approximate"] is True
+    assert sum(bucket["count"] for bucket in facets["categories"]) == 10
+
+async def test_unfiltered_relevance_ranks_best_matches_first(manager):
+    listings, after, _ = await manager.search_product_listings(query="shirt", limit=10)
+    assert len(listings) == 10 and after is not None
+    assert all(listing["category"] == "Clothing" for listing in listings)
+
+async def test_filters_apply_before_the_candidate_cap(manager):
+    manager.config.max_filter_candidates = 10
+    listings, _, facets = await manager.search_product_listings(query="shirt", category="Home", facets=True)
+    assert sorted(listing["title"] for listing in listings) == ["Cushion 0", "Cushion 1", "Cushion 2"]
+    assert facets["approximate"] is False
+    listings, _, _ = await manager.search_product_listings(query="shirt", price_max=50, sort="price")
+    assert [listing["price"] for listing in listings] == [5, 6, 7]
+
+async def test_filtered_scores_use_the_global_document_frequency(manager):
+    ranked = await manager.search_index.search("shirt cushion", 100, max_postings=100)
+    filtered = await manager.search_index.search("shirt cushion", 100, max_postings=100, filters={"category": "Home"})
+    assert filtered == [item for item in ranked if item[0] in {product_id for product_id, _ in filtered}]
+    assert len(filtered) == 3
+
+async def test_upgrade_computes_missing_impacts(index):
+    def impacts(postings):
+        return {(posting["term"], posting["product_id"]): posting["impact"] for posting in postings}
+    original = impacts(await index.postings.find({}).to_list(None))
+    await index.postings.update_many({"product_id": {"$lt": "p0300"}}, {"$unset": {"impact": ""}})
+    await index.stats.update_one({"_id": "stats"}, {"$unset": {"version": ""}})
+    assert await index.upgrade() == await index.postings.count_documents({"product_id": {"$lt": "p0300"}})
+    upgraded = impacts(await index.postings.find({}).to_list(None))
+    assert upgraded.keys() == original.keys()
+    assert all(upgraded[key] == pytest.approx(impact) for key, impact in original.items())
+    assert (await index.stats.find_one({"_id": "stats"}))["version"] == 1
+    assert await index.upgrade() == 0
+
+async def test_indexes_without_filter_fields_ignore_filters(index):
+    assert index.version == search.INDEX_VERSION
+    assert await index.search("oak", filters={"category": "nothing"}) == []
+    await index.stats.update_one({"_id": "stats"}, {"$set": {"version": 1}})
+    await index.upgrade()
+    assert index.version == 1
+    assert await index.search("oak", filters={"category": "nothing"}) == await index.search("oak")
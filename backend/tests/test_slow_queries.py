@@ -0,0 +1,99 @@
+import asyncio
+import types
+import pymongo.errors
+import pytest
+from core import config, database
+
+pytestmark = pytest.mark.anyio
+
+def run_command(recorder, command: dict, duration_ms: float, request_id: int = 1, reply=None, failure=None):
+    name = next(iter(command))
+    started = types.SimpleNamespace(connection_id=("db", 27017), request_id=request_id, command=command)
+    finished = types.SimpleNamespace(
+        connection_id=("db", 27017),
+        request_id=request_id,
+        command_name=name,
+        database_name="test",
+        duration_micros=int(duration_ms * 1000),
+        reply=reply or {},
+        failure=failure,
+    )
+    recorder.started(started)
+    if failure is None:
+        recorder.succeeded(finished)
+    else:
+        recorder.failed(finished)
+
+class ExplainingDatabase:
+    def __init__(self, error: Exception | None = None):
+        self.error = error
+        self.explained = []
+    async def command(self, command: dict) -> dict:
+        self.explained.append(command)
+        if self.error is not None:
+            raise self.error
+        return {
+            "queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "email_1"}}},
+            "executionStats": {"totalDocsExamined": 1, "totalKeysExamined": 1, "nReturned": 1, "executionTimeMillis": 3},
+        }
+
+def test_redact_keeps_the_shape_only():
+    assert database.redact({"email": "a@b", "age": {"$gte": 18}, "$or": [{"x": 1}, {"y": "z"}]}) == {
+        "email": "?", "age": {"$gte": "?"}, "$or": [{"x": 1}, {"y": "?"}]
+    }
+    assert database.redact({"tags": ["a", "b"], "created_at": -1}) == {"tags": "?", "created_at": -1}
+
+def test_only_slow_commands_are_recorded_redacted():
+    recorder = database.SlowQueryRecorder(config.SlowQueryLog(threshold_ms=50, explain=False))
+    run_command(recorder, {"find": "users", "filter": {"email": "a@b"}, "lsid": {}}, 10, request_id=1)
+    run_command(
+        recorder,
+        {"find": "users", "filter": {"email": "a@b"}, "sort": {"created_at": -1}},
+        80,
+        request_id=2,
+        reply={"cursor": {"firstBatch": [{}, {}]}}
+    )
+    assert recorder.seen == 1
+    [record] = recorder.recent()
+    assert record["collection"] == "users" and record["command"] == "find"
+    assert record["shape"] == {"filter": {"email": "?"}, "sort": {"created_at": -1}}
+    assert record["returned"] == 2 and record["error"] is None
+
+def test_errors_are_recorded_without_their_message():
+    recorder = database.SlowQueryRecorder(config.SlowQueryLog(threshold_ms=0, explain=False))
+    failure = {"ok": 0, "code": 11000, "codeName": "DuplicateKey", "errmsg": "E11000 duplicate key: { email: \"a@b\" }"}
+    run_command(recorder, {"insert": "users", "documents": [{"email": "a@b"}]}, 5, failure=failure)
+    [record] = recorder.recent()
+    assert record["error"] == "DuplicateKey (11000)"
+    assert "a@b" not in repr(record)
+
+def test_sampling_counts_every_slow_command():
+    recorder = database.SlowQueryRecorder(config.SlowQueryLog(threshold_ms=0, sample_rate=0.0, explain=False))
+    for request_id in range(5):
+        run_command(recorder, {"find": "users", "filter": {}}, 1, request_id=request_id)
+    assert recorder.seen == 5 and recorder.recent() == []
+
+async def test_slow_reads_are_explained_in_the_background():
+    recorder = database.SlowQueryRecorder(config.SlowQueryLog(threshold_ms=0))
+    db = ExplainingDatabase()
+    task = asyncio.create_task(recorder.run(db))
+    await asyncio.sleep(0)
+    run_command(recorder, {"find": "users", "filter": {"email": "a@b"}, "lsid": {}, "$db": "test"}, 1)
+    for _ in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+    [record] = recorder.recent()
+    assert db.explained == [{"explain": {"find": "users", "filter": {"email": "a@b"}}, "verbosity": "executionStats"}]
+    assert record["explain"]["plan"] == ["FETCH", "IXSCAN email_1"]
+    assert record["explain"]["collection_scan"] is False
+
+async def test_explain_errors_are_recorded_without_their_message():
+    recorder = database.SlowQueryRecorder(config.SlowQueryLog(threshold_ms=0))
+    failure = pymongo.errors.OperationFailure("bad value a@b", code=2, details={"code": 2, "codeName": "BadValue", "errmsg": "bad value a@b"})
+    task = asyncio.create_task(recorder.run(ExplainingDatabase(failure)))
+    await asyncio.sleep(0)
+    run_command(recorder, {"find": "users", "filter": {"email": "a@b"}}, 1)
+    for _ in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+    assert recorder.recent()[0]["explain"] == {"error": "BadValue (2)"}
@@ -0,0 +1,52 @@
+import asyncio
+import datetime
+import pytest
+from core import config, database, sms
+
+pytestmark = pytest.mark.anyio
+
+async def drain(outbox: sms.SMSOutbox, provider, done):
+    task = asyncio.create_task(outbox.run(provider))
+    try:
+        for _ in range(200):
+            if await done():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("The outbox did not drain.")
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+async def test_queued_messages_are_sent(db):
+    outbox = sms.SMSOutbox(db, config.SMS(provider="fake", workers=1, poll_interval=0.01))
+    provider = sms.FakeSMSClient()
+    message_ids = [await outbox.enqueue(f"+1555000{n}", f"OTP {n}") for n in range(5)]
+    async def sent():
+        return await db["sms_outbox"].count_documents({"status": "sent"}) == 5
+    await drain(outbox, provider, sent)
+    assert sorted(message["body"] for message in provider.sent) == [f"OTP {n}" for n in range(5)]
+    status = await outbox.get_status(message_ids[0])
+    assert status["status"] == "sent" and status["attempts"] == 1
+
+async def test_failed_sends_are_retried_until_attempts_run_out(db):
+    outbox = sms.SMSOutbox(db, config.SMS(provider="fake", workers=1, max_attempts=3, backoff_base=0, poll_interval=0.01))
+    message_id = await outbox.enqueue("+15550000", "OTP")
+    async def failed():
+        return (await outbox.get_status(message_id))["status"] == "failed"
+    await drain(outbox, sms.FakeSMSClient(failure_rate=1.0), failed)
+    status = await outbox.get_status(message_id)
+    assert status["attempts"] == 3
+    assert status["last_error"] == "Simulated SMS provider failure."
+
+async def test_expired_leases_are_claimed_again(db):
+    outbox = sms.SMSOutbox(db, config.SMS(provider="fake"))
+    now = database.utcnow()
+    await db["sms_outbox"].insert_many([
+        {"message_id": "stuck", "to": "+1", "body": "a", "status": "sending", "attempts": 1,
+         "next_attempt_at": now, "lease_until": now - datetime.timedelta(seconds=1)},
+        {"message_id": "leased", "to": "+1", "body": "b", "status": "sending", "attempts": 1,
+         "next_attempt_at": now, "lease_until": now + datetime.timedelta(seconds=60)},
+    ])
+    message = await outbox._claim()
+    assert message["message_id"] == "stuck" and message["attempts"] == 2
+    assert await outbox._claim() is None
@@ -0,0 +1,58 @@
+import gzip
+import fastapi
+import pytest
+from fastapi.testclient import TestClient
+from core import config, static
+
+@pytest.fixture
+def client(tmp_path):
+    source = tmp_path / "frontend"
+    (source / "home").mkdir(parents=True)
+    (source / "404").mkdir()
+    (source / "home" / "index.html").write_text('<link href="/style.css" rel="stylesheet">' + "<p>Home</p>" * 200)
+    (source / "404" / "index.html").write_text("<p>Lost</p>")
+    (source / "style.css").write_text("body { color: black; }\n" * 100)
+    static.build(str(source), str(tmp_path / "build"))
+    app = fastapi.FastAPI()
+    @app.get("/a/items/")
+    async def items():
+        return {"items": []}
+    site = static.StaticSite(config.Static(directory=str(tmp_path / "build")))
+    app.router.default = static.fallback(site, app.router.not_found)
+    return TestClient(app)
+
+def test_api_routing_comes_first(client):
+    response = client.post("/a/items/")
+    assert response.status_code == 405 and response.headers["allow"] == "GET"
+    response = client.get("/a/items", follow_redirects=False)
+    assert response.status_code == 307 and response.headers["location"].endswith("/a/items/")
+    response = client.get("/a/nope")
+    assert response.status_code == 404 and response.json() == {"detail": "Not Found"}
+
+def test_pages_and_assets(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200 and "Home" in response.text
+    assert response.headers["content-encoding"] == "gzip" and response.headers["cache-control"] == static.REVALIDATE
+    stylesheet = response.text.split('href="')[1].split('"')[0]
+    assert stylesheet != "/style.css"
+    response = client.get(stylesheet, headers={"Accept-Encoding": "identity"})
+    assert response.headers["cache-control"] == static.IMMUTABLE and "content-encoding" not in response.headers
+    revalidated = client.get(stylesheet, headers={"Accept-Encoding": "identity", "If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+
+def test_refused_gzip_gets_identity(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip;q=0, *"})
+    assert "content-encoding" not in response.headers
+
+def test_unknown_page(client):
+    response = client.get("/missing")
+    assert response.status_code == 404 and "Lost" in response.text
+    assert client.post("/home/").status_code == 405
+
+def test_build_writes_gzip_variants(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "app.js").write_text("console.log(1);\n" * 200)
+    manifest = static.build(str(tmp_path / "src"), str(tmp_path / "out"))
+    entry = manifest["files"]["app.js"]
+    compressed = (tmp_path / "out" / entry["encodings"]["gzip"]).read_bytes()
+    assert gzip.decompress(compressed) == (tmp_path / "out" / entry["file"]).read_bytes()